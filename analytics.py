@@ -0,0 +1,158 @@
+"""
+摘要前的统计分析 - daily_report.py 用
+一次遍历全部消息，算出各频道/帖子和各小时的消息分布、回复关系、分享的链接、问答对和高频词，
+整理成紧凑的表格交给模型；这些不必再让模型从原文里数，原文预算也可以相应省下来
+"""
+
+import re
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+from discord_client import DISCORD_EPOCH
+
+LINK_RE = re.compile(r"https?://[^\s<>()\[\]「」，。！？]+")
+QUESTION_RE = re.compile(r"[?？]\s*$|^(请问|求助|有没有人|有人知道|为什么|为啥|怎么|如何)|(怎么|如何|为什么|为啥|能不能|是不是|吗|么)[?？。\s]*$")
+EN_WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9_+\-]{2,}")
+CJK_RUN_RE = re.compile(r"[\u4e00-\u9fff]{2,}")
+# 含这些字的二字词基本都是虚词搭配，不算话题词
+STOP_CHARS = set("的了是在我你他她它们这那就都也还和与及或而吗呢吧啊呀哦嗯么个一不有没人到说要会能很太更又被把让给对着过怎什为以看里")
+EN_STOPWORDS = {
+    "the", "and", "for", "you", "are", "but", "not", "this", "that", "with", "have", "has", "was", "can",
+    "just", "what", "how", "why", "when", "who", "all", "any", "its", "it's", "from", "they", "your", "our",
+    "there", "here", "then", "than", "been", "will", "would", "should", "could", "also", "about", "into",
+    "http", "https", "www", "com",
+}
+SNIPPET_CHARS = 80
+
+
+def section_title(header):
+    """去掉标题块上下的 ===== 分隔行，只留 帖子: xxx / 频道: #xxx 这一行"""
+    lines = [line for line in header.split("\n") if line.strip("= ")]
+    return lines[0] if lines else header
+
+
+def snippet(text, limit=SNIPPET_CHARS):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def terms(text):
+    """英文单词 + 中文二字词；同一条消息里的重复词只算一次"""
+    found = {w.lower() for w in EN_WORD_RE.findall(text)} - EN_STOPWORDS
+    for run in CJK_RUN_RE.findall(text):
+        for i in range(len(run) - 1):
+            pair = run[i:i + 2]
+            if pair[0] not in STOP_CHARS and pair[1] not in STOP_CHARS:
+                found.add(pair)
+    return found
+
+
+def analyze(sections, top_n=10):
+    """[(标题, [MessageRecord...])] → 统计结果 dict；每个帖子内消息按 id 升序，一次遍历完成"""
+    channels = []
+    hours = [0] * 24
+    weekdays = [0] * 7
+    author_of = {}
+    reply_pairs = Counter()
+    replied = Counter()
+    domains = Counter()
+    links = []
+    seen_links = set()
+    term_counts = Counter()
+    # 问题消息 id → 问题摘录；已经配上回答的问题 id
+    questions = {}
+    answered_ids = set()
+    qa = []
+    total = 0
+    utc_offset = time.localtime().tm_gmtoff
+
+    for header, msgs in sections:
+        authors = set()
+        # 没有显式回复时，把同一帖子里下一条别人发的消息当作回答
+        open_question = None
+        for m in msgs:
+            total += 1
+            authors.add(m.author)
+            # 按固定时区偏移换算，比逐条 datetime.fromtimestamp 快得多；1970-01-01 是星期四
+            local = ((m.id >> 22) + DISCORD_EPOCH) // 1000 + utc_offset
+            hours[local // 3600 % 24] += 1
+            weekdays[(local // 86400 + 3) % 7] += 1
+            author_of[m.id] = m.author
+            content = m.content
+
+            answered = None
+            if m.reference_id:
+                target = author_of.get(m.reference_id)
+                if target and target != m.author:
+                    reply_pairs[(m.author, target)] += 1
+                    replied[target] += 1
+                    answered = m.reference_id
+            elif open_question is not None and author_of[open_question] != m.author \
+                    and not QUESTION_RE.search(m.content.strip()):
+                answered = open_question
+            if answered in questions and answered not in answered_ids:
+                answered_ids.add(answered)
+                qa.append((author_of[answered], questions[answered], m.author, snippet(content)))
+            if open_question is not None and author_of[open_question] != m.author:
+                open_question = None
+
+            if not content:
+                continue
+            for url in LINK_RE.findall(content):
+                domain = urlparse(url).netloc.lower().removeprefix("www.")
+                domains[domain] += 1
+                if url not in seen_links:
+                    seen_links.add(url)
+                    links.append((url, m.author))
+            if QUESTION_RE.search(content.strip()):
+                questions[m.id] = snippet(content)
+                open_question = m.id
+            term_counts.update(terms(LINK_RE.sub(" ", content)))
+        channels.append((section_title(header), len(msgs), len(authors)))
+
+    return {
+        "total_messages": total,
+        "channels": sorted(channels, key=lambda c: -c[1]),
+        "hours": hours,
+        "weekdays": weekdays,
+        "reply_pairs": reply_pairs.most_common(top_n),
+        "most_replied": replied.most_common(top_n),
+        "domains": domains.most_common(top_n),
+        "links": links,
+        "questions": len(questions),
+        "answered": len(qa),
+        "qa": qa,
+        "terms": [(t, n) for t, n in term_counts.most_common(top_n * 2) if n > 1],
+    }
+
+
+def render_tables(result, max_rows=10, max_links=15, max_qa=8):
+    """统计结果 → 给模型看的紧凑表格（纯文本，每行一条记录）"""
+    lines = [f"各频道/帖子（消息数 | 发言人数），前 {max_rows}："]
+    lines += [f"- {title} | {count} | {authors}" for title, count, authors in result["channels"][:max_rows]]
+    if len(result["channels"]) > max_rows:
+        lines.append(f"- ……其余 {len(result['channels']) - max_rows} 个")
+
+    lines.append("\n按小时分布（时:消息数）：")
+    lines.append(" ".join(f"{h:02d}:{n}" for h, n in enumerate(result["hours"]) if n))
+    lines.append("按星期分布（一~日）：" + " ".join(str(n) for n in result["weekdays"]))
+
+    if result["reply_pairs"]:
+        lines.append("\n回复关系（回复者 → 被回复者 | 次数）：")
+        lines += [f"- {a} → {b} | {n}" for (a, b), n in result["reply_pairs"][:max_rows]]
+        lines.append("被回复最多的用户：" + "、".join(f"{u}({n})" for u, n in result["most_replied"][:max_rows]))
+
+    if result["links"]:
+        lines.append(f"\n分享的链接（分享者 | 链接），共 {len(result['links'])} 个：")
+        lines += [f"- {author} | {url}" for url, author in result["links"][:max_links]]
+        lines.append("链接域名：" + "、".join(f"{d}({n})" for d, n in result["domains"][:max_rows]))
+
+    lines.append(f"\n问题：共 {result['questions']} 个，其中 {result['answered']} 个有人回复")
+    if result["qa"]:
+        lines.append("问答（提问者：问题 → 回答者：回答）：")
+        lines += [f"- {asker}：{q} → {answerer}：{a}" for asker, q, answerer, a in result["qa"][:max_qa]]
+
+    if result["terms"]:
+        lines.append("\n高频词（词(出现该词的消息数)）：" + "、".join(f"{t}({n})" for t, n in result["terms"]))
+    return "\n".join(lines)
@@ -3,17 +3,40 @@ Discord 频道导出工具 - Flask后端
 支持论坛频道和普通频道，使用后台线程避免超时
 """
 
-from flask import Flask, render_template, request, jsonify, send_file
-import requests
-import time
-from datetime import datetime
+from flask import Flask, Response, render_template, request, jsonify, send_file
+from datetime import datetime, timezone
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment
 import os
 import re
-import threading
-import uuid
+import io
+import json
+import time
+import html
+import itertools
+import gzip
+import zipfile
 from google import genai
+from discord_client import DISCORD_EPOCH, DiscordClient, fetch_ordered, resolve_channels, snowflake_bounds
+from message_store import MessageStore
+from jobs import JobCancelled, JobManager, new_job_id
+from export_cache import ExportCache, make_key
+from llm_cache import llm_cache
+from checkpoints import CheckpointStore
+from metrics import metrics
+from attachments import AttachmentArchiver
+
+# NDJSON 的 zstd 压缩和 Parquet 导出是可选功能，没装对应的包时这两种格式不可用
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 app = Flask(__name__)
 
@@ -21,21 +44,22 @@ app = Flask(__name__)
 BOT_TOKEN = os.environ.get("DISCORD_BOT_TOKEN", "")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
 VISUAL_PROMPT_PATH = os.path.join("exports", "聊天记录可视化prompt.txt")
+VISUAL_MODEL = "gemini-3-flash-preview"
+VISUAL_EXTRA_REQUIREMENTS = """额外要求（硬性）：
+1. 只输出完整HTML，不要输出Markdown代码块。
+2. 删除“熬夜冠军”模块（包括相关标题和内容）。
+3. 默认生成完整版报告。
+4. 数据不足时对应字段写“暂无数据”，不要留占位符。
+5. 输出的HTML可直接保存并在浏览器打开。"""
 
-API_BASE = "https://discord.com/api/v9"
-
-# 任务状态管理
-export_lock = threading.Lock()
-task_status = {
-    "is_running": False,
-    "task_id": None,
-    "progress": "",
-    "result": None,
-    "error": None,
-    "filename": None,
-    "txt_filename": None,
-    "report_filename": None
-}
+# 导出任务队列（多个任务可同时执行）
+jobs = JobManager()
+SSE_MAX_SECONDS = 300
+# 导出结果缓存，同时负责 exports/ 目录的配额清理
+export_cache = ExportCache()
+# 导出任务断点，进程重启后据此恢复未完成的任务
+checkpoints = CheckpointStore()
+exports_resumed = False
 
 
 def get_headers():
@@ -47,15 +71,12 @@ def snowflake_to_datetime(snowflake_id):
     return datetime.fromtimestamp(timestamp_ms / 1000)
 
 
+discord = DiscordClient(get_headers)
+store = MessageStore()
+
+
 def api_get(endpoint, params=None):
-    url = f"{API_BASE}{endpoint}"
-    while True:
-        r = requests.get(url, headers=get_headers(), params=params)
-        if r.status_code == 429:
-            retry = r.json().get("retry_after", 1)
-            time.sleep(retry)
-            continue
-        return r
+    return discord.get(endpoint, params)
 
 
 def parse_discord_url(url):
@@ -68,16 +89,24 @@ def parse_discord_url(url):
 def get_channel_info(channel_id):
     r = api_get(f"/channels/{channel_id}")
     if r.status_code == 200:
-        return r.json()
-    return None
-
-
-def get_all_threads(forum_id):
-    threads = []
-    r = api_get(f"/channels/{forum_id}/threads/active")
-    if r.status_code == 200:
-        threads.extend(r.json().get("threads", []))
-
+        info = r.json()
+        store.save_channel(info)
+        return info
+    return store.get_channel(channel_id)
+
+
+def get_all_threads(forum_id, active=None):
+    """活跃帖子每次都拉取（整服发现时已经拿到，由 active 传入）；归档帖子按归档时间倒序翻页，翻到库里已有的部分即停"""
+    if active is None:
+        active = []
+        r = api_get(f"/channels/{forum_id}/threads/active")
+        if r.status_code == 200:
+            active = r.json().get("threads", [])
+    store.save_threads(active)
+
+    known = store.latest_archive_timestamp(forum_id)
+    archived_threads = []
+    complete = False
     params = {"limit": 100}
     while True:
         r = api_get(f"/channels/{forum_id}/threads/archived/public", params)
@@ -86,98 +115,470 @@ def get_all_threads(forum_id):
         data = r.json()
         archived = data.get("threads", [])
         if not archived:
+            complete = True
             break
-        threads.extend(archived)
-        if not data.get("has_more"):
-            break
-        params["before"] = archived[-1]["thread_metadata"]["archive_timestamp"]
-    return threads
-
-
-def get_channel_messages(channel_id, date_from=None, date_to=None):
-    messages = []
-    params = {"limit": 100}
-    while True:
-        r = api_get(f"/channels/{channel_id}/messages", params)
-        if r.status_code != 200:
+        archived_threads.extend(archived)
+        last_ts = archived[-1]["thread_metadata"]["archive_timestamp"]
+        if not data.get("has_more") or (known and last_ts <= known):
+            complete = True
             break
-        batch = r.json()
-        if not batch:
-            break
-        for msg in batch:
-            msg_time = snowflake_to_datetime(msg["id"])
-            if date_from and msg_time < date_from:
-                continue
-            if date_to and msg_time > date_to:
-                continue
-            messages.append(msg)
-        if len(batch) < 100:
-            break
-        params["before"] = batch[-1]["id"]
-        time.sleep(0.3)
-    return messages
+        params["before"] = last_ts
+
+    # 翻页中断时不入库，避免下次误以为更早的归档帖子都已同步
+    if not complete:
+        return active + archived_threads
+    store.save_threads(archived_threads)
+    return store.get_threads(forum_id)
+
+
+def sync_channel_messages(channel_id, date_from=None, date_to=None, last_message_id=None, check_cancelled=None):
+    after, before = snowflake_bounds(date_from, date_to)
+    store.try_sync(api_get, channel_id, after, before, last_message_id, check_cancelled)
+
+
+def iter_channel_messages(channel_id, date_from=None, date_to=None):
+    """从本地库逐条读出已同步的消息（按时间升序）"""
+    after, before = snowflake_bounds(date_from, date_to)
+    return store.iter_messages(channel_id, after, before)
+
+
+def format_message(msg, guild_id, channel_id, archiver=None):
+    """MessageRecord → 写入器用的一行；逐条生成逐条写出，不会整批留在内存里
+
+    传入 archiver 时附件在后台下载，local_attachments 与 attachments 一一对应，写本地副本的相对路径
+    （不是 Discord 附件的为空串）；下载可能失败，所以原链接照样保留
+    """
+    local = [archiver.localize(url) or "" for url in msg.attachments] if archiver else ()
+    return {
+        "id": msg.id,
+        "guild_id": guild_id,
+        "channel_id": channel_id,
+        "author_id": msg.author_id,
+        "reference_id": msg.reference_id,
+        "author": msg.author,
+        "time": snowflake_to_datetime(msg.id).strftime("%Y-%m-%d %H:%M:%S"),
+        "content": msg.content,
+        "attachments": "\n".join(msg.attachments),
+        "local_attachments": local,
+        "link": f"https://discord.com/channels/{guild_id}/{channel_id}/{msg.id}"
+    }
+
+
+def iter_thread_export(name, created, guild_id, channel_id, date_from, date_to, channel=None, archiver=None):
+    """返回 {"name", "created", "channel", "messages": 生成器}，没有消息时返回 None"""
+    messages = iter_channel_messages(channel_id, date_from, date_to)
+    first = next(messages, None)
+    if first is None:
+        return None
+    return {
+        "name": name,
+        "created": created,
+        "channel": channel or name,
+        "messages": (format_message(msg, guild_id, channel_id, archiver)
+                     for msg in itertools.chain([first], messages))
+    }
+
+
+class TxtWriter:
+    def __init__(self, filename):
+        self.f = open(filename, "w", encoding="utf-8")
+
+    def begin_thread(self, thread):
+        self.f.write(f"{'='*60}\n频道/帖子: {thread['name']}\n创建时间: {thread['created']}\n{'='*60}\n\n")
+
+    def write_message(self, thread, msg):
+        self.f.write(f"[{msg['time']}] {msg['author']}:\n{msg['content']}\n")
+        if msg["attachments"]:
+            self.f.write(f"附件: {msg['attachments']}\n")
+        local = [p for p in msg.get("local_attachments", ()) if p]
+        if local:
+            self.f.write(f"本地附件: {' '.join(local)}\n")
+        self.f.write(f"链接: {msg['link']}\n\n")
+
+    def end_thread(self, thread):
+        pass
+
+    def close(self):
+        self.f.close()
+
+
+class ExcelWriter:
+    """write-only 模式的 xlsx 写入器，逐行落盘，内存占用与行数无关
+
+    单个 sheet 写满 Excel 行数上限后自动续到新 sheet；
+    sheet_per_channel=True 时每个频道（论坛）单独一个 sheet；
+    local_attachments=True 时（导出时下载了附件）末尾多一列本地附件路径
+    """
+    HEADERS = ["频道/帖子", "创建时间", "消息作者", "消息时间", "消息内容", "附件", "消息链接"]
+    WIDTHS = {"A": 40, "B": 18, "C": 15, "D": 20, "E": 80, "F": 50, "G": 60}
+    LOCAL_HEADER = "本地附件"
+    MAX_ROWS = 1048576
+    HEADER_FONT = Font(bold=True, color="FFFFFF")
+    HEADER_FILL = PatternFill(start_color="5865F2", end_color="5865F2", fill_type="solid")
+
+    def __init__(self, filename, sheet_per_channel=False, max_rows=MAX_ROWS, local_attachments=False):
+        self.filename = filename
+        self.sheet_per_channel = sheet_per_channel
+        self.local_attachments = local_attachments
+        self.headers = self.HEADERS + [self.LOCAL_HEADER] if local_attachments else self.HEADERS
+        self.widths = {**self.WIDTHS, "H": 50} if local_attachments else self.WIDTHS
+        self.max_rows = max_rows
+        self.wb = openpyxl.Workbook(write_only=True)
+        self.ws = None
+        self.sheet_rows = 0
+        self.channel = None
+        self.sheet_names = set()
+        # 频道 → [当前 sheet, 已写行数]，同一频道的帖子不连续时也回到原 sheet
+        self.sheets = {}
+        self.rows = 0
+
+    def _sheet_title(self, base):
+        base = re.sub(r"[\[\]:*?/\\]", "_", base or "消息导出")[:28] or "消息导出"
+        title, n = base, 1
+        while title in self.sheet_names:
+            n += 1
+            title = f"{base}({n})"
+        self.sheet_names.add(title)
+        return title
+
+    def _new_sheet(self, base):
+        self.ws = self.wb.create_sheet(self._sheet_title(base))
+        # write-only 模式下列宽必须在写入第一行前设置
+        for col, width in self.widths.items():
+            self.ws.column_dimensions[col].width = width
+        header = []
+        for h in self.headers:
+            cell = WriteOnlyCell(self.ws, value=h)
+            cell.font = self.HEADER_FONT
+            cell.fill = self.HEADER_FILL
+            header.append(cell)
+        self.ws.append(header)
+        self.sheet_rows = 1
+
+    def begin_thread(self, thread):
+        channel = thread.get("channel") if self.sheet_per_channel else None
+        if self.ws is not None and channel == self.channel:
+            return
+        if self.ws is not None:
+            self.sheets[self.channel] = [self.ws, self.sheet_rows]
+        self.channel = channel
+        if channel in self.sheets:
+            self.ws, self.sheet_rows = self.sheets[channel]
+        else:
+            self._new_sheet(channel or "消息导出")
+
+    def write_message(self, thread, msg):
+        if self.sheet_rows >= self.max_rows:
+            self._new_sheet(self.channel or "消息导出")
+        row = [thread["name"], thread["created"], msg["author"], msg["time"],
+               msg["content"], msg["attachments"], msg["link"]]
+        if self.local_attachments:
+            row.append("\n".join(p for p in msg.get("local_attachments", ()) if p))
+        self.ws.append(row)
+        self.sheet_rows += 1
+        self.rows += 1
+
+    def end_thread(self, thread):
+        pass
+
+    def close(self):
+        if self.ws is None:
+            self._new_sheet("消息导出")
+        self.wb.save(self.filename)
+
+
+class HtmlWriter:
+    """逐条写入文件的 HTML 导出，内容统一转义
+
+    pages 为 None 时输出单个 HTML；pages="thread" 每个帖子一页，
+    pages=N 每 N 条消息一页，此时 filename 是 zip 包（index.html + 分页）
+    """
+    STYLE = """<style>body{font-family:'Segoe UI',sans-serif;background:#36393f;color:#dcddde;padding:20px}
+.thread{background:#2f3136;margin:20px 0;border-radius:8px;overflow:hidden}
+.thread-header{background:#5865f2;color:white;padding:15px;font-size:18px}
+.message{padding:10px 15px;border-bottom:1px solid #40444b}
+.author{color:#7289da;font-weight:bold}.time{color:#72767d;font-size:12px;margin-left:10px}
+.content{margin-top:5px;white-space:pre-wrap}.link a,.attachments a{color:#00aff4}
+.attachments a{display:block;margin-top:5px}.attachments img{max-width:400px;max-height:300px;border-radius:4px}
+.attachments a.source{font-size:12px;margin-top:2px}
+.pager{margin:20px 0}.pager a,.index a{color:#00aff4;margin-right:15px}.index li{margin:6px 0}</style>"""
+
+    IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+
+    def __init__(self, filename, pages=None):
+        self.filename = filename
+        self.pages = pages
+        self.zip = zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) if pages else None
+        self.f = None
+        self.page_no = 0
+        self.page_messages = 0
+        self.page_threads = []
+        self.index = []
+        self.in_thread = False
+        if not pages:
+            self.f = open(filename, "w", encoding="utf-8")
+            self._write_head("Discord导出")
+
+    def _write_head(self, title):
+        self.f.write(f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{html.escape(title)}</title>'
+                     f'{self.STYLE}</head><body>')
+
+    @staticmethod
+    def page_name(no):
+        return f"page_{no:04d}.html"
+
+    def _open_page(self):
+        self.page_no += 1
+        self.page_messages = 0
+        self.page_threads = []
+        raw = self.zip.open(self.page_name(self.page_no), "w", force_zip64=True)
+        self.f = io.TextIOWrapper(raw, encoding="utf-8")
+        self._write_head(f"Discord导出 - 第 {self.page_no} 页")
+        self.f.write('<div class="pager"><a href="index.html">目录</a>'
+                     + (f'<a href="{self.page_name(self.page_no - 1)}">上一页</a>' if self.page_no > 1 else "")
+                     + "</div>")
+
+    def _close_page(self):
+        if self.f is None:
+            return
+        if self.in_thread:
+            self.f.write("</div>")
+        # 写当前页时还不知道有没有下一页，链接总是写上，close() 时补一个"已是最后一页"的页面
+        self.f.write(f'<div class="pager"><a href="index.html">目录</a>'
+                     f'<a href="{self.page_name(self.page_no + 1)}">下一页</a></div></body></html>')
+        self.f.close()
+        self.index.append((self.page_no, self.page_threads, self.page_messages))
+        self.f = None
+
+    def _thread_header(self, thread, cont=False):
+        suffix = "（续）" if cont else ""
+        self.f.write(f'<div class="thread"><div class="thread-header">'
+                     f'{html.escape(thread["name"])}{suffix} ({html.escape(thread["created"])})</div>')
+        self.in_thread = True
+
+    def _attachments(self, attachments, local=()):
+        """每个附件一个链接，图片直接内嵌显示；有本地副本时链接本地副本，另附原链接，本地图片加载失败时改用原链接"""
+        if not attachments:
+            return ""
+        parts = []
+        for url, path in itertools.zip_longest(attachments.split("\n"), local, fillvalue=""):
+            src = html.escape(url, quote=True)
+            href = html.escape(path, quote=True) if path else src
+            if url.split("?", 1)[0].lower().endswith(self.IMAGE_EXTS):
+                fallback = f' data-src="{src}" onerror="this.onerror=null;this.src=this.dataset.src"' if path else ""
+                parts.append(f'<a href="{href}" target="_blank"><img src="{href}"{fallback} loading="lazy"></a>')
+            else:
+                name = html.escape(url.split("?", 1)[0].rsplit("/", 1)[-1] or url)
+                parts.append(f'<a href="{href}" target="_blank">📎 {name}</a>')
+            if path:
+                parts.append(f'<a class="source" href="{src}" target="_blank">原链接</a>')
+        return f'<div class="attachments">{"".join(parts)}</div>'
+
+    def begin_thread(self, thread):
+        if self.pages == "thread" or (self.pages and self.f is None):
+            self._close_page()
+            self._open_page()
+        if self.pages:
+            self.page_threads.append(thread["name"])
+        self._thread_header(thread)
+
+    def write_message(self, thread, msg):
+        if self.pages and self.pages != "thread" and self.page_messages >= self.pages:
+            self._close_page()
+            self._open_page()
+            self.page_threads.append(thread["name"])
+            self._thread_header(thread, cont=True)
+        self.page_messages += 1
+        self.f.write(f'<div class="message"><span class="author">{html.escape(msg["author"])}</span>'
+                     f'<span class="time">{html.escape(msg["time"])}</span>'
+                     f'<div class="content">{html.escape(msg["content"])}</div>'
+                     f'{self._attachments(msg["attachments"], msg.get("local_attachments", ()))}'
+                     f'<div class="link"><a href="{html.escape(msg["link"], quote=True)}" target="_blank">查看原消息</a></div></div>')
+
+    def end_thread(self, thread):
+        self.f.write("</div>")
+        self.in_thread = False
+
+    def close(self):
+        if not self.pages:
+            self.f.write("</body></html>")
+            self.f.close()
+            return
+        self._close_page()
+        with io.TextIOWrapper(self.zip.open(self.page_name(self.page_no + 1), "w"), encoding="utf-8") as f:
+            self.f = f
+            self._write_head("Discord导出")
+            f.write('<div class="pager">已是最后一页 <a href="index.html">返回目录</a></div></body></html>')
+        with io.TextIOWrapper(self.zip.open("index.html", "w"), encoding="utf-8") as f:
+            self.f = f
+            self._write_head("Discord导出 - 目录")
+            f.write('<div class="thread"><div class="thread-header">目录</div><ol class="index">')
+            for no, names, count in self.index:
+                label = "、".join(html.escape(n) for n in dict.fromkeys(names))
+                f.write(f'<li><a href="{self.page_name(no)}">第 {no} 页</a>{label}（{count} 条）</li>')
+            f.write("</ol></div></body></html>")
+        self.f = None
+        self.zip.close()
+
+
+def export_record(thread, msg):
+    """NDJSON / Parquet 共用的消息结构，字段和顺序固定；时间戳是 UTC 毫秒"""
+    return {
+        "message_id": msg["id"],
+        "guild_id": int(msg["guild_id"]) if msg["guild_id"] else None,
+        "thread_id": int(msg["channel_id"]),
+        "thread": thread["name"],
+        "channel": thread.get("channel") or thread["name"],
+        "author_id": msg["author_id"],
+        "author": msg["author"],
+        "timestamp": (msg["id"] >> 22) + DISCORD_EPOCH,
+        "content": msg["content"],
+        "attachments": msg["attachments"].split("\n") if msg["attachments"] else [],
+        # 与 attachments 一一对应的本地副本路径，不是 Discord 附件的为 null；没有下载附件时为空列表
+        "local_attachments": [p or None for p in msg.get("local_attachments", ())],
+        "reply_to": msg["reference_id"],
+    }
+
+
+class NdjsonWriter:
+    """每行一条消息的 JSON，compression 为 None / "gzip" / "zstd"，边写边压缩
+
+    时间戳写成 ISO 8601（UTC），其余字段见 export_record
+    """
+    EXTENSIONS = {None: "ndjson", "gzip": "ndjson.gz", "zstd": "ndjson.zst"}
+
+    def __init__(self, filename, compression=None):
+        if compression == "gzip":
+            self.f = gzip.open(filename, "wt", encoding="utf-8", compresslevel=6)
+        elif compression == "zstd":
+            stream = zstandard.ZstdCompressor(level=3).stream_writer(open(filename, "wb"))
+            self.f = io.TextIOWrapper(stream, encoding="utf-8")
+        else:
+            self.f = open(filename, "w", encoding="utf-8")
+        self.encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+    def begin_thread(self, thread):
+        pass
+
+    def write_message(self, thread, msg):
+        record = export_record(thread, msg)
+        record["timestamp"] = datetime.fromtimestamp(record["timestamp"] / 1000, timezone.utc) \
+            .isoformat(timespec="milliseconds").replace("+00:00", "Z")
+        self.f.write(self.encode(record))
+        self.f.write("\n")
+
+    def end_thread(self, thread):
+        pass
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetWriter:
+    """按列缓冲、每 ROW_GROUP_SIZE 条写一个 row group 的 Parquet 导出（zstd 压缩），内存占用与总行数无关"""
+    ROW_GROUP_SIZE = 65536
+
+    def __init__(self, filename):
+        self.schema = pa.schema([
+            ("message_id", pa.int64()),
+            ("guild_id", pa.int64()),
+            ("thread_id", pa.int64()),
+            ("thread", pa.string()),
+            ("channel", pa.string()),
+            ("author_id", pa.int64()),
+            ("author", pa.string()),
+            ("timestamp", pa.timestamp("ms", tz="UTC")),
+            ("content", pa.string()),
+            ("attachments", pa.list_(pa.string())),
+            ("local_attachments", pa.list_(pa.string())),
+            ("reply_to", pa.int64()),
+        ])
+        self.writer = pq.ParquetWriter(filename, self.schema, compression="zstd")
+        self.columns = {name: [] for name in self.schema.names}
+        self.buffered = 0
+
+    def _flush(self):
+        if not self.buffered:
+            return
+        self.writer.write_table(pa.Table.from_pydict(self.columns, schema=self.schema))
+        for values in self.columns.values():
+            values.clear()
+        self.buffered = 0
+
+    def begin_thread(self, thread):
+        pass
+
+    def write_message(self, thread, msg):
+        for name, value in export_record(thread, msg).items():
+            self.columns[name].append(value)
+        self.buffered += 1
+        if self.buffered >= self.ROW_GROUP_SIZE:
+            self._flush()
+
+    def end_thread(self, thread):
+        pass
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+def write_export(threads_data, writers, on_progress=None):
+    """单次遍历把帖子/消息流同时写入多个 writer，返回 (帖子数, 消息数)
+
+    threads_data 和每个帖子的 messages 都可以是生成器，边抓边写，内存不随导出规模增长；
+    on_progress(帖子数, 消息数) 在每个帖子写完及每 500 条消息时调用
+    """
+    thread_count = 0
+    message_count = 0
+    # 各 writer 的写入耗时分开累计，剩下的时间花在上游（抓取、读库、格式化）
+    write_seconds = [0.0] * len(writers)
+    clock = time.perf_counter
+    start = clock()
+    try:
+        for thread in threads_data:
+            thread_count += 1
+            for i, w in enumerate(writers):
+                t = clock()
+                w.begin_thread(thread)
+                write_seconds[i] += clock() - t
+            for msg in thread["messages"]:
+                for i, w in enumerate(writers):
+                    t = clock()
+                    w.write_message(thread, msg)
+                    write_seconds[i] += clock() - t
+                message_count += 1
+                if on_progress and message_count % 500 == 0:
+                    on_progress(thread_count, message_count)
+            for i, w in enumerate(writers):
+                t = clock()
+                w.end_thread(thread)
+                write_seconds[i] += clock() - t
+            if on_progress:
+                on_progress(thread_count, message_count)
+    finally:
+        for i, w in enumerate(writers):
+            t = clock()
+            w.close()
+            write_seconds[i] += clock() - t
+        for w, seconds in zip(writers, write_seconds):
+            metrics.inc("export_write_seconds_total", seconds, writer=type(w).__name__)
+        metrics.inc("export_messages_total", message_count)
+        metrics.observe("stage_duration_seconds", sum(write_seconds), stage="export_write")
+        metrics.observe("stage_duration_seconds", clock() - start - sum(write_seconds), stage="export_fetch")
+    return thread_count, message_count
 
 
 def export_to_excel(threads_data, filename):
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "消息导出"
-    headers = ["频道/帖子", "创建时间", "消息作者", "消息时间", "消息内容", "附件", "消息链接"]
-    for col, h in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=h)
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color="5865F2", end_color="5865F2", fill_type="solid")
-    row = 2
-    for thread in threads_data:
-        for msg in thread["messages"]:
-            ws.cell(row=row, column=1, value=thread["name"])
-            ws.cell(row=row, column=2, value=thread["created"])
-            ws.cell(row=row, column=3, value=msg["author"])
-            ws.cell(row=row, column=4, value=msg["time"])
-            ws.cell(row=row, column=5, value=msg["content"])
-            ws.cell(row=row, column=6, value=msg["attachments"])
-            ws.cell(row=row, column=7, value=msg["link"])
-            row += 1
-    ws.column_dimensions["A"].width = 40
-    ws.column_dimensions["B"].width = 18
-    ws.column_dimensions["C"].width = 15
-    ws.column_dimensions["D"].width = 20
-    ws.column_dimensions["E"].width = 80
-    ws.column_dimensions["F"].width = 50
-    ws.column_dimensions["G"].width = 60
-    wb.save(filename)
-    return row - 1
+    return write_export(threads_data, [ExcelWriter(filename)])[1]
 
 
 def export_to_txt(threads_data, filename):
-    with open(filename, "w", encoding="utf-8") as f:
-        for thread in threads_data:
-            f.write(f"{'='*60}\n频道/帖子: {thread['name']}\n创建时间: {thread['created']}\n{'='*60}\n\n")
-            for msg in thread["messages"]:
-                f.write(f"[{msg['time']}] {msg['author']}:\n{msg['content']}\n")
-                if msg["attachments"]:
-                    f.write(f"附件: {msg['attachments']}\n")
-                f.write(f"链接: {msg['link']}\n\n")
+    write_export(threads_data, [TxtWriter(filename)])
 
 
 def export_to_html(threads_data, filename):
-    html = """<!DOCTYPE html><html><head><meta charset="utf-8"><title>Discord导出</title>
-<style>body{font-family:'Segoe UI',sans-serif;background:#36393f;color:#dcddde;padding:20px}
-.thread{background:#2f3136;margin:20px 0;border-radius:8px;overflow:hidden}
-.thread-header{background:#5865f2;color:white;padding:15px;font-size:18px}
-.message{padding:10px 15px;border-bottom:1px solid #40444b}
-.author{color:#7289da;font-weight:bold}.time{color:#72767d;font-size:12px;margin-left:10px}
-.content{margin-top:5px;white-space:pre-wrap}.link a{color:#00aff4}</style></head><body>"""
-    for thread in threads_data:
-        html += f'<div class="thread"><div class="thread-header">{thread["name"]} ({thread["created"]})</div>'
-        for msg in thread["messages"]:
-            html += f'<div class="message"><span class="author">{msg["author"]}</span><span class="time">{msg["time"]}</span>'
-            html += f'<div class="content">{msg["content"]}</div>'
-            html += f'<div class="link"><a href="{msg["link"]}" target="_blank">查看原消息</a></div></div>'
-        html += '</div>'
-    html += "</body></html>"
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(html)
+    write_export(threads_data, [HtmlWriter(filename)])
 
 
 def get_visual_prompt():
@@ -278,28 +679,34 @@ def generate_visual_report(chat_text):
     if not GEMINI_API_KEY:
         raise ValueError("请先设置 Gemini API Key")
 
-    client = genai.Client(api_key=GEMINI_API_KEY)
+    # 同一份 TXT + 同样的 Prompt 命中缓存时不再调用模型
+    html_content = llm_cache.get(prompt_template, chat_text, VISUAL_MODEL, VISUAL_EXTRA_REQUIREMENTS)
+    if not html_content:
+        client = genai.Client(api_key=GEMINI_API_KEY)
 
-    final_prompt = f"""{prompt_template}
+        final_prompt = f"""{prompt_template}
 
-额外要求（硬性）：
-1. 只输出完整HTML，不要输出Markdown代码块。
-2. 删除“熬夜冠军”模块（包括相关标题和内容）。
-3. 默认生成完整版报告。
-4. 数据不足时对应字段写“暂无数据”，不要留占位符。
-5. 输出的HTML可直接保存并在浏览器打开。
+{VISUAL_EXTRA_REQUIREMENTS}
 
 以下是需要分析的Discord聊天记录（TXT）：
 {chat_text}
 """
 
-    response = client.models.generate_content(
-        model="gemini-3-flash-preview",
-        contents=final_prompt,
-    )
-    html_content = extract_html_content(getattr(response, "text", ""))
-    if not html_content:
-        raise ValueError("Gemini 未返回有效HTML内容")
+        try:
+            with metrics.timer("llm_request_duration_seconds", model=VISUAL_MODEL):
+                response = client.models.generate_content(
+                    model=VISUAL_MODEL,
+                    contents=final_prompt,
+                )
+        except Exception:
+            metrics.inc("llm_requests_total", model=VISUAL_MODEL, outcome="error")
+            raise
+        html_content = extract_html_content(getattr(response, "text", ""))
+        if not html_content:
+            metrics.inc("llm_requests_total", model=VISUAL_MODEL, outcome="empty")
+            raise ValueError("Gemini 未返回有效HTML内容")
+        metrics.inc("llm_requests_total", model=VISUAL_MODEL, outcome="ok")
+        llm_cache.put(prompt_template, chat_text, VISUAL_MODEL, html_content, VISUAL_EXTRA_REQUIREMENTS)
 
     html_content = remove_night_owl_section(html_content)
     html_content = ensure_mermaid_script(html_content)
@@ -307,113 +714,191 @@ def generate_visual_report(chat_text):
     return html_content
 
 
-def do_export(urls, date_from, date_to, export_format):
-    """后台执行导出任务"""
-    global task_status
-    try:
-        all_threads_data = []
-        total_messages = 0
-
-        for i, url in enumerate(urls):
-            task_status["progress"] = f"处理频道 {i+1}/{len(urls)}..."
-            guild_id, channel_id = parse_discord_url(url)
-            if not channel_id:
-                continue
-
-            channel_info = get_channel_info(channel_id)
-            if not channel_info:
-                continue
-
-            channel_type = channel_info.get("type")
-            channel_name = channel_info.get("name", "未知频道")
-
-            if channel_type == 15:
-                threads = get_all_threads(channel_id)
-                task_status["progress"] = f"频道 {i+1}: 找到 {len(threads)} 个帖子"
-                
-                for j, thread in enumerate(threads):
-                    thread_created = snowflake_to_datetime(thread["id"])
-                    if date_from and thread_created < date_from:
-                        continue
-                    if date_to and thread_created > date_to:
-                        continue
-
-                    task_status["progress"] = f"频道 {i+1}: 处理帖子 {j+1}/{len(threads)}"
-                    messages = get_channel_messages(thread["id"], date_from, date_to)
-                    if messages:
-                        messages.sort(key=lambda m: m["id"])
-                        thread_data = {
-                            "name": thread["name"],
-                            "created": thread_created.strftime("%Y-%m-%d %H:%M"),
-                            "messages": []
-                        }
-                        for msg in messages:
-                            thread_data["messages"].append({
-                                "author": msg.get("author", {}).get("username", "未知"),
-                                "time": snowflake_to_datetime(msg["id"]).strftime("%Y-%m-%d %H:%M:%S"),
-                                "content": msg.get("content", ""),
-                                "attachments": "\n".join([a.get("url", "") for a in msg.get("attachments", [])]),
-                                "link": f"https://discord.com/channels/{guild_id}/{thread['id']}/{msg['id']}"
-                            })
-                            total_messages += 1
-                        all_threads_data.append(thread_data)
-                    time.sleep(0.3)
+def iter_export_threads(job, urls, date_from, date_to, archiver=None):
+    """按顺序产出每个要导出的频道/帖子；论坛帖子在后台并发同步，前台边读边产出
+
+    只有服务器ID的链接导出整个服务器的文字频道和论坛；同一服务器的频道列表和活跃帖子整服只拉一次
+
+    论坛的帖子列表记入断点；从断点恢复时沿用记下的帖子列表，输出文件要从头重写，所以每个帖子仍然要过一遍，
+    但已同步完的帖子直接读库，没同步完的从库里记录的已覆盖区间继续，不需要另记进度；
+    恢复出的帖子不带 last_message_id，每个帖子都向 Discord 确认一次有没有新消息
+    """
+    state = checkpoints.get(job.id) or {}
+    saved_threads = state.get("threads", {})
+    job.set_progress("正在获取频道列表...")
+    channels = resolve_channels(api_get, urls, get_channel_info)
+    store.save_threads([info for _, info, _ in channels])
+    for i, (guild_id, channel_info, active_threads) in enumerate(channels):
+        job.set_progress(f"处理频道 {i+1}/{len(channels)}...")
+        channel_id = channel_info["id"]
+        channel_type = channel_info.get("type")
+        channel_name = channel_info.get("name", "未知频道")
+
+        if channel_type == 15:
+            threads = saved_threads.get(str(channel_id))
+            if threads is None:
+                threads = get_all_threads(channel_id, active_threads)
+                job.set_progress(f"频道 {i+1}: 找到 {len(threads)} 个帖子")
+
+                threads = [
+                    {"id": t["id"], "name": t["name"], "last_message_id": t.get("last_message_id")}
+                    for t in threads
+                    if not (date_from and snowflake_to_datetime(t["id"]) < date_from)
+                    and not (date_to and snowflake_to_datetime(t["id"]) > date_to)
+                ]
+                # 断点里只记 ID 和名称：恢复时可能已过去很久，记下的 last_message_id 早已过时
+                saved_threads[str(channel_id)] = [{"id": t["id"], "name": t["name"]} for t in threads]
+                checkpoints.update(job.id, threads=saved_threads)
             else:
-                messages = get_channel_messages(channel_id, date_from, date_to)
-                if messages:
-                    messages.sort(key=lambda m: m["id"])
-                    thread_data = {
-                        "name": f"#{channel_name}",
-                        "created": snowflake_to_datetime(channel_id).strftime("%Y-%m-%d %H:%M"),
-                        "messages": []
-                    }
-                    for msg in messages:
-                        thread_data["messages"].append({
-                            "author": msg.get("author", {}).get("username", "未知"),
-                            "time": snowflake_to_datetime(msg["id"]).strftime("%Y-%m-%d %H:%M:%S"),
-                            "content": msg.get("content", ""),
-                            "attachments": "\n".join([a.get("url", "") for a in msg.get("attachments", [])]),
-                            "link": f"https://discord.com/channels/{guild_id}/{channel_id}/{msg['id']}"
-                        })
-                        total_messages += 1
-                    all_threads_data.append(thread_data)
-
-        if not all_threads_data:
-            task_status["error"] = "没有找到符合条件的消息"
-            return
-
-        task_status["progress"] = "正在生成文件..."
-        os.makedirs("exports", exist_ok=True)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        txt_filename = f"exports/Discord导出_{timestamp}.txt"
-        export_to_txt(all_threads_data, txt_filename)
-
-        if export_format == "excel":
-            filename = f"exports/Discord导出_{timestamp}.xlsx"
-            export_to_excel(all_threads_data, filename)
-        elif export_format == "txt":
-            filename = txt_filename
+                job.set_progress(f"频道 {i+1}: 从断点恢复，共 {len(threads)} 个帖子")
+
+            def report_progress(done, total, i=i):
+                job.set_progress(f"频道 {i+1}: 处理帖子 {done}/{total}")
+
+            for thread, _ in fetch_ordered(
+                threads,
+                lambda t: sync_channel_messages(t["id"], date_from, date_to, t.get("last_message_id"),
+                                                job.check_cancelled),
+                on_done=report_progress,
+            ):
+                thread_data = iter_thread_export(
+                    thread["name"],
+                    snowflake_to_datetime(thread["id"]).strftime("%Y-%m-%d %H:%M"),
+                    guild_id, thread["id"], date_from, date_to, channel=f"#{channel_name}", archiver=archiver,
+                )
+                if thread_data:
+                    yield thread_data
         else:
-            filename = f"exports/Discord导出_{timestamp}.html"
-            export_to_html(all_threads_data, filename)
-
-        task_status["result"] = {
-            "threads": len(all_threads_data),
-            "messages": total_messages,
-            "txt_filename": txt_filename,
-            "export_filename": filename
-        }
-        task_status["filename"] = filename
-        task_status["txt_filename"] = txt_filename
-        task_status["report_filename"] = None
-        task_status["progress"] = "完成！"
+            sync_channel_messages(channel_id, date_from, date_to, channel_info.get("last_message_id"),
+                                  job.check_cancelled)
+            thread_data = iter_thread_export(
+                f"#{channel_name}",
+                snowflake_to_datetime(channel_id).strftime("%Y-%m-%d %H:%M"),
+                guild_id, channel_id, date_from, date_to, archiver=archiver,
+            )
+            if thread_data:
+                yield thread_data
+
+
+@jobs.task
+def do_export(job, urls, date_from, date_to, export_format, sheet_per_channel=False, html_pages=None,
+              cache_key=None, download_attachments=False, compression=None):
+    """后台执行导出任务（在任务队列的工作线程里运行）
+
+    download_attachments=True 时附件边导出边在后台下载到 exports/attachments/，导出文件里写本地相对路径；
+    compression 只对 ndjson 格式有效：None / "gzip" / "zstd"
+    """
+    os.makedirs("exports", exist_ok=True)
+    # 从断点恢复时，上次进程没写完的输出文件作废，重新从库里完整写一遍
+    for name in os.listdir("exports"):
+        if name.startswith("Discord导出_") and (f"_{job.id}." in name or f"_{job.id}_html." in name):
+            os.remove(os.path.join("exports", name))
+    # 多个任务可能在同一秒开始，文件名带上任务ID避免互相覆盖
+    stem = f"exports/Discord导出_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{job.id}"
+    txt_filename = f"{stem}.txt"
+    writers = [TxtWriter(txt_filename)]
+
+    if export_format == "excel":
+        filename = f"{stem}.xlsx"
+        writers.append(ExcelWriter(filename, sheet_per_channel=sheet_per_channel,
+                                   local_attachments=download_attachments))
+    elif export_format == "txt":
+        filename = txt_filename
+    elif export_format == "ndjson":
+        filename = f"{stem}.{NdjsonWriter.EXTENSIONS[compression]}"
+        writers.append(NdjsonWriter(filename, compression))
+    elif export_format == "parquet":
+        filename = f"{stem}.parquet"
+        writers.append(ParquetWriter(filename))
+    elif html_pages:
+        filename = f"{stem}_html.zip"
+        writers.append(HtmlWriter(filename, pages=html_pages))
+    else:
+        filename = f"{stem}.html"
+        writers.append(HtmlWriter(filename))
 
-    except Exception as e:
-        task_status["error"] = str(e)
+    archiver = AttachmentArchiver(check_cancelled=job.check_cancelled) if download_attachments else None
+    attachment_stats = None
+
+    def on_progress(thread_count, message_count):
+        job.check_cancelled()
+        job.update(threads_written=thread_count, messages_written=message_count)
+
+    try:
+        thread_count, total_messages = write_export(
+            iter_export_threads(job, urls, date_from, date_to, archiver), writers,
+            on_progress=on_progress,
+        )
+        if archiver:
+            with metrics.stage("attachments"):
+                attachment_stats = archiver.wait(
+                    on_progress=lambda done, total: job.set_progress(f"下载附件 {done}/{total}")
+                )
+    except JobCancelled:
+        for path in {txt_filename, filename}:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
     finally:
-        task_status["is_running"] = False
-        if export_lock.locked():
-            export_lock.release()
+        # 出错或取消时丢下没下完的附件（.part 留着，下次导出续传）
+        if archiver:
+            archiver.close(cancel=True)
+        # 正常结束、出错、取消都不再需要断点；只有进程意外退出时断点才会留下
+        checkpoints.delete(job.id)
+
+    if not thread_count:
+        for path in {txt_filename, filename}:
+            if os.path.exists(path):
+                os.remove(path)
+        job.update(error="没有找到符合条件的消息")
+        return None
+
+    result = {
+        "threads": thread_count,
+        "messages": total_messages,
+        "txt_filename": txt_filename,
+        "export_filename": filename
+    }
+    if attachment_stats:
+        result["attachments"] = attachment_stats
+    if cache_key:
+        export_cache.put(cache_key, [txt_filename, filename], result)
+    export_cache.evict()
+    if archiver:
+        # exports/attachments/ 不在 exports/ 的配额里，由附件库自己的上限管
+        archiver.store.evict()
+    job.update(filename=filename, txt_filename=txt_filename, report_filename=None, progress="完成！")
+    return result
+
+
+def parse_checkpoint_date(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def resume_exports():
+    """按断点重新提交上次进程退出时没做完的导出任务（沿用原任务ID），每个进程只做一次
+
+    任务还在共享任务库里的（SQLite 后端）会在心跳超时后自动重新排队，这里只处理任务库里已经没有的；
+    多个 worker 同时恢复同一个断点时 jobs.submit 按任务ID去重，只有一个提交成功
+    （memory 后端不跨进程去重，多 worker 部署要用 sqlite 后端）。
+    需要 Bot Token 才能继续抓取，没有 Token 时等设置 Token 后再恢复
+    """
+    global exports_resumed
+    if exports_resumed or not BOT_TOKEN:
+        return
+    exports_resumed = True
+    for state in checkpoints.load_all():
+        if jobs.get(state["job_id"]):
+            continue
+        params = state["params"]
+        jobs.submit(
+            do_export, params["urls"], parse_checkpoint_date(params["date_from"]),
+            parse_checkpoint_date(params["date_to"]), params["export_format"],
+            params["sheet_per_channel"], params["html_pages"],
+            kind="export", priority=state.get("priority", 0), job_id=state["job_id"],
+            cache_key=params.get("cache_key"), download_attachments=params.get("download_attachments", False),
+            compression=params.get("compression"),
+        )
 
 
 @app.route("/")
@@ -434,6 +919,7 @@ def set_token():
     global BOT_TOKEN
     data = request.json
     BOT_TOKEN = data.get("token", "")
+    resume_exports()
     return jsonify({"success": True})
 
 
@@ -447,27 +933,42 @@ def set_gemini_key():
 
 @app.route("/api/export", methods=["POST"])
 def export():
-    global BOT_TOKEN, task_status
+    global BOT_TOKEN
 
     if not BOT_TOKEN:
         return jsonify({"error": "请先设置Bot Token"}), 400
 
-    if not export_lock.acquire(blocking=False):
-        return jsonify({
-            "status": "busy",
-            "message": "当前有任务正在执行，请稍后再试",
-            "progress": task_status["progress"]
-        }), 429
-
     try:
         data = request.json
         urls = data.get("urls", [])
         date_from = data.get("date_from")
         date_to = data.get("date_to")
         export_format = data.get("format", "excel")
+        sheet_per_channel = bool(data.get("sheet_per_channel"))
+        download_attachments = bool(data.get("download_attachments"))
+        # NDJSON 压缩：留空不压缩，可选 gzip / zstd
+        compression = (data.get("compression") or None) if export_format == "ndjson" else None
+        if export_format not in ("excel", "txt", "html", "ndjson", "parquet"):
+            return jsonify({"error": f"不支持的导出格式: {export_format}"}), 400
+        if compression not in NdjsonWriter.EXTENSIONS:
+            return jsonify({"error": "compression 只能是 gzip 或 zstd"}), 400
+        if compression == "zstd" and zstandard is None:
+            return jsonify({"error": "zstd 压缩需要先安装 zstandard（pip install zstandard）"}), 400
+        if export_format == "parquet" and pq is None:
+            return jsonify({"error": "Parquet 导出需要先安装 pyarrow（pip install pyarrow）"}), 400
+        # HTML 分页："thread" 每帖一页，数字为每页消息数，留空为单文件
+        html_pages = data.get("html_pages") or None
+        if html_pages and html_pages != "thread":
+            try:
+                html_pages = max(1, int(html_pages))
+            except (TypeError, ValueError):
+                return jsonify({"error": "html_pages 只能是 thread 或正整数"}), 400
+        try:
+            priority = int(data.get("priority", 0))
+        except (TypeError, ValueError):
+            return jsonify({"error": "priority 必须是整数"}), 400
 
         if not urls:
-            export_lock.release()
             return jsonify({"error": "请输入至少一个频道链接"}), 400
 
         # 解析日期时间
@@ -491,36 +992,153 @@ def export():
                     date_to_parsed = datetime.strptime(date_to.strip(), "%Y-%m-%d")
                     date_to_parsed = date_to_parsed.replace(hour=23, minute=59, second=59)
         except Exception as e:
-            export_lock.release()
             return jsonify({"error": f"日期时间格式错误: {str(e)}"}), 400
 
-        # 重置状态
-        task_id = str(uuid.uuid4())[:8]
-        task_status["is_running"] = True
-        task_status["task_id"] = task_id
-        task_status["progress"] = "任务启动中..."
-        task_status["result"] = None
-        task_status["error"] = None
-        task_status["filename"] = None
-        task_status["txt_filename"] = None
-        task_status["report_filename"] = None
-
-        # 启动后台线程
-        thread = threading.Thread(target=do_export, args=(urls, date_from_parsed, date_to_parsed, export_format))
-        thread.daemon = True
-        thread.start()
-
-        return jsonify({"status": "started", "task_id": task_id, "message": "导出任务已启动"})
+        # 时间范围已完全过去的请求结果不会再变，可以直接复用缓存文件
+        cache_key = None
+        if date_to_parsed and date_to_parsed < datetime.now():
+            after, before = snowflake_bounds(date_from_parsed, date_to_parsed)
+            options = {"sheet_per_channel": sheet_per_channel, "html_pages": html_pages}
+            # 只在开启时加入，不影响已有缓存的键
+            if download_attachments:
+                options["download_attachments"] = True
+            if compression:
+                options["compression"] = compression
+            cache_key = make_key(
+                [parse_discord_url(u)[1] or u for u in urls], after, before, export_format, options,
+            )
+            cached = export_cache.get(cache_key)
+            if cached:
+                result = cached["result"]
+                job = jobs.add_finished(
+                    result, kind="export", cached=True,
+                    filename=result["export_filename"], txt_filename=result["txt_filename"],
+                )
+                return jsonify({
+                    "status": "started",
+                    "task_id": job.id,
+                    "cached": True,
+                    "position": None,
+                    "message": "命中缓存，直接返回上次的导出结果"
+                })
+
+        # 先写断点再入队，任务就算马上开始也能找到自己的断点
+        job_id = new_job_id()
+        checkpoints.update(job_id, created_at=time.time(), priority=priority, params={
+            "urls": urls,
+            "date_from": date_from_parsed.isoformat() if date_from_parsed else None,
+            "date_to": date_to_parsed.isoformat() if date_to_parsed else None,
+            "export_format": export_format,
+            "sheet_per_channel": sheet_per_channel,
+            "html_pages": html_pages,
+            "cache_key": cache_key,
+            "download_attachments": download_attachments,
+            "compression": compression,
+        })
+        job = jobs.submit(
+            do_export, urls, date_from_parsed, date_to_parsed, export_format,
+            sheet_per_channel, html_pages, kind="export", priority=priority, job_id=job_id,
+            cache_key=cache_key, download_attachments=download_attachments, compression=compression,
+        )
+        return jsonify({
+            "status": "started",
+            "task_id": job.id,
+            "position": jobs.position(job),
+            "message": "导出任务已加入队列"
+        })
 
     except Exception as e:
-        if export_lock.locked():
-            export_lock.release()
         return jsonify({"error": str(e)}), 500
 
 
+def job_status(job):
+    status = job.to_dict()
+    status["position"] = jobs.position(job)
+    return status
+
+
 @app.route("/api/status")
 def get_status():
-    return jsonify(task_status)
+    """兼容旧前端：不带 task_id 时返回最近一个任务"""
+    task_id = request.args.get("task_id")
+    job = jobs.get(task_id) if task_id else jobs.latest("export")
+    if not job:
+        if task_id:
+            return jsonify({"error": "任务不存在"}), 404
+        return jsonify({"is_running": False, "task_id": None, "progress": "", "result": None, "error": None})
+    return jsonify(job_status(job))
+
+
+@app.route("/api/jobs")
+def list_jobs():
+    return jsonify({
+        "jobs": [job_status(job) for job in jobs.list(request.args.get("kind"))],
+        "llm_cache": llm_cache.stats(),
+    })
+
+
+@app.route("/api/metrics")
+def get_metrics():
+    """Prometheus 抓取用：Discord 请求、速率限制、写文件、大模型调用和各阶段耗时"""
+    return Response(metrics.render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route("/api/jobs/<job_id>")
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "任务不存在"}), 404
+    return jsonify(job_status(job))
+
+
+@app.route("/api/jobs/<job_id>/events")
+def job_events(job_id):
+    """Server-Sent Events：任务状态一变化就推送，任务结束后关闭连接"""
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "任务不存在"}), 404
+
+    def stream():
+        # 单个连接最长保持 SSE_MAX_SECONDS，之后由浏览器 EventSource 自动重连
+        deadline = time.monotonic() + SSE_MAX_SECONDS
+        version = -1
+        yield "retry: 2000\n\n"
+        while time.monotonic() < deadline:
+            new_version = job.wait_for_change(version, timeout=15)
+            if new_version == version:
+                yield ": keep-alive\n\n"
+                continue
+            version = new_version
+            status = job_status(job)
+            yield f"data: {json.dumps(status, ensure_ascii=False)}\n\n"
+            if not status["is_running"]:
+                return
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/api/jobs/<job_id>/result")
+def get_job_result(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "任务不存在"}), 404
+    state = job.status["state"]
+    if state != "done":
+        return jsonify({"error": job.status["error"] or f"任务尚未完成（{state}）", "state": state}), 409
+    return jsonify({"state": state, "result": job.status["result"]})
+
+
+@app.route("/api/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    if not jobs.get(job_id):
+        return jsonify({"error": "任务不存在"}), 404
+    if not jobs.cancel(job_id):
+        return jsonify({"error": "任务已结束，无法取消"}), 409
+    # 排队中被取消的任务不会再运行，断点要在这里删掉；运行中的任务退出时自己删
+    if jobs.get(job_id).status["state"] == "cancelled":
+        checkpoints.delete(job_id)
+    return jsonify({"success": True})
 
 
 @app.route("/api/download/<path:filename>")
@@ -542,14 +1160,43 @@ def preview_report():
     return jsonify({"error": "报告文件不存在"}), 404
 
 
+@jobs.task
+def do_visualize(job, txt_filename, export_job_id=None):
+    """后台生成可视化报告（在任务队列的工作线程里运行）"""
+    job.set_progress("正在读取聊天记录...")
+    with open(os.path.join(os.getcwd(), txt_filename), "r", encoding="utf-8") as f:
+        chat_text = f.read()
+    if not chat_text.strip():
+        job.update(error="TXT内容为空，无法生成可视化报告")
+        return None
+
+    job.set_progress("正在调用 Gemini 生成可视化报告...")
+    with metrics.stage("visualize"):
+        html_content = generate_visual_report(chat_text)
+    # 模型调用本身无法中断，返回后再检查一次是否已被取消，已取消就不写报告文件
+    job.check_cancelled()
+    job.set_progress("正在保存报告...")
+    os.makedirs("exports", exist_ok=True)
+    report_filename = f"exports/聊天记录可视化_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{job.id}.html"
+    with open(report_filename, "w", encoding="utf-8") as f:
+        f.write(html_content)
+
+    export_job = jobs.get(export_job_id) if export_job_id else None
+    if export_job:
+        export_job.update(report_filename=report_filename)
+    job.update(filename=report_filename, report_filename=report_filename, progress="完成！")
+    return {"filename": report_filename}
+
+
 @app.route("/api/visualize", methods=["POST"])
 def visualize():
-    global task_status
+    """提交可视化任务后立即返回任务ID，进度和结果通过 /api/jobs/<id> 查询"""
     if not GEMINI_API_KEY:
         return jsonify({"error": "请先设置 Gemini API Key"}), 400
 
     data = request.json or {}
-    txt_filename = data.get("txt_filename") or task_status.get("txt_filename")
+    export_job = jobs.get(data.get("task_id")) if data.get("task_id") else jobs.latest("export")
+    txt_filename = data.get("txt_filename") or (export_job and export_job.status.get("txt_filename"))
     if not txt_filename:
         return jsonify({"error": "未找到可视化所需的TXT导出文件"}), 400
 
@@ -557,27 +1204,26 @@ def visualize():
     if not os.path.exists(txt_filepath):
         return jsonify({"error": f"TXT文件不存在: {txt_filename}"}), 404
 
-    try:
-        with open(txt_filepath, "r", encoding="utf-8") as f:
-            chat_text = f.read()
-        if not chat_text.strip():
-            return jsonify({"error": "TXT内容为空，无法生成可视化报告"}), 400
-
-        html_content = generate_visual_report(chat_text)
-        os.makedirs("exports", exist_ok=True)
-        report_filename = f"exports/聊天记录可视化_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
-        with open(report_filename, "w", encoding="utf-8") as f:
-            f.write(html_content)
+    job = jobs.submit(
+        do_visualize, txt_filename, export_job.id if export_job else None, kind="visualize",
+    )
+    return jsonify({
+        "status": "started",
+        "task_id": job.id,
+        "position": jobs.position(job),
+        "message": "可视化任务已加入队列"
+    })
 
-        task_status["report_filename"] = report_filename
-        return jsonify({
-            "success": True,
-            "filename": report_filename
-        })
-    except Exception as e:
-        return jsonify({"error": f"可视化生成失败: {str(e)}"}), 500
 
+# 所有任务函数都已注册，再开始领取任务
+jobs.start()
 
 if __name__ == "__main__":
     os.makedirs("exports", exist_ok=True)
+    # debug 模式下 reloader 的父进程不处理请求，只在真正提供服务的子进程里恢复任务
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        resume_exports()
     app.run(debug=True, port=5000)
+else:
+    # gunicorn 等 WSGI 服务器导入时恢复
+    resume_exports()
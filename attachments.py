@@ -0,0 +1,411 @@
+"""
+附件归档 - app.py 用
+Discord CDN 的附件链接会过期，导出时可以顺带把附件下载下来，导出文件里在原链接之外再写一份本地副本的相对路径：
+- 附件按内容 SHA-256 存一份（data/attachments/objects），索引记下 附件ID → 哈希，跨导出同一附件只下载一次
+- exports/attachments/<频道ID>/<附件ID>/<文件名> 是指向这份内容的硬链接，导出文件写的就是这个路径
+- 下载中断会留下 .part 文件，下次用 Range 请求从断开处续传
+- 有界线程池并发下载，排队数也有上限；所有下载共用一个令牌桶限速
+- 附件库（含导出目录里的链接）超出 ATTACHMENT_MAX_MB 时按最近使用时间淘汰
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import unquote, urlparse
+
+import requests
+
+from metrics import metrics
+
+ATTACHMENT_DIR = os.environ.get("ATTACHMENT_DIR", os.path.join("data", "attachments"))
+ATTACHMENT_WORKERS = int(os.environ.get("ATTACHMENT_WORKERS", "4"))
+# 所有下载合计的带宽上限，0 为不限
+ATTACHMENT_MAX_BYTES_PER_SEC = int(float(os.environ.get("ATTACHMENT_MAX_MB_PER_SEC", "0")) * 1024 * 1024)
+# 附件库的磁盘上限（对象、导出目录里复制出来的副本、未下完的 .part 合计），0 为不限
+ATTACHMENT_MAX_BYTES = int(float(os.environ.get("ATTACHMENT_MAX_MB", "5120")) * 1024 * 1024)
+# 最近用过的附件可能正被导出任务链接，不参与淘汰
+MIN_IDLE_SECONDS = 600
+# 这么久没有续传的 .part 文件直接删掉
+PARTIAL_TTL = 7 * 86400
+EXPORT_DIR = "exports"
+LINK_DIR = "attachments"
+ATTACHMENT_HOSTS = {"cdn.discordapp.com", "media.discordapp.net"}
+ATTACHMENT_PATH_RE = re.compile(r"^/attachments/(\d+)/(\d+)/([^/]+)$")
+CHUNK_SIZE = 256 * 1024
+MAX_ATTEMPTS = 4
+# 每个下载线程最多排队这么多个附件，导出写得比下载快时在这里等
+QUEUE_PER_WORKER = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS attachments (
+    key TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    object TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_attachments_object ON attachments (object);
+-- 导出目录里指向各对象的链接（或副本），淘汰对象时一起删掉
+CREATE TABLE IF NOT EXISTS links (
+    path TEXT PRIMARY KEY,
+    object TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_links_object ON links (object);
+"""
+
+
+class AttachmentError(Exception):
+    """附件下载失败；retry=False 表示不必重试（链接过期、文件已删除等）"""
+
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+def file_key(st):
+    return st.st_dev, st.st_ino
+
+
+def parse_attachment_url(url):
+    """Discord 附件链接 → (索引键 频道ID/附件ID, 导出目录下的相对路径)；不是附件链接时返回 None
+
+    键里不带查询参数：同一附件每次拿到的签名参数（ex/is/hm）都不同，cdn 和 media 两个域名也是同一份
+    """
+    parsed = urlparse(url)
+    if parsed.netloc.lower() not in ATTACHMENT_HOSTS:
+        return None
+    match = ATTACHMENT_PATH_RE.match(parsed.path)
+    if not match:
+        return None
+    channel_id, attachment_id, filename = match.groups()
+    filename = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", unquote(filename)).strip(" .")[:120] or "file"
+    return f"{channel_id}/{attachment_id}", f"{LINK_DIR}/{channel_id}/{attachment_id}/{filename}"
+
+
+def object_suffix(rel_path):
+    """对象文件沿用原文件的扩展名，便于直接打开；过长或奇怪的扩展名不要"""
+    ext = os.path.splitext(rel_path)[1].lower()
+    return ext if re.fullmatch(r"\.[a-z0-9]{1,10}", ext) else ""
+
+
+def link_or_copy(src, dest):
+    """在导出目录里放一份附件：优先硬链接，跨文件系统等情况退回复制"""
+    if os.path.exists(dest):
+        return
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    try:
+        os.link(src, dest)
+    except FileExistsError:
+        pass
+    except OSError:
+        tmp = f"{dest}.{threading.get_ident()}.tmp"
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+
+
+class BandwidthLimiter:
+    """令牌桶：所有下载线程共用每秒 rate 字节的额度，最多攒一秒的突发；rate 为 0 时不限速"""
+
+    def __init__(self, rate=ATTACHMENT_MAX_BYTES_PER_SEC):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+
+    def consume(self, size):
+        """记下刚收到的 size 字节，额度透支时睡到还清为止"""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= size
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+
+class AttachmentStore:
+    """按内容寻址的附件库 + SQLite 索引，多个导出任务共用；同一附件同时只有一个线程在下载"""
+
+    def __init__(self, directory=ATTACHMENT_DIR, limiter=None, max_bytes=ATTACHMENT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(directory, "objects")
+        self.partial_dir = os.path.join(directory, "partial")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.limiter = limiter or BandwidthLimiter()
+        self.session = requests.Session()
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=max(ATTACHMENT_WORKERS, 10)))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        # 正在下载的键 → Event，其他线程要同一附件时等它下完
+        self._inflight = {}
+
+    def lookup(self, key):
+        """已归档时返回对象文件路径并刷新最近使用时间，否则 None"""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT object FROM attachments WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            path = os.path.join(self.objects_dir, row[0])
+            if not os.path.exists(path):
+                return None
+            self._conn.execute("UPDATE attachments SET used_at = ? WHERE key = ?", (time.time(), key))
+        return path
+
+    def link(self, path, dest):
+        """在导出目录里放一份对象文件并记下来，淘汰对象时一起删"""
+        link_or_copy(path, dest)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO links (path, object) VALUES (?, ?)",
+                (dest, os.path.relpath(path, self.objects_dir).replace(os.sep, "/")),
+            )
+
+    def fetch(self, url, key, suffix="", cancelled=None):
+        """确保附件已归档，返回 (对象文件路径, 是否新下载)；cancelled 是 threading.Event，置位后尽快中止"""
+        while True:
+            path = self.lookup(key)
+            if path:
+                return path, False
+            with self._lock:
+                event = self._inflight.get(key)
+                owner = event is None
+                if owner:
+                    event = self._inflight[key] = threading.Event()
+            if owner:
+                break
+            event.wait()
+        try:
+            path = self.lookup(key)
+            if path:
+                return path, False
+            part, sha256, size = self._download(url, key, cancelled)
+            return self._commit(key, part, sha256, size, suffix), True
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+
+    def _download(self, url, key, cancelled):
+        """下载到 .part 文件，已有的部分用 Range 续传；返回 (.part 路径, sha256, 字节数)"""
+        part = os.path.join(self.partial_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".part")
+        for attempt in range(MAX_ATTEMPTS):
+            # 续传前先把已有部分算进哈希，之后边收边算，不用整个文件再读一遍
+            sha256 = hashlib.sha256()
+            offset = 0
+            if os.path.exists(part):
+                with open(part, "rb") as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                        sha256.update(chunk)
+                        offset += len(chunk)
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                with self.session.get(url, headers=headers, stream=True, timeout=30) as r:
+                    if r.status_code == 416:
+                        # 已有部分和服务器上的文件对不上，从头下载
+                        os.remove(part)
+                        continue
+                    if r.status_code in (403, 404, 410):
+                        raise AttachmentError(f"HTTP {r.status_code}（链接可能已过期）", retry=False)
+                    if r.status_code not in (200, 206):
+                        raise AttachmentError(f"HTTP {r.status_code}")
+                    if r.status_code == 200 and offset:
+                        # 服务器不支持续传，整个重下
+                        sha256 = hashlib.sha256()
+                        offset = 0
+                    with open(part, "ab" if offset else "wb") as f:
+                        for chunk in r.iter_content(CHUNK_SIZE):
+                            if cancelled is not None and cancelled.is_set():
+                                raise AttachmentError("已取消", retry=False)
+                            self.limiter.consume(len(chunk))
+                            f.write(chunk)
+                            sha256.update(chunk)
+                            offset += len(chunk)
+                            metrics.inc("attachment_bytes_downloaded_total", len(chunk))
+                return part, sha256.hexdigest(), offset
+            except AttachmentError as e:
+                if not e.retry or attempt == MAX_ATTEMPTS - 1:
+                    raise
+            except requests.RequestException as e:
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise AttachmentError(str(e)) from e
+            time.sleep(min(2 ** attempt, 10))
+        raise AttachmentError("下载失败")
+
+    def _commit(self, key, part, sha256, size, suffix):
+        """.part 移到内容寻址的位置（同样内容已存在时直接丢掉），再写索引"""
+        rel = f"{sha256[:2]}/{sha256}{suffix}"
+        path = os.path.join(self.objects_dir, rel)
+        if os.path.exists(path):
+            os.remove(part)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(part, path)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO attachments (key, sha256, size, object, fetched_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, sha256, size, rel, now, now),
+            )
+        return path
+
+    def evict(self):
+        """删掉过期的 .part，再按最近使用时间淘汰对象（连同导出目录里的链接）直到不超过 max_bytes；返回淘汰的对象数
+
+        同一文件的多个硬链接只算一次；复制出来的副本单独计数
+        """
+        now = time.time()
+        seen = set()
+        total = 0
+        for name in os.listdir(self.partial_dir):
+            path = os.path.join(self.partial_dir, name)
+            try:
+                st = os.stat(path)
+                if now - st.st_mtime > PARTIAL_TTL:
+                    os.remove(path)
+                else:
+                    total += st.st_size
+            except OSError:
+                pass
+        with self._lock:
+            objects = self._conn.execute(
+                "SELECT object, MAX(used_at) FROM attachments GROUP BY object ORDER BY MAX(used_at)"
+            ).fetchall()
+            links = {}
+            for path, obj in self._conn.execute("SELECT path, object FROM links").fetchall():
+                links.setdefault(obj, []).append(path)
+
+        def disk_size(paths):
+            size = 0
+            for path in paths:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if file_key(st) not in seen:
+                    seen.add(file_key(st))
+                    size += st.st_size
+            return size
+
+        sizes = {}
+        for obj, _ in objects:
+            sizes[obj] = disk_size([os.path.join(self.objects_dir, obj)] + links.get(obj, []))
+            total += sizes[obj]
+        if not self.max_bytes or total <= self.max_bytes:
+            return 0
+
+        removed = 0
+        for obj, used_at in objects:
+            if total <= self.max_bytes:
+                break
+            if now - used_at < MIN_IDLE_SECONDS:
+                continue
+            for path in [os.path.join(self.objects_dir, obj)] + links.get(obj, []):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM attachments WHERE object = ?", (obj,))
+                self._conn.execute("DELETE FROM links WHERE object = ?", (obj,))
+            total -= sizes[obj]
+            removed += 1
+        return removed
+
+
+class AttachmentArchiver:
+    """一次导出用的下载器：localize() 立即返回本地相对路径，下载在后台线程池里进行，wait() 等全部完成
+
+    下载失败时这个路径上没有文件，所以导出文件里总是同时保留原链接
+
+    check_cancelled 在排队等待和 wait() 里定期调用，抛出的异常（如 JobCancelled）原样向上传
+    """
+
+    def __init__(self, store=None, workers=ATTACHMENT_WORKERS, export_dir=EXPORT_DIR, check_cancelled=None):
+        self.store = store or get_store()
+        self.export_dir = export_dir
+        self.check_cancelled = check_cancelled
+        self.cancelled = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="attachment")
+        self._slots = threading.BoundedSemaphore(workers * QUEUE_PER_WORKER)
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._closed = False
+        self.stats = {"downloaded": 0, "reused": 0, "failed": 0}
+        self.failed_urls = []
+
+    def localize(self, url):
+        """附件链接 → 导出文件里写的本地相对路径（相对 exports/）；不是 Discord 附件链接时返回 None"""
+        parsed = parse_attachment_url(url)
+        if parsed is None:
+            return None
+        key, rel = parsed
+        if key in self._futures:
+            return rel
+        while not self._slots.acquire(timeout=1):
+            if self.check_cancelled:
+                self.check_cancelled()
+        self._futures[key] = self._pool.submit(self._archive, url, key, rel)
+        return rel
+
+    def _archive(self, url, key, rel):
+        result = "failed"
+        try:
+            path, downloaded = self.store.fetch(url, key, object_suffix(rel), self.cancelled)
+            self.store.link(path, os.path.join(self.export_dir, rel))
+            result = "downloaded" if downloaded else "reused"
+        except Exception as e:
+            # 任何异常都只算这个附件失败，不能让线程池吞掉异常后漏记
+            with self._lock:
+                self.failed_urls.append(f"{url.split('?', 1)[0]}：{e}")
+        finally:
+            self._slots.release()
+        with self._lock:
+            self.stats[result] += 1
+        metrics.inc("attachment_downloads_total", result=result)
+
+    def wait(self, on_progress=None):
+        """等全部附件处理完，返回统计；on_progress(已完成, 总数) 每秒左右调用一次"""
+        pending = set(self._futures.values())
+        total = len(pending)
+        while pending:
+            _, pending = wait(pending, timeout=1)
+            if self.check_cancelled:
+                self.check_cancelled()
+            if on_progress:
+                on_progress(total - len(pending), total)
+        return {**self.stats, "total": total, "failed_urls": self.failed_urls[:20]}
+
+    def close(self, cancel=False):
+        """结束线程池；cancel=True 时丢掉排队中的附件并中止正在下的（.part 留着下次续传）"""
+        if self._closed:
+            return
+        self._closed = True
+        if cancel:
+            self.cancelled.set()
+        self._pool.shutdown(wait=True, cancel_futures=cancel)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """进程内共享一个附件库，第一次要下载附件时才建目录和索引"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = AttachmentStore()
+        return _store
@@ -0,0 +1,116 @@
+"""
+Excel 导出基准：旧版逐格写入的 Workbook vs write-only ExcelWriter
+每种写法在独立子进程里运行，分别统计耗时和峰值内存（RSS）
+
+用法：python benchmarks/bench_excel.py --rows 200000
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 2026-03-02 前后的 snowflake，synthetic_threads 生成的消息 id 从这里递增
+SNOWFLAKE_BASE = (1772400000000 - 1420070400000) << 22
+
+
+def synthetic_threads(rows, per_thread=500):
+    """生成与 do_export 同结构的帖子流，消息按需生成，不占额外内存"""
+    def messages(t, n):
+        for k in range(n):
+            yield {
+                "id": ((t * per_thread + k) << 22) + SNOWFLAKE_BASE,
+                "guild_id": "1",
+                "channel_id": t,
+                "author_id": k % 97,
+                "reference_id": None,
+                "author": f"user{k % 97}",
+                "time": "2026-03-02 14:30:00",
+                "content": f"第 {t} 帖第 {k} 条消息 " + "内容" * 40,
+                "attachments": "",
+                "link": f"https://discord.com/channels/1/{t}/{k}",
+            }
+
+    t = 0
+    while rows > 0:
+        n = min(per_thread, rows)
+        yield {"name": f"帖子 {t}", "created": "2026-03-02 14:30", "channel": f"#频道{t % 3}",
+               "messages": messages(t, n)}
+        rows -= n
+        t += 1
+
+
+def legacy_export_to_excel(threads_data, filename):
+    """改造前的实现：普通 Workbook + 逐格 ws.cell()"""
+    import openpyxl
+    from openpyxl.styles import Font, PatternFill
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "消息导出"
+    headers = ["频道/帖子", "创建时间", "消息作者", "消息时间", "消息内容", "附件", "消息链接"]
+    for col, h in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=col, value=h)
+        cell.font = Font(bold=True, color="FFFFFF")
+        cell.fill = PatternFill(start_color="5865F2", end_color="5865F2", fill_type="solid")
+    row = 2
+    for thread in threads_data:
+        for msg in thread["messages"]:
+            ws.cell(row=row, column=1, value=thread["name"])
+            ws.cell(row=row, column=2, value=thread["created"])
+            ws.cell(row=row, column=3, value=msg["author"])
+            ws.cell(row=row, column=4, value=msg["time"])
+            ws.cell(row=row, column=5, value=msg["content"])
+            ws.cell(row=row, column=6, value=msg["attachments"])
+            ws.cell(row=row, column=7, value=msg["link"])
+            row += 1
+    wb.save(filename)
+    return row - 1
+
+
+def run_one(mode, rows, filename):
+    start = time.perf_counter()
+    if mode == "legacy":
+        legacy_export_to_excel(synthetic_threads(rows), filename)
+    else:
+        from app import ExcelWriter, write_export
+        write_export(synthetic_threads(rows), [ExcelWriter(filename, sheet_per_channel=(mode == "per_channel"))])
+    elapsed = time.perf_counter() - start
+    # Linux 下 ru_maxrss 单位是 KB
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"mode": mode, "rows": rows, "seconds": round(elapsed, 2), "peak_rss_mb": round(peak_mb, 1),
+            "file_mb": round(os.path.getsize(filename) / 1024 / 1024, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--modes", default="legacy,write_only,per_channel")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        with tempfile.TemporaryDirectory() as tmp:
+            print(json.dumps(run_one(args.child, args.rows, os.path.join(tmp, "bench.xlsx"))))
+        return
+
+    print(f"{'模式':<12}{'行数':>10}{'耗时(s)':>10}{'峰值内存(MB)':>14}{'文件(MB)':>10}")
+    for mode in args.modes.split(","):
+        out = subprocess.run(
+            [sys.executable, __file__, "--rows", str(args.rows), "--child", mode],
+            capture_output=True, text=True, check=True, cwd=ROOT,
+            # 导入 app 时不要在仓库里建消息库和任务库，也不要领取真实的排队任务
+            env={**os.environ, "MESSAGE_STORE_PATH": ":memory:", "JOB_BACKEND": "memory"},
+        )
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{r['mode']:<12}{r['rows']:>10}{r['seconds']:>10}{r['peak_rss_mb']:>14}{r['file_mb']:>10}")
+
+
+if __name__ == "__main__":
+    main()
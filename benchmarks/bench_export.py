@@ -0,0 +1,162 @@
+"""
+离线导出基准：启动本地假 Discord API（fake_discord.py），对整条导出链路计时
+每个场景在独立子进程里运行（消息库用 :memory:，每次都从假服务器完整抓取），统计耗时、吞吐、请求数、
+429 次数和峰值内存（RSS）；writer:* 场景不联网，只测各写出格式
+
+用法：python benchmarks/bench_export.py --forums 2 --threads 200 --messages 500
+      python benchmarks/bench_export.py --cases do_export:txt,export_channels --json results.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+from fake_discord import add_arguments  # noqa: E402
+from jobs import FINISHED_STATES  # noqa: E402
+
+CASES = ("do_export:txt,do_export:excel,do_export:html,do_export:ndjson.zst,do_export:parquet,export_channels,"
+         "writer:txt,writer:excel,writer:html,writer:ndjson,writer:ndjson.gz,writer:ndjson.zst,writer:parquet")
+# ndjson 场景名里的扩展名 → do_export 的 compression 参数
+NDJSON_COMPRESSION = {"ndjson": None, "ndjson.gz": "gzip", "ndjson.zst": "zstd"}
+
+
+def fetch_json(url):
+    with urllib.request.urlopen(url) as resp:
+        return json.load(resp)
+
+
+def run_do_export(fmt, urls, days):
+    import app
+    date_to = datetime.now()
+    compression = NDJSON_COMPRESSION.get(fmt)
+    if fmt in NDJSON_COMPRESSION:
+        fmt = "ndjson"
+    job = app.jobs.submit(app.do_export, urls, date_to - timedelta(days=days), date_to, fmt, kind="export",
+                          compression=compression)
+    version = 0
+    while job.to_dict()["state"] not in FINISHED_STATES:
+        version = job.wait_for_change(version)
+    status = job.to_dict()
+    if status["state"] != "done":
+        raise RuntimeError(f"导出失败：{status.get('error')}")
+    return status["result"]["messages"]
+
+
+def run_export_channels(urls, days):
+    import daily_report
+    date_to = datetime.now()
+    # export_channels 会逐频道打印进度，基准输出里不需要
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, stats = daily_report.export_channels(urls, date_to - timedelta(days=days), date_to)
+    return stats["total_messages"]
+
+
+def run_writer(fmt, rows):
+    from app import ExcelWriter, HtmlWriter, NdjsonWriter, ParquetWriter, TxtWriter, write_export
+    from bench_excel import synthetic_threads
+    writer = {
+        "txt": lambda: TxtWriter("bench.txt"),
+        "excel": lambda: ExcelWriter("bench.xlsx"),
+        "html": lambda: HtmlWriter("bench.html"),
+        "ndjson": lambda: NdjsonWriter("bench.ndjson"),
+        "ndjson.gz": lambda: NdjsonWriter("bench.ndjson.gz", "gzip"),
+        "ndjson.zst": lambda: NdjsonWriter("bench.ndjson.zst", "zstd"),
+        "parquet": lambda: ParquetWriter("bench.parquet"),
+    }[fmt]
+    _, count = write_export(synthetic_threads(rows), [writer()])
+    return count
+
+
+def run_one(case, urls, days, rows):
+    start = time.perf_counter()
+    name, _, fmt = case.partition(":")
+    if name == "do_export":
+        messages = run_do_export(fmt, urls, days)
+    elif name == "export_channels":
+        messages = run_export_channels(urls, days)
+    else:
+        messages = run_writer(fmt, rows)
+    elapsed = time.perf_counter() - start
+    # Linux 下 ru_maxrss 单位是 KB
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"case": case, "messages": messages, "seconds": round(elapsed, 2), "peak_rss_mb": round(peak_mb, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument("--cases", default=CASES)
+    parser.add_argument("--json", help="把结果另存为 JSON 文件")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--urls", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    # writer:* 场景的行数与假服务器上的消息总数相同，便于对照
+    rows = (args.forums * args.threads + args.channels) * args.messages
+
+    if args.child:
+        urls = json.loads(args.urls) if args.urls else []
+        print(json.dumps(run_one(args.child, urls, args.days, rows)))
+        return
+
+    fake_args = [
+        "--port", "0", "--forums", str(args.forums), "--threads", str(args.threads),
+        "--channels", str(args.channels), "--messages", str(args.messages), "--days", str(args.days),
+        "--latency-ms", str(args.latency_ms), "--bucket-limit", str(args.bucket_limit),
+        "--bucket-reset", str(args.bucket_reset), "--global-rate", str(args.global_rate),
+        "--random-429", str(args.random_429),
+    ]
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, "fake_discord.py")] + fake_args,
+                              stdout=subprocess.PIPE, text=True)
+    results = []
+    try:
+        api_base = server.stdout.readline().strip()
+        origin = api_base.rsplit("/api/", 1)[0]
+        urls = fetch_json(f"{origin}/_urls")["urls"]
+        print(f"假服务器 {api_base}：{len(urls)} 个论坛/频道，共 {fetch_json(origin + '/_stats')['total_messages']} 条消息")
+        print(f"{'场景':<18}{'消息数':>10}{'耗时(s)':>10}{'消息/s':>10}{'请求数':>8}{'请求/s':>8}"
+              f"{'429':>6}{'峰值内存(MB)':>14}")
+        for case in args.cases.split(","):
+            before = fetch_json(f"{origin}/_stats")
+            with tempfile.TemporaryDirectory() as tmp:
+                out = subprocess.run(
+                    [sys.executable, __file__, "--child", case, "--urls", json.dumps(urls)] + fake_args[2:],
+                    capture_output=True, text=True, check=True, cwd=tmp,
+                    # 每个场景一个空的工作目录和内存消息库，导出文件、断点和任务都不落到仓库里
+                    env={**os.environ, "PYTHONPATH": ROOT, "DISCORD_API_BASE": api_base,
+                         "DISCORD_BOT_TOKEN": "bench", "MESSAGE_STORE_PATH": ":memory:", "JOB_BACKEND": "memory"},
+                )
+            after = fetch_json(f"{origin}/_stats")
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            r["requests"] = after["requests"] - before["requests"]
+            r["rate_limited"] = after["rate_limited"] - before["rate_limited"]
+            seconds = r["seconds"] or 0.01
+            r["messages_per_sec"] = round(r["messages"] / seconds)
+            r["requests_per_sec"] = round(r["requests"] / seconds, 1)
+            results.append(r)
+            print(f"{r['case']:<18}{r['messages']:>10}{r['seconds']:>10}{r['messages_per_sec']:>10}"
+                  f"{r['requests']:>8}{r['requests_per_sec']:>8}{r['rate_limited']:>6}{r['peak_rss_mb']:>14}")
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+消息常驻内存基准：原始 Discord JSON vs 旧版 API 同形 dict vs MessageRecord
+模拟 daily_report 把整周消息留在内存里的场景，每种写法在独立子进程里运行，统计耗时和峰值内存（RSS）
+
+用法：python benchmarks/bench_records.py --messages 500000
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PAGE_SIZE = 100
+
+
+def synthetic_pages(count, channel_id=1400000000000000000):
+    """按页产出 Discord 返回的 JSON 文本，字段与真实消息对象一致（author、embeds、reactions 等）"""
+    base_id = 1480000000000000000
+    for start in range(0, count, PAGE_SIZE):
+        page = []
+        for k in range(start, min(start + PAGE_SIZE, count)):
+            uid = 1372503951869607976 + k % 500
+            page.append({
+                "type": 0 if k % 7 else 19,
+                "id": str(base_id + k * 4194304),
+                "channel_id": str(channel_id),
+                "author": {
+                    "id": str(uid),
+                    "username": f"user{k % 500}",
+                    "global_name": f"用户{k % 500}",
+                    "avatar": "a1b2c3d4e5f60718293a4b5c6d7e8f90",
+                    "discriminator": "0",
+                    "public_flags": 0,
+                    "flags": 0,
+                    "banner": None,
+                    "accent_color": None,
+                    "avatar_decoration_data": None,
+                },
+                "content": f"第 {k} 条消息 " + "内容" * (k % 40),
+                "timestamp": "2026-03-02T14:30:00.000000+00:00",
+                "edited_timestamp": None,
+                "tts": False,
+                "mention_everyone": False,
+                "mentions": [],
+                "mention_roles": [],
+                "attachments": [
+                    {"id": str(base_id + k), "filename": "image.png", "size": 123456,
+                     "url": f"https://cdn.discordapp.com/attachments/{channel_id}/{k}/image.png",
+                     "proxy_url": f"https://media.discordapp.net/attachments/{channel_id}/{k}/image.png",
+                     "width": 1280, "height": 720, "content_type": "image/png"}
+                ] if k % 10 == 0 else [],
+                "embeds": [
+                    {"type": "link", "url": "https://example.com/article", "title": "示例文章",
+                     "description": "链接预览" * 10, "provider": {"name": "Example"}}
+                ] if k % 15 == 0 else [],
+                "components": [],
+                "reactions": [
+                    {"emoji": {"id": None, "name": "👍"}, "count": 3, "count_details": {"burst": 0, "normal": 3},
+                     "burst_colors": [], "me_burst": False, "burst_me": False, "me": False, "burst_count": 0}
+                ] if k % 5 == 0 else [],
+                "pinned": False,
+                "flags": 0,
+                "message_reference": {"type": 0, "channel_id": str(channel_id),
+                                      "message_id": str(base_id + (k - 1) * 4194304)} if k % 7 == 0 and k else None,
+            })
+        yield json.dumps(page, ensure_ascii=False)
+
+
+def legacy_message(channel_id, msg):
+    """改造前 row_to_message 的返回值：与 Discord API 同形的嵌套 dict"""
+    from message_store import message_row
+    mid, channel_id, author_id, author, content, attachments, ref = message_row(channel_id, msg)
+    out = {
+        "id": str(mid),
+        "channel_id": str(channel_id),
+        "author": {"id": str(author_id) if author_id else None, "username": author},
+        "content": content or "",
+        "attachments": [{"url": url} for url in json.loads(attachments or "[]")],
+    }
+    if ref:
+        out["message_reference"] = {"message_id": str(ref)}
+    return out
+
+
+def run_one(mode, count):
+    from message_store import message_row, row_to_message
+    channel_id = 1400000000000000000
+    kept = []
+    start = time.perf_counter()
+    for page_json in synthetic_pages(count, channel_id):
+        page = json.loads(page_json)
+        if mode == "raw":
+            kept.extend(page)
+        elif mode == "dict":
+            kept.extend(legacy_message(channel_id, msg) for msg in page)
+        else:
+            # 与 MessageStore 一致：解析后立即转成行，原始 JSON 随本页一起丢弃
+            kept.extend(row_to_message(message_row(channel_id, msg)) for msg in page)
+        del page
+    elapsed = time.perf_counter() - start
+    # Linux 下 ru_maxrss 单位是 KB
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"mode": mode, "messages": len(kept), "seconds": round(elapsed, 2), "peak_rss_mb": round(peak_mb, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500000)
+    parser.add_argument("--modes", default="raw,dict,record")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_one(args.child, args.messages)))
+        return
+
+    print(f"{'模式':<10}{'消息数':>10}{'耗时(s)':>10}{'峰值内存(MB)':>14}")
+    for mode in args.modes.split(","):
+        out = subprocess.run(
+            [sys.executable, __file__, "--messages", str(args.messages), "--child", mode],
+            capture_output=True, text=True, check=True, cwd=ROOT,
+            env={**os.environ, "MESSAGE_STORE_PATH": ":memory:"},
+        )
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{r['mode']:<10}{r['messages']:>10}{r['seconds']:>10}{r['peak_rss_mb']:>14}")
+
+
+if __name__ == "__main__":
+    main()
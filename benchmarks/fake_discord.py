@@ -0,0 +1,351 @@
+"""
+本地假 Discord API - 离线压测和调试用
+按参数生成一个合成服务器：若干论坛（每个 N 个帖子）和文字频道，每个帖子/频道 M 条消息；
+消息按 id 现算，不占内存。返回与真实接口一致的 X-RateLimit-* 响应头，超出额度时返回 429
+
+用法：python benchmarks/fake_discord.py --port 8555 --forums 2 --threads 200 --messages 500
+然后 DISCORD_API_BASE=http://127.0.0.1:8555/api/v9 python app.py 即可让整个应用连到它
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DISCORD_EPOCH = 1420070400000
+API_PREFIX = "/api/v9"
+SNOWFLAKE_RE = re.compile(r"/\d{15,}")
+
+
+def snowflake_at(ms, salt=0):
+    return ((ms - DISCORD_EPOCH) << 22) + salt
+
+
+def iso(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).isoformat()
+
+
+class MessageIds:
+    """一个频道的消息 id 序列：从 start_ms 起每 step_ms 一条，按下标现算，可直接 bisect"""
+
+    def __init__(self, start_ms, step_ms, count, salt):
+        self.start_ms = start_ms
+        self.step_ms = step_ms
+        self.count = count
+        self.salt = salt
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, k):
+        return snowflake_at(self.start_ms + k * self.step_ms, self.salt)
+
+
+class SyntheticGuild:
+    """合成的服务器数据：论坛、帖子、文字频道和消息，全部由参数确定"""
+
+    def __init__(self, forums=2, threads=100, channels=2, messages=500, days=7, users=200,
+                 active_ratio=0.1, now=None):
+        self.users = users
+        now_ms = int((now or datetime.now()).timestamp() * 1000)
+        start_ms = now_ms - days * 86400 * 1000
+        self.guild_id = snowflake_at(now_ms - 400 * 86400 * 1000)
+        self.channels = {}
+        self.forums = []
+        self.texts = []
+        self.threads = {}
+        self.message_ids = {}
+        salt = 0
+
+        def new_channel(ms):
+            nonlocal salt
+            salt += 1
+            return snowflake_at(ms, salt & 0x3FFFFF)
+
+        for f in range(forums):
+            fid = new_channel(now_ms - 365 * 86400 * 1000 + f)
+            self.forums.append(fid)
+            self.channels[fid] = {"id": str(fid), "type": 15, "guild_id": str(self.guild_id),
+                                  "name": f"论坛-{f}", "parent_id": None}
+            self.threads[fid] = []
+            span = now_ms - start_ms
+            for t in range(threads):
+                created = start_ms + (t * span) // max(threads, 1)
+                tid = new_channel(created)
+                archived = t < threads * (1 - active_ratio)
+                ids = MessageIds(created, max(1, (now_ms - created) // max(messages, 1)), messages, salt & 0x3FFFFF)
+                self.message_ids[tid] = ids
+                thread = {
+                    "id": str(tid), "type": 11, "guild_id": str(self.guild_id), "parent_id": str(fid),
+                    "name": f"帖子 {f}-{t}", "message_count": messages,
+                    "last_message_id": str(ids[messages - 1]) if messages else None,
+                    "thread_metadata": {"archived": archived, "locked": False,
+                                        "archive_timestamp": iso(min(created + 86400 * 1000, now_ms))},
+                }
+                self.channels[tid] = thread
+                self.threads[fid].append(thread)
+
+        for c in range(channels):
+            cid = new_channel(now_ms - 365 * 86400 * 1000 + forums + c)
+            ids = MessageIds(start_ms, max(1, (now_ms - start_ms) // max(messages, 1)), messages, salt & 0x3FFFFF)
+            self.message_ids[cid] = ids
+            self.texts.append(cid)
+            self.channels[cid] = {"id": str(cid), "type": 0, "guild_id": str(self.guild_id), "name": f"频道-{c}",
+                                  "parent_id": None, "last_message_id": str(ids[messages - 1]) if messages else None}
+
+    @property
+    def total_messages(self):
+        return sum(len(ids) for ids in self.message_ids.values())
+
+    def urls(self):
+        """导出用的频道链接：每个论坛和文字频道各一个"""
+        return [f"https://discord.com/channels/{self.guild_id}/{cid}" for cid in self.forums + self.texts]
+
+    def message(self, channel_id, ids, k):
+        uid = 1372503951869607976 + (k * 7919 + channel_id) % self.users
+        msg = {
+            "type": 0,
+            "id": str(ids[k]),
+            "channel_id": str(channel_id),
+            "author": {"id": str(uid), "username": f"user{uid % self.users}", "global_name": f"用户{uid % self.users}",
+                       "avatar": "a1b2c3d4e5f60718293a4b5c6d7e8f90", "discriminator": "0", "public_flags": 0},
+            "content": f"第 {k} 条消息 message #{k} " + "内容 content " * (k % 12),
+            "timestamp": iso(ids.start_ms + k * ids.step_ms),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "components": [],
+            "pinned": False,
+            "flags": 0,
+        }
+        if k % 10 == 0:
+            msg["attachments"] = [{"id": str(ids[k] + 1), "filename": "image.png", "size": 123456,
+                                   "url": f"https://cdn.discordapp.com/attachments/{channel_id}/{ids[k]}/image.png",
+                                   "content_type": "image/png"}]
+        if k % 15 == 0:
+            msg["embeds"] = [{"type": "link", "url": "https://example.com/article", "title": "示例文章"}]
+        if k % 7 == 0 and k:
+            msg["type"] = 19
+            msg["message_reference"] = {"type": 0, "channel_id": str(channel_id), "message_id": str(ids[k - 1])}
+        return msg
+
+    def messages(self, channel_id, params):
+        """与真实接口一致：before / after / 默认最新，每页最多 limit 条，新消息在前"""
+        ids = self.message_ids.get(channel_id)
+        if ids is None:
+            return None
+        limit = max(1, min(int(params.get("limit", 50)), 100))
+        if "after" in params:
+            lo = bisect.bisect_right(ids, int(params["after"]))
+            hi = min(lo + limit, len(ids))
+        else:
+            hi = bisect.bisect_left(ids, int(params["before"])) if "before" in params else len(ids)
+            lo = max(0, hi - limit)
+        return [self.message(channel_id, ids, k) for k in range(hi - 1, lo - 1, -1)]
+
+    def archived_threads(self, forum_id, params):
+        threads = sorted(
+            (t for t in self.threads.get(forum_id, []) if t["thread_metadata"]["archived"]),
+            key=lambda t: t["thread_metadata"]["archive_timestamp"], reverse=True,
+        )
+        if "before" in params:
+            threads = [t for t in threads if t["thread_metadata"]["archive_timestamp"] < params["before"]]
+        limit = max(1, min(int(params.get("limit", 50)), 100))
+        return {"threads": threads[:limit], "members": [], "has_more": len(threads) > limit}
+
+    def active_threads(self, forum_id=None):
+        forums = [forum_id] if forum_id else self.forums
+        return {"threads": [t for f in forums for t in self.threads.get(f, [])
+                            if not t["thread_metadata"]["archived"]], "members": []}
+
+
+class RateLimits:
+    """每个 (路由, major parameter) 一个固定窗口 bucket，外加每秒的全局额度"""
+
+    def __init__(self, bucket_limit=50, bucket_reset=1.0, global_rate=50, random_429=0.0):
+        self.bucket_limit = bucket_limit
+        self.bucket_reset = bucket_reset
+        self.global_rate = global_rate
+        self.random_429 = random_429
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._global = []
+
+    def check(self, path):
+        """返回 (状态码, 响应头, 429 的响应体或 None)"""
+        route = SNOWFLAKE_RE.sub("/{id}", path)
+        m = re.match(r"^/(channels|guilds)/(\d+)", path)
+        key = (route, m.group(2) if m else "")
+        bucket_hash = hashlib.sha1(route.encode()).hexdigest()[:12]
+        now = time.monotonic()
+        with self._lock:
+            self._global = [t for t in self._global if now - t < 1.0]
+            if len(self._global) >= self.global_rate:
+                retry = round(self._global[0] + 1.0 - now, 3)
+                return 429, {"X-RateLimit-Global": "true", "X-RateLimit-Scope": "global",
+                             "Retry-After": str(retry)}, {"message": "You are being rate limited.",
+                                                          "retry_after": retry, "global": True}
+            start, count = self._buckets.get(key, (now, 0))
+            if now - start >= self.bucket_reset:
+                start, count = now, 0
+            reset_after = round(start + self.bucket_reset - now, 3)
+            headers = {
+                "X-RateLimit-Limit": str(self.bucket_limit),
+                "X-RateLimit-Bucket": bucket_hash,
+                "X-RateLimit-Reset-After": str(reset_after),
+                "X-RateLimit-Reset": str(round(time.time() + reset_after, 3)),
+            }
+            if count >= self.bucket_limit or (self.random_429 and random.random() < self.random_429):
+                headers.update({"X-RateLimit-Remaining": "0", "X-RateLimit-Scope": "user",
+                                "Retry-After": str(reset_after)})
+                return 429, headers, {"message": "You are being rate limited.",
+                                      "retry_after": reset_after, "global": False}
+            self._buckets[key] = (start, count + 1)
+            self._global.append(now)
+            headers["X-RateLimit-Remaining"] = str(self.bucket_limit - count - 1)
+            return 200, headers, None
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+
+    def record(self, status):
+        with self._lock:
+            self.requests += 1
+            if status == 429:
+                self.rate_limited += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {"requests": self.requests, "rate_limited": self.rate_limited}
+
+
+def make_handler(guild, limits, stats, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status, body, headers=None):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            if url.path == "/_stats":
+                return self.send_json(200, dict(stats.to_dict(), total_messages=guild.total_messages))
+            if url.path == "/_urls":
+                return self.send_json(200, {"guild_id": str(guild.guild_id), "urls": guild.urls()})
+            if not url.path.startswith(API_PREFIX):
+                return self.send_json(404, {"message": "404: Not Found", "code": 0})
+            path = url.path[len(API_PREFIX):]
+            if not self.headers.get("Authorization"):
+                stats.record(401)
+                return self.send_json(401, {"message": "401: Unauthorized", "code": 0})
+
+            if latency:
+                time.sleep(latency)
+            status, headers, error = limits.check(path)
+            stats.record(status)
+            if status == 429:
+                return self.send_json(429, error, headers)
+
+            body = self.route(path, params)
+            if body is None:
+                return self.send_json(404, {"message": "Unknown Channel", "code": 10003}, headers)
+            return self.send_json(200, body, headers)
+
+        def route(self, path, params):
+            parts = path.strip("/").split("/")
+            if parts[0] == "guilds" and len(parts) >= 2 and int(parts[1]) == guild.guild_id:
+                if len(parts) == 2:
+                    return {"id": str(guild.guild_id), "name": "合成服务器"}
+                if parts[2] == "channels":
+                    return [guild.channels[c] for c in guild.forums + guild.texts]
+                if parts[2:] == ["threads", "active"]:
+                    return guild.active_threads()
+                return None
+            if parts[0] != "channels" or len(parts) < 2:
+                return None
+            channel_id = int(parts[1])
+            if channel_id not in guild.channels:
+                return None
+            if len(parts) == 2:
+                return guild.channels[channel_id]
+            if parts[2] == "messages":
+                return guild.messages(channel_id, params)
+            if parts[2:] == ["threads", "active"]:
+                return guild.active_threads(channel_id)
+            if parts[2:] == ["threads", "archived", "public"]:
+                return guild.archived_threads(channel_id, params)
+            return None
+
+    return Handler
+
+
+def serve(guild, port=0, latency=0.0, limits=None):
+    """在后台线程启动服务，返回 (server, 基础 URL)"""
+    stats = Stats()
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(guild, limits or RateLimits(), stats, latency))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def add_arguments(parser):
+    parser.add_argument("--forums", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=100, help="每个论坛的帖子数")
+    parser.add_argument("--channels", type=int, default=2, help="文字频道数")
+    parser.add_argument("--messages", type=int, default=500, help="每个帖子/频道的消息数")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--latency-ms", type=float, default=20, help="每个请求的模拟网络延迟")
+    parser.add_argument("--bucket-limit", type=int, default=50)
+    parser.add_argument("--bucket-reset", type=float, default=1.0)
+    parser.add_argument("--global-rate", type=int, default=50)
+    parser.add_argument("--random-429", type=float, default=0.0, help="随机返回 429 的概率")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8555)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    guild = SyntheticGuild(args.forums, args.threads, args.channels, args.messages, args.days)
+    limits = RateLimits(args.bucket_limit, args.bucket_reset, args.global_rate, args.random_429)
+    server, base = serve(guild, args.port, args.latency_ms / 1000, limits)
+    # 第一行输出基础 URL，bench_export.py 据此连接
+    print(f"{base}{API_PREFIX}", flush=True)
+    print(f"服务器 {guild.guild_id}：{len(guild.forums)} 个论坛、{len(guild.texts)} 个文字频道、"
+          f"共 {guild.total_messages} 条消息", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+导出任务断点 - 每个导出任务一个 JSON 文件，记录请求参数和各论坛的帖子列表
+进程被杀或重启后按断点继续任务（沿用原任务ID）；消息本身已逐页写入消息库，
+翻页游标即库里的已覆盖区间，恢复后从中断的那一页继续抓取
+"""
+
+import json
+import os
+import threading
+import time
+
+CHECKPOINT_DIR = os.environ.get("EXPORT_CHECKPOINT_DIR", os.path.join("data", "checkpoints"))
+
+
+class CheckpointStore:
+    def __init__(self, directory=CHECKPOINT_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _write(self, job_id):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(job_id)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._states[job_id], f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _state(self, job_id):
+        """内存里没有时读磁盘：任务可能是在别的进程里提交或中断的（调用方持有锁）"""
+        state = self._states.get(job_id)
+        if state is None:
+            try:
+                with open(self._path(job_id), "r", encoding="utf-8") as f:
+                    state = self._states[job_id] = json.load(f)
+            except (OSError, ValueError):
+                return None
+        return state
+
+    def update(self, job_id, **fields):
+        """合并字段并落盘"""
+        with self._lock:
+            state = self._state(job_id)
+            if state is None:
+                state = self._states[job_id] = {"job_id": job_id}
+            state.update(fields, updated_at=time.time())
+            self._write(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            state = self._state(job_id)
+            return dict(state) if state else None
+
+    def delete(self, job_id):
+        with self._lock:
+            self._states.pop(job_id, None)
+            try:
+                os.remove(self._path(job_id))
+            except OSError:
+                pass
+
+    def load_all(self):
+        """读出磁盘上所有未完成任务的断点（按创建时间排序），并接管到内存"""
+        try:
+            names = sorted(n for n in os.listdir(self.directory) if n.endswith(".json"))
+        except OSError:
+            return []
+        states = []
+        with self._lock:
+            for name in names:
+                try:
+                    with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                        state = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if "params" not in state:
+                    continue
+                self._states[state["job_id"]] = state
+                states.append(dict(state))
+        return sorted(states, key=lambda s: s.get("created_at", 0))
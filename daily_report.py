@@ -4,6 +4,8 @@ Discord 每日/每周报告自动化脚本
 """
 
 import requests as req
+import argparse
+import json
 import time
 import os
 import re
@@ -11,6 +13,14 @@ import sys
 from collections import Counter
 from datetime import datetime, timedelta
 from openai import OpenAI
+from discord_client import DiscordClient, fetch_all, resolve_channels, snowflake_bounds
+from message_store import MessageStore
+from llm_cache import llm_cache
+from metrics import metrics
+from summary_budget import estimate_tokens, render_sections, select_messages
+from analytics import analyze, render_tables
+from report_partitions import (THREAD_LOOKBACK_DAYS, PartitionStore, build_partition, day_bounds,
+                               merge_partitions, split_by_day)
 
 if sys.stdout.encoding != "utf-8":
     sys.stdout.reconfigure(encoding="utf-8")
@@ -33,9 +43,17 @@ CHANNEL_URLS = [
     "https://discord.com/channels/1372503951869607976/1477959294174494873",
 ]
 
-DAYS_BACK = 7
-API_BASE = "https://discord.com/api/v9"
+# 报告覆盖最近多少个完整自然日（不含今天），可用 --days 或 REPORT_DAYS 改成日报/月报
+DAYS_BACK = int(os.environ.get("REPORT_DAYS", "7"))
+REPORT_NAMES = {1: "日报", 7: "周报", 30: "月报", 31: "月报"}
 MAX_SUMMARY_CHARS = 120000
+# 单次摘要请求里聊天记录的 token 预算，超出时按重要度挑选消息
+SUMMARY_TOKEN_BUDGET = int(os.environ.get("SUMMARY_TOKEN_BUDGET", "40000"))
+# 全文超过预算这么多倍时挑选会丢掉太多内容，改走 map-reduce
+MAP_REDUCE_RATIO = 3
+# map-reduce 时按频道/帖子分块，每块的字符上限；要点笔记合并到不超过 MAX_SUMMARY_CHARS
+MAX_CHUNK_CHARS = 40000
+SUMMARY_CONCURRENCY = int(os.environ.get("SUMMARY_CONCURRENCY", "4"))
 
 # ========== Discord 抓取 ==========
 
@@ -47,33 +65,39 @@ def snowflake_to_datetime(sid):
     return datetime.fromtimestamp(((int(sid) >> 22) + 1420070400000) / 1000)
 
 
-def api_get(endpoint, params=None):
-    url = f"{API_BASE}{endpoint}"
-    while True:
-        r = req.get(url, headers=get_headers(), params=params)
-        if r.status_code == 429:
-            retry = r.json().get("retry_after", 1)
-            print(f"  速率限制，等待 {retry}s...")
-            time.sleep(retry)
-            continue
-        return r
+discord = DiscordClient(get_headers)
+store = MessageStore()
+partitions_store = PartitionStore()
 
 
-def parse_url(url):
-    m = re.search(r"/channels/(\d+)/(\d+)", url)
-    return (m.group(1), m.group(2)) if m else (None, None)
+def api_get(endpoint, params=None):
+    return discord.get(
+        endpoint, params,
+        on_rate_limit=lambda retry: print(f"  速率限制，等待 {retry}s..."),
+    )
 
 
 def get_channel_info(channel_id):
     r = api_get(f"/channels/{channel_id}")
-    return r.json() if r.status_code == 200 else None
-
-
-def get_all_threads(forum_id):
-    threads = []
-    r = api_get(f"/channels/{forum_id}/threads/active")
-    if r.status_code == 200:
-        threads.extend(r.json().get("threads", []))
+    if r.status_code != 200:
+        return store.get_channel(channel_id)
+    info = r.json()
+    store.save_channel(info)
+    return info
+
+
+def get_all_threads(forum_id, active=None):
+    """活跃帖子每次都拉取（整服发现时已经拿到，由 active 传入）；归档帖子按归档时间倒序翻页，翻到库里已有的部分即停"""
+    if active is None:
+        active = []
+        r = api_get(f"/channels/{forum_id}/threads/active")
+        if r.status_code == 200:
+            active = r.json().get("threads", [])
+    store.save_threads(active)
+
+    known = store.latest_archive_timestamp(forum_id)
+    archived_threads = []
+    complete = False
     params = {"limit": 100}
     while True:
         r = api_get(f"/channels/{forum_id}/threads/archived/public", params)
@@ -82,111 +106,132 @@ def get_all_threads(forum_id):
         data = r.json()
         archived = data.get("threads", [])
         if not archived:
+            complete = True
             break
-        threads.extend(archived)
-        if not data.get("has_more"):
-            break
-        params["before"] = archived[-1]["thread_metadata"]["archive_timestamp"]
-    return threads
-
-
-def get_messages(channel_id, date_from, date_to):
-    messages = []
-    params = {"limit": 100}
-    while True:
-        r = api_get(f"/channels/{channel_id}/messages", params)
-        if r.status_code != 200:
-            break
-        batch = r.json()
-        if not batch:
-            break
-        for msg in batch:
-            t = snowflake_to_datetime(msg["id"])
-            if date_from and t < date_from:
-                continue
-            if date_to and t > date_to:
-                continue
-            messages.append(msg)
-        if len(batch) < 100:
+        archived_threads.extend(archived)
+        last_ts = archived[-1]["thread_metadata"]["archive_timestamp"]
+        if not data.get("has_more") or (known and last_ts <= known):
+            complete = True
             break
-        params["before"] = batch[-1]["id"]
-        time.sleep(0.3)
-    return messages
-
-
-def export_channels(urls, date_from, date_to):
-    all_text = []
-    ai_text = []
-    total_msgs = 0
-    author_counts = Counter()
-    covered_items = set()
-
-    for url in urls:
-        guild_id, channel_id = parse_url(url)
-        if not channel_id:
-            print(f"[跳过] 无效链接: {url}")
-            continue
-
-        info = get_channel_info(channel_id)
-        if not info:
-            print(f"[跳过] 无法获取频道信息: {channel_id}")
-            continue
-
+        params["before"] = last_ts
+
+    # 翻页中断时不入库，避免下次误以为更早的归档帖子都已同步
+    if not complete:
+        return active + archived_threads
+    store.save_threads(archived_threads)
+    return store.get_threads(forum_id)
+
+
+def get_messages(channel_id, date_from, date_to, last_message_id=None):
+    """先把消息增量同步到本地库再读出，重复导出重叠的时间段几乎不再请求 Discord；返回 (消息列表, 是否同步成功)"""
+    after, before = snowflake_bounds(date_from, date_to)
+    return store.load_messages(api_get, channel_id, after, before, last_message_id)
+
+
+def collect_sections(urls, date_from, date_to, threads_from=None):
+    """按频道顺序返回 ([(键, 所属频道ID, 标题, [MessageRecord...])], 同步失败的频道/帖子数)，
+    键形如 thread:ID / channel:ID，消息按 id 升序
+
+    论坛只取创建时间在 [threads_from, date_to] 内的帖子，threads_from 默认与 date_from 相同；
+    同步失败（含 5xx、429）的频道/帖子只用库里已有的消息，由调用方决定结果能不能长期保存
+    """
+    if threads_from is None:
+        threads_from = date_from
+    sections = []
+    failed = 0
+    channels = resolve_channels(api_get, urls, get_channel_info)
+    store.save_threads([info for _, info, _ in channels])
+    print(f"[频道] {len(urls)} 个链接 → {len(channels)} 个频道")
+    for guild_id, info, active_threads in channels:
+        channel_id = info["id"]
         ch_type = info.get("type")
         ch_name = info.get("name", "未知频道")
         print(f"[处理] #{ch_name} (type={ch_type})")
 
         if ch_type == 15:
-            threads = get_all_threads(channel_id)
+            threads = get_all_threads(channel_id, active_threads)
             print(f"  找到 {len(threads)} 个帖子")
-            for thread in threads:
-                tc = snowflake_to_datetime(thread["id"])
-                if date_from and tc < date_from:
-                    continue
-                if date_to and tc > date_to:
-                    continue
-                msgs = get_messages(thread["id"], date_from, date_to)
+            threads = [
+                t for t in threads
+                if not (threads_from and snowflake_to_datetime(t["id"]) < threads_from)
+                and not (date_to and snowflake_to_datetime(t["id"]) > date_to)
+            ]
+            results = fetch_all(threads, lambda t: get_messages(t["id"], date_from, date_to, t.get("last_message_id")))
+            for thread, (msgs, ok) in zip(threads, results):
+                failed += not ok
                 if msgs:
-                    msgs.sort(key=lambda m: m["id"])
-                    covered_items.add(f"thread:{thread['id']}")
-                    all_text.append(f"{'='*50}\n帖子: {thread['name']}\n{'='*50}")
-                    ai_text.append(f"{'='*50}\n帖子: {thread['name']}\n{'='*50}")
-                    for msg in msgs:
-                        author = msg.get("author", {}).get("username", "未知")
-                        t = snowflake_to_datetime(msg["id"]).strftime("%Y-%m-%d %H:%M:%S")
-                        content = msg.get("content", "")
-                        all_text.append(f"[{t}] {author}: {content}")
-                        ai_text.append(f"{author}: {content}")
-                        total_msgs += 1
-                        author_counts[author] += 1
-                    all_text.append("")
-                    ai_text.append("")
-                time.sleep(0.3)
+                    msgs.sort(key=lambda m: m.id)
+                    sections.append((f"thread:{thread['id']}", channel_id,
+                                     f"{'='*50}\n帖子: {thread['name']}\n{'='*50}", msgs))
         else:
-            msgs = get_messages(channel_id, date_from, date_to)
+            msgs, ok = get_messages(channel_id, date_from, date_to, info.get("last_message_id"))
+            failed += not ok
             if msgs:
-                msgs.sort(key=lambda m: m["id"])
-                covered_items.add(f"channel:{channel_id}")
-                all_text.append(f"{'='*50}\n频道: #{ch_name}\n{'='*50}")
-                ai_text.append(f"{'='*50}\n频道: #{ch_name}\n{'='*50}")
-                for msg in msgs:
-                    author = msg.get("author", {}).get("username", "未知")
-                    t = snowflake_to_datetime(msg["id"]).strftime("%Y-%m-%d %H:%M:%S")
-                    content = msg.get("content", "")
-                    all_text.append(f"[{t}] {author}: {content}")
-                    ai_text.append(f"{author}: {content}")
-                    total_msgs += 1
-                    author_counts[author] += 1
-                all_text.append("")
-                ai_text.append("")
+                msgs.sort(key=lambda m: m.id)
+                sections.append((f"channel:{channel_id}", channel_id, f"{'='*50}\n频道: #{ch_name}\n{'='*50}", msgs))
+    if failed:
+        print(f"[警告] {failed} 个频道/帖子同步失败，只用了库里已有的消息")
+    return sections, failed
+
+
+def build_report_data(sections, author_counts=None):
+    """sections → (完整 TXT, 摘要用的 [(标题, [MessageRecord...])], 统计)；author_counts 已算好时不再逐条计数"""
+    all_text = []
+    if author_counts is None:
+        author_counts = Counter(msg.author for _, _, _, msgs in sections for msg in msgs)
+    for _, _, header, msgs in sections:
+        all_text.append(header)
+        for msg in msgs:
+            t = snowflake_to_datetime(msg.id).strftime("%Y-%m-%d %H:%M:%S")
+            all_text.append(f"[{t}] {msg.author}: {msg.content}")
+        all_text.append("")
 
     stats = {
-        "total_messages": total_msgs,
+        "total_messages": sum(author_counts.values()),
         "active_users": len(author_counts),
-        "covered_items": len(covered_items),
-        "top_users": author_counts.most_common(10),
+        "covered_items": len(sections),
+        # 同样条数按名字排，直接抓取和合并分区的结果一致
+        "top_users": sorted(author_counts.items(), key=lambda kv: (-kv[1], kv[0]))[:10],
     }
-    return "\n".join(all_text), "\n".join(ai_text), stats
+    return "\n".join(all_text), [(header, msgs) for _, _, header, msgs in sections], stats
+
+
+def export_channels(urls, date_from, date_to):
+    """直接抓取整段时间，返回 (完整 TXT, 摘要用的 [(标题, [MessageRecord...])], 统计)"""
+    sections, _ = collect_sections(urls, date_from, date_to)
+    return build_report_data(sections)
+
+
+def load_partitions(urls, days):
+    """返回 days 各天的分区；缺的（或频道列表变了的）合成一段连续时间一次抓取，再按天拆开写入
+
+    有频道/帖子同步失败时这次照常用拆出的分区，但不写入，下次重新抓取，避免一次临时错误把不完整的一天固定下来
+    """
+    partitions = {day: partitions_store.get(day, urls) for day in days}
+    missing = [day for day in days if partitions[day] is None]
+    if missing:
+        print(f"[分区] 已有 {len(days) - len(missing)} 天，需要生成 {len(missing)} 天")
+        date_from, _ = day_bounds(missing[0])
+        _, date_to = day_bounds(missing[-1])
+        sections, failed = collect_sections(urls, date_from, date_to,
+                                            threads_from=date_from - timedelta(days=THREAD_LOOKBACK_DAYS))
+        by_day = split_by_day(sections, missing)
+        if failed:
+            print(f"[分区] 有同步失败的频道/帖子，这 {len(missing)} 天的分区不写入，下次重新生成")
+        for day in missing:
+            partitions[day] = build_partition(day, urls, by_day.get(day, []))
+            if not failed:
+                partitions_store.put(partitions[day])
+    else:
+        print(f"[分区] {len(days)} 天都已生成，不需要抓取")
+    return [partitions[day] for day in days]
+
+
+def export_days(urls, days):
+    """合并 days 各天的分区，返回值与 export_channels 相同"""
+    window_start, _ = day_bounds(days[0])
+    sections, author_counts, _ = merge_partitions(load_partitions(urls, days), window_start)
+    return build_report_data(sections, author_counts)
 
 
 def normalize_ai_base(base_url):
@@ -262,46 +307,15 @@ SUMMARY_PROMPT = """你是一个 Discord 社群运营分析师。请根据以下
 """
 
 
+ANALYTICS_HEADER = "以下统计表由程序遍历全部消息算出（不受聊天记录筛选影响），讨论热点、资源链接、问答和活跃用户请优先依据它们："
+
+
 def format_top_users(top_users):
     if not top_users:
         return "无"
     return "、".join(f"{name}({count})" for name, count in top_users)
 
 
-def trim_chat_text(chat_text):
-    if len(chat_text) <= MAX_SUMMARY_CHARS:
-        return chat_text, False
-
-    sections = [s for s in chat_text.split("\n\n") if s.strip()]
-    target = MAX_SUMMARY_CHARS // 2
-
-    front = []
-    front_len = 0
-    for section in sections:
-        size = len(section) + 2
-        if front_len + size > target:
-            break
-        front.append(section)
-        front_len += size
-
-    back = []
-    back_len = 0
-    remaining = sections[len(front):]
-    for section in reversed(remaining):
-        size = len(section) + 2
-        if back_len + size > target:
-            break
-        back.append(section)
-        back_len += size
-
-    trimmed = "\n\n".join(
-        front
-        + ["[...中间部分因消息过多已省略，完整聊天记录请以导出文件为准...]"]
-        + list(reversed(back))
-    )
-    return trimmed, True
-
-
 def build_overview(stats, period):
     return "\n".join(
         [
@@ -314,8 +328,9 @@ def build_overview(stats, period):
     )
 
 
-def build_summary_input(chat_text, stats, period):
-    trimmed_text, was_trimmed = trim_chat_text(chat_text)
+def build_summary_input(sections, stats, period, tables=""):
+    # 统计表占用的 token 从原文预算里扣掉，总输入规模不变
+    selected_text, kept, total = select_messages(sections, max(SUMMARY_TOKEN_BUDGET - estimate_tokens(tables), 0))
     meta = "\n".join(
         [
             "以下是程序预先计算的真实统计，请你在分析时参考：",
@@ -324,64 +339,218 @@ def build_summary_input(chat_text, stats, period):
             f"- 活跃用户数：{stats['active_users']}",
             f"- 涉及频道/帖子数：{stats['covered_items']}",
             f"- 活跃用户TOP10（真实计数）：{format_top_users(stats['top_users'])}",
-            f"- 聊天记录是否被截断：{'是' if was_trimmed else '否'}",
+            f"- 聊天记录是否经过筛选：" + (
+                f"是（按重要度保留 {kept}/{total} 条，省略处已标注）" if kept < total else "否"
+            ),
+            "",
+            ANALYTICS_HEADER,
+            tables,
             "",
             "聊天记录如下：",
-            trimmed_text,
+            selected_text,
         ]
     )
     return meta
 
 
-def generate_summary(ai_chat_text, stats, period):
+MAP_PROMPT = """你是一个 Discord 社群运营分析师。下面是本周聊天记录的一部分（若干频道/帖子）。
+请提取供周报使用的要点笔记，不要写成周报格式：
+- 正面反馈、建议、不满或 bug 反馈：每条附用户名和「原文引用」
+- 讨论话题：话题名称、简要说明、关键词、大致消息量
+- 重要消息与公告：发送者、时间、消息原文
+- 分享的链接/资源：分享者、资源描述、原始链接URL
+- 有趣或有价值的对话片段、金句：直接引用原文
+- 问答：提问者、问题、回答者、回答
+引用日语或英文时保留原文并附中文翻译。没有的类别直接省略。用中文书写，尽量精炼。
+"""
+
+MERGE_PROMPT = """你是一个 Discord 社群运营分析师。下面是同一周聊天记录不同部分提炼出的要点笔记。
+请把它们合并成一份更精炼的要点笔记：合并重复话题、保留最有代表性的原文引用、用户名和链接URL，
+保持与输入相同的类别划分，不要写成周报格式。用中文书写。
+"""
+
+SECTION_HEADER_RE = re.compile(r"(?m)^(?==+\n(?:帖子|频道): )")
+
+
+def split_sections(chat_text):
+    """按"帖子/频道"标题切成独立片段，每段自带标题"""
+    return [sec.strip("\n") for sec in SECTION_HEADER_RE.split(chat_text) if sec.strip()]
+
+
+def chunk_sections(sections, limit=MAX_CHUNK_CHARS):
+    """把片段装箱成不超过 limit 字符的块；单个超长片段按行拆开，续块重复标题"""
+    pieces = []
+    for sec in sections:
+        if len(sec) <= limit:
+            pieces.append(sec)
+            continue
+        lines = sec.split("\n")
+        header = "\n".join(lines[:3]) if lines and lines[0].startswith("=") else ""
+        cont_header = "\n".join([lines[0], lines[1] + "（续）", lines[2]]) if header else ""
+        body = lines[3:] if header else lines
+        cur, cur_len = [header] if header else [], len(header)
+        for line in body:
+            if cur_len + len(line) + 1 > limit and cur_len > len(cont_header):
+                pieces.append("\n".join(cur))
+                cur = [cont_header] if header else []
+                cur_len = len(cont_header)
+            cur.append(line[:limit])
+            cur_len += len(line[:limit]) + 1
+        if len(cur) > 1 or not header:
+            pieces.append("\n".join(cur))
+
+    chunks, cur, cur_len = [], [], 0
+    for piece in pieces:
+        if cur and cur_len + len(piece) + 2 > limit:
+            chunks.append("\n\n".join(cur))
+            cur, cur_len = [], 0
+        cur.append(piece)
+        cur_len += len(piece) + 2
+    if cur:
+        chunks.append("\n\n".join(cur))
+    return chunks
+
+
+def make_ai_client():
     base_url = normalize_ai_base(AI_API_BASE)
-    client = OpenAI(base_url=base_url, api_key=AI_API_KEY)
     print(f"  使用 API Base: {base_url}")
-    summary_input = build_summary_input(ai_chat_text, stats, period)
-    print(f"  发送给模型的文本长度: {len(summary_input)} 字符")
+    return OpenAI(base_url=base_url, api_key=AI_API_KEY)
+
 
+def call_model(client, system_prompt, user_input):
+    """按候选模型顺序调用，额度/服务不可用时退避重试；全部失败返回 None
+
+    任一候选模型对同样的 Prompt 和输入有缓存结果时直接返回，不发请求
+    """
     model_candidates = [
         "gemini-3-flash",       # 你之前跑通过，优先尝试
         "gemini-2.5-flash",     # 兼容兜底
         "gemini-2.5-flash-lite"
     ]
 
+    model_name, cached = llm_cache.get_any(system_prompt, user_input, model_candidates)
+    if cached:
+        print(f"  命中缓存: {model_name}")
+        return cached
+
     for model_name in model_candidates:
         for attempt in range(3):
             try:
                 print(f"  尝试模型: {model_name} (第{attempt+1}次)")
-                response = client.chat.completions.create(
-                    model=model_name,
-                    messages=[
-                        {"role": "system", "content": SUMMARY_PROMPT.strip()},
-                        {"role": "user", "content": summary_input},
-                    ],
-                )
+                with metrics.timer("llm_request_duration_seconds", model=model_name):
+                    response = client.chat.completions.create(
+                        model=model_name,
+                        messages=[
+                            {"role": "system", "content": system_prompt.strip()},
+                            {"role": "user", "content": user_input},
+                        ],
+                    )
                 text = response.choices[0].message.content or ""
                 if text.strip():
                     print(f"  成功使用模型: {model_name}")
+                    metrics.inc("llm_requests_total", model=model_name, outcome="ok")
+                    llm_cache.put(system_prompt, user_input, model_name, text.strip())
                     return text.strip()
+                metrics.inc("llm_requests_total", model=model_name, outcome="empty")
             except Exception as e:
                 err_str = str(e)
                 if "404" in err_str or "Not Found" in err_str or "model_not_found" in err_str:
+                    metrics.inc("llm_requests_total", model=model_name, outcome="not_found")
                     print(f"  模型不可用，切换下一个模型: {model_name}")
                     break
                 if "429" in err_str or "RESOURCE_EXHAUSTED" in err_str:
+                    metrics.inc("llm_requests_total", model=model_name, outcome="rate_limited")
                     wait = 15 * (attempt + 1)
                     print(f"  额度限制，等待 {wait}s 后重试...")
+                    metrics.inc("llm_retry_wait_seconds_total", wait, model=model_name)
                     time.sleep(wait)
                 elif "503" in err_str or "UNAVAILABLE" in err_str:
+                    metrics.inc("llm_requests_total", model=model_name, outcome="unavailable")
                     wait = 10 * (attempt + 1)
                     print(f"  服务暂不可用，等待 {wait}s 后重试...")
+                    metrics.inc("llm_retry_wait_seconds_total", wait, model=model_name)
                     time.sleep(wait)
                 else:
+                    metrics.inc("llm_requests_total", model=model_name, outcome="error")
                     print(f"  出错: {err_str[:200]}")
                     break
-    return "摘要生成失败"
+    return None
+
+
+def map_reduce_notes(client, chat_text):
+    """map：各块并发提炼要点笔记；reduce：笔记超长时分组合并，直到能放进一次请求
+
+    每轮合并份数至少减半，最后合成一份仍然超长时抛 ValueError，不截断笔记
+    """
+    chunks = chunk_sections(split_sections(chat_text))
+    print(f"  聊天记录分为 {len(chunks)} 块，并发数 {SUMMARY_CONCURRENCY}")
+    notes = fetch_all(chunks, lambda c: call_model(client, MAP_PROMPT, c), max_workers=SUMMARY_CONCURRENCY)
+    failed = sum(1 for n in notes if not n)
+    notes = [n for n in notes if n]
+
+    while notes and len("\n\n".join(notes)) > MAX_SUMMARY_CHARS:
+        if len(notes) == 1:
+            raise ValueError(f"要点笔记合并到一份后仍有 {len(notes[0])} 字符，超出上限 {MAX_SUMMARY_CHARS}")
+        groups = chunk_sections(notes)
+        if len(groups) > (len(notes) + 1) // 2:
+            # 单份笔记太长装不进同一块时两两合并，保证每轮都在减少
+            groups = ["\n\n".join(notes[i:i + 2]) for i in range(0, len(notes), 2)]
+        print(f"  合并 {len(notes)} 份笔记为 {len(groups)} 份...")
+        merged = fetch_all(groups, lambda g: call_model(client, MERGE_PROMPT, g), max_workers=SUMMARY_CONCURRENCY)
+        # 合并失败的组保留原笔记全文，下一轮继续合并
+        notes = [m or g for m, g in zip(merged, groups)]
+    return notes, len(chunks), failed
+
+
+def build_reduce_input(notes, stats, period, chunk_count, failed, tables=""):
+    # map_reduce_notes 已经把笔记合并到上限以内，这里不再截断
+    notes_text = "\n\n".join(f"--- 第 {i+1} 部分要点 ---\n{n}" for i, n in enumerate(notes))
+    meta = "\n".join(
+        [
+            "以下是程序预先计算的真实统计，请你在分析时参考：",
+            f"- 统计周期：{period}",
+            f"- 总消息数：{stats['total_messages']}",
+            f"- 活跃用户数：{stats['active_users']}",
+            f"- 涉及频道/帖子数：{stats['covered_items']}",
+            f"- 活跃用户TOP10（真实计数）：{format_top_users(stats['top_users'])}",
+            f"- 聊天记录因篇幅较长，已按频道/帖子分成 {chunk_count} 块分别提炼要点"
+            + (f"（其中 {failed} 块提炼失败）" if failed else "（覆盖全部聊天记录）"),
+            "",
+            ANALYTICS_HEADER,
+            tables,
+            "",
+            "聊天记录如下（分块提炼的要点笔记，原文引用均来自聊天记录）：",
+            notes_text,
+        ]
+    )
+    return meta
+
+
+def generate_summary(ai_sections, stats, period):
+    client = make_ai_client()
+    ai_chat_text = render_sections(ai_sections)
+    tokens = estimate_tokens(ai_chat_text)
+    print(f"  聊天记录约 {tokens} tokens，预算 {SUMMARY_TOKEN_BUDGET}")
+    with metrics.stage("analytics"):
+        tables = render_tables(analyze(ai_sections))
+    print(f"  统计表约 {estimate_tokens(tables)} tokens")
+    if tokens <= SUMMARY_TOKEN_BUDGET * MAP_REDUCE_RATIO:
+        summary_input = build_summary_input(ai_sections, stats, period, tables)
+    else:
+        try:
+            notes, chunk_count, failed = map_reduce_notes(client, ai_chat_text)
+        except ValueError as e:
+            print(f"  ❌ {e}")
+            return f"摘要生成失败：{e}"
+        if not notes:
+            return "摘要生成失败"
+        summary_input = build_reduce_input(notes, stats, period, chunk_count, failed, tables)
+    print(f"  发送给模型的文本长度: {len(summary_input)} 字符，约 {estimate_tokens(summary_input)} tokens")
+    return call_model(client, SUMMARY_PROMPT, summary_input) or "摘要生成失败"
 
 # ========== 飞书卡片发送 ==========
 
-def build_card(report, period):
+def build_card(report, period, report_name="周报"):
     sections = report.split("━━━")
     elements = []
     for section in sections:
@@ -397,7 +566,7 @@ def build_card(report, period):
         "msg_type": "interactive",
         "card": {
             "header": {
-                "title": {"content": f"📋 Discord 社群周报 ({period})", "tag": "plain_text"},
+                "title": {"content": f"📋 Discord 社群{report_name} ({period})", "tag": "plain_text"},
                 "template": "purple",
             },
             "elements": elements,
@@ -405,48 +574,79 @@ def build_card(report, period):
     }
 
 
-def send_lark(report, period):
-    payload = build_card(report, period)
+def print_metrics():
+    """各阶段耗时、Discord 请求/速率限制、大模型调用等指标的 JSON 汇总"""
+    print("--- 运行指标 ---")
+    print(json.dumps(metrics.summary(), ensure_ascii=False, indent=2))
+    print("--- 指标结束 ---\n")
+
+
+def send_lark(report, period, report_name="周报"):
+    payload = build_card(report, period, report_name)
     r = req.post(LARK_WEBHOOK, json=payload)
     print(f"[飞书] 状态码={r.status_code}, 返回={r.text}")
     return r.status_code == 200
 
 # ========== 主流程 ==========
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Discord 日报/周报/月报")
+    parser.add_argument("--days", type=int, default=DAYS_BACK,
+                        help=f"覆盖最近多少个完整自然日，1~{THREAD_LOOKBACK_DAYS}（默认 {DAYS_BACK}）")
+    parser.add_argument("--ingest", action="store_true", help="只生成缺少的日分区，不生成摘要、不发送")
+    args = parser.parse_args()
+    if not 1 <= args.days <= THREAD_LOOKBACK_DAYS:
+        parser.error(f"--days 只能在 1~{THREAD_LOOKBACK_DAYS} 之间")
+    return args
+
+
 def main():
+    args = parse_args()
     now = datetime.now()
-    date_from = now - timedelta(days=DAYS_BACK)
-    date_to = now
-    period = f"{date_from.strftime('%m/%d')} - {date_to.strftime('%m/%d')}"
+    today = now.date()
+    days = [today - timedelta(days=k) for k in range(args.days, 0, -1)]
+    period = f"{days[0].strftime('%m/%d')} - {days[-1].strftime('%m/%d')}"
+    report_name = REPORT_NAMES.get(args.days, f"{args.days}天报告")
 
     print(f"\n{'='*60}")
-    print(f"  Discord 周报自动生成")
+    print(f"  Discord {report_name}自动生成" if not args.ingest else "  Discord 日分区生成")
     print(f"  时间范围: {period}")
     print(f"  频道数: {len(CHANNEL_URLS)}")
     print(f"{'='*60}\n")
 
-    # 1. 导出
+    # 1. 导出：已有的日分区直接合并，缺的才抓取
     print("[Step 1/3] 导出聊天记录...")
-    chat_text, ai_chat_text, stats = export_channels(CHANNEL_URLS, date_from, date_to)
+    if args.ingest:
+        with metrics.stage("ingest"):
+            load_partitions(CHANNEL_URLS, days)
+        print_metrics()
+        return
+    with metrics.stage("export_channels"):
+        chat_text, ai_sections, stats = export_days(CHANNEL_URLS, days)
 
     if not chat_text.strip():
         print("[结束] 没有找到消息，跳过后续步骤")
+        print_metrics()
         return
 
     print(f"  导出完成: {stats['total_messages']} 条消息")
     print(f"  活跃用户: {stats['active_users']} 人")
-    print(f"  涉及频道/帖子: {stats['covered_items']} 个\n")
+    print(f"  涉及频道/帖子: {stats['covered_items']} 个")
+    latency = discord.latency_stats()
+    print(f"  Discord 请求: {latency['requests']} 次, 平均 {latency['avg']*1000:.0f}ms, "
+          f"p95 {latency['p95']*1000:.0f}ms\n")
 
     # 保存到本地
     os.makedirs("exports", exist_ok=True)
-    txt_path = f"exports/周报原始_{now.strftime('%Y%m%d_%H%M%S')}.txt"
+    txt_path = f"exports/{report_name}原始_{now.strftime('%Y%m%d_%H%M%S')}.txt"
     with open(txt_path, "w", encoding="utf-8") as f:
         f.write(chat_text)
     print(f"  已保存到: {txt_path}\n")
 
     # 2. Gemini 摘要
     print("[Step 2/3] 生成 Gemini 摘要...")
-    summary_body = generate_summary(ai_chat_text, stats, period)
+    with metrics.stage("summary"):
+        summary_body = generate_summary(ai_sections, stats, period)
     summary = build_overview(stats, period) + "\n\n━━━\n\n" + summary_body
     print(f"  摘要长度: {len(summary)} 字\n")
     print("--- 摘要预览 ---")
@@ -454,18 +654,23 @@ def main():
     if len(summary) > 500:
         print("...(截断)")
     print("--- 预览结束 ---\n")
+    cache_stats = llm_cache.stats()
+    print(f"  模型缓存: 命中 {cache_stats['hits']} 次, 未命中 {cache_stats['misses']} 次, "
+          f"命中率 {cache_stats['hit_rate']:.0%}\n")
 
     # 3. 发送飞书
     if "摘要生成失败" in summary:
         print("[跳过] 摘要生成失败，不发送到飞书\n")
     else:
         print("[Step 3/3] 发送到飞书群...")
-        ok = send_lark(summary, period)
+        with metrics.stage("send_lark"):
+            ok = send_lark(summary, period, report_name)
         if ok:
             print("  发送成功!\n")
         else:
             print("  发送失败，请检查 Webhook URL\n")
 
+    print_metrics()
     print(f"{'='*60}")
     print(f"  全部完成!")
     print(f"{'='*60}")
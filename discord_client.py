@@ -0,0 +1,391 @@
+"""
+Discord API 公共模块 - app.py 与 daily_report.py 共用
+速率限制：按 X-RateLimit-* 响应头跟踪每个 bucket，额度用完前主动等待
+分页边界：把 date_from / date_to 换算成 snowflake，翻页到范围外即停
+并发抓取：论坛帖子用有界线程池并发拉取，共用同一个速率限制器
+频道发现：同一服务器的多个链接（或整个服务器）只请求一次频道列表和一次活跃帖子列表
+HTTP 连接：共享 requests.Session（连接池 + keep-alive + gzip/brotli），记录每次请求耗时
+指标：请求数、响应字节数、耗时直方图、429 次数和速率限制等待时间都记到 metrics
+"""
+
+import os
+import re
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+from metrics import metrics
+
+# 可指向本地的假 Discord 服务（benchmarks/fake_discord.py）做离线测试
+API_BASE = os.environ.get("DISCORD_API_BASE", "https://discord.com/api/v9")
+DISCORD_EPOCH = 1420070400000
+THREAD_WORKERS = int(os.environ.get("DISCORD_THREAD_WORKERS", "8"))
+# Bot 全局上限 50 次/秒，留一点余量
+GLOBAL_RATE_PER_SEC = int(os.environ.get("DISCORD_GLOBAL_RATE", "45"))
+# 连接池至少要容纳所有并发抓取线程
+POOL_SIZE = int(os.environ.get("DISCORD_POOL_SIZE", str(max(THREAD_WORKERS, 10))))
+CONNECT_TIMEOUT = float(os.environ.get("DISCORD_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.environ.get("DISCORD_READ_TIMEOUT", "30"))
+
+# 同一服务器至少有这么多个链接时改用整服发现（两次请求），少于它时逐个频道请求更省
+GUILD_DISCOVERY_MIN = 2
+# 整服导出包含的频道类型：文字、公告、论坛
+EXPORT_CHANNEL_TYPES = (0, 5, 15)
+CATEGORY_TYPE = 4
+CHANNEL_URL_RE = re.compile(r"/channels/(\d+)(?:/(\d+))?")
+
+# 路由中的 major parameter（Discord 按它拆分同一路由的 bucket）
+MAJOR_PARAM_RE = re.compile(r"^/(channels|guilds|webhooks)/(\d+)")
+SNOWFLAKE_RE = re.compile(r"/\d{15,}")
+
+
+class DiscordAPIError(Exception):
+    """Discord 返回非 200（无权限、频道不存在等）"""
+
+    def __init__(self, status_code, endpoint):
+        super().__init__(f"Discord API {status_code}: {endpoint}")
+        self.status_code = status_code
+        self.endpoint = endpoint
+
+
+def route_key(method, endpoint):
+    """返回 (路由模板, major parameter)，例如 ("GET /channels/{id}/messages", "123")"""
+    major = ""
+    m = MAJOR_PARAM_RE.match(endpoint)
+    if m:
+        major = m.group(2)
+    route = SNOWFLAKE_RE.sub("/{id}", endpoint)
+    return f"{method.upper()} {route}", major
+
+
+def datetime_to_snowflake(dt):
+    """时间 → 该毫秒内最小的 snowflake（与 snowflake_to_datetime 一样按本地时间）"""
+    return (int(dt.timestamp() * 1000) - DISCORD_EPOCH) << 22
+
+
+def snowflake_bounds(date_from=None, date_to=None):
+    """返回 (after, before) 游标，均为开区间；没有对应日期时为 None"""
+    after = max(datetime_to_snowflake(date_from) - 1, 0) if date_from else None
+    before = datetime_to_snowflake(date_to + timedelta(milliseconds=1)) if date_to else None
+    return after, before
+
+
+def iter_message_batches(api_get, channel_id, after=None, before=None, newest_first=False):
+    """按页产出 (after, before) 开区间内的原始消息
+
+    有 after 时向后翻页，越过 before 的那一页即停；否则从 before（或最新）向前翻页到频道开头。
+    newest_first=True 时即使有 after 也从 before 向前翻页，越过 after 的那一页即停。
+    遇到非 200 响应抛 DiscordAPIError，调用方据此区分"抓完了"和"抓失败了"。
+    """
+    params = {"limit": 100}
+    if after is not None and not newest_first:
+        params["after"] = str(after)
+    elif before is not None:
+        params["before"] = str(before)
+    endpoint = f"/channels/{channel_id}/messages"
+    while True:
+        r = api_get(endpoint, params)
+        if r.status_code != 200:
+            raise DiscordAPIError(r.status_code, endpoint)
+        batch = r.json()
+        if not batch:
+            return
+        ids = [int(msg["id"]) for msg in batch]
+        yield [
+            msg for msg, mid in zip(batch, ids)
+            if (after is None or mid > after) and (before is None or mid < before)
+        ]
+        if len(batch) < 100:
+            return
+        if "after" in params:
+            if before is not None and max(ids) >= before:
+                return
+            params["after"] = str(max(ids))
+        else:
+            if after is not None and min(ids) <= after:
+                return
+            params["before"] = str(min(ids))
+
+
+def parse_channel_url(url):
+    """返回 (服务器ID, 频道ID)；只有服务器ID的链接表示整个服务器，频道ID为 None"""
+    m = CHANNEL_URL_RE.search(url)
+    return (m.group(1), m.group(2)) if m else (None, None)
+
+
+def discover_guild(api_get, guild_id):
+    """整个服务器的频道和活跃帖子：共两次请求，帖子按 parent_id 在本地归到所属论坛
+
+    返回 (可导出频道列表（按客户端里的显示顺序）, {频道ID: [活跃帖子...]})；
+    频道列表拿不到时返回 (None, None)，只有活跃帖子拿不到时第二项为 None（调用方退回逐个论坛拉取）
+    """
+    r = api_get(f"/guilds/{guild_id}/channels")
+    if r.status_code != 200:
+        return None, None
+    channels = r.json()
+    category_position = {c["id"]: c.get("position", 0) for c in channels if c.get("type") == CATEGORY_TYPE}
+
+    def order(c):
+        # 不在分类里的频道排在最前，其余按分类顺序、再按分类内顺序
+        parent = c.get("parent_id")
+        return (category_position.get(parent, -1) if parent else -1, c.get("position", 0), int(c["id"]))
+
+    channels = sorted((c for c in channels if c.get("type") in EXPORT_CHANNEL_TYPES), key=order)
+
+    r = api_get(f"/guilds/{guild_id}/threads/active")
+    if r.status_code != 200:
+        return channels, None
+    active = {}
+    for thread in r.json().get("threads", []):
+        active.setdefault(thread.get("parent_id"), []).append(thread)
+    return channels, active
+
+
+def resolve_channels(api_get, urls, get_channel_info):
+    """把导出链接展开成 [(服务器ID, 频道信息, 该频道的活跃帖子或 None)]，重复的频道只保留第一次
+
+    同一服务器的链接不少于 GUILD_DISCOVERY_MIN 个、或有整服链接时，用 discover_guild 一次拿全；
+    否则（或整服发现失败时）逐个 get_channel_info。活跃帖子为 None 表示需要按论坛单独拉取
+    """
+    parsed = [parse_channel_url(url) for url in urls]
+    link_counts = Counter(guild_id for guild_id, _ in parsed if guild_id)
+    discovered = {}
+    for guild_id, channel_id in parsed:
+        if guild_id and guild_id not in discovered and (
+                channel_id is None or link_counts[guild_id] >= GUILD_DISCOVERY_MIN):
+            discovered[guild_id] = discover_guild(api_get, guild_id)
+
+    resolved = []
+    seen = set()
+    for guild_id, channel_id in parsed:
+        channels, active = discovered.get(guild_id, (None, None))
+        if channel_id is None:
+            infos = channels or []
+        else:
+            info = next((c for c in channels or [] if c["id"] == channel_id), None)
+            if info is None:
+                # 帖子链接、没做整服发现或发现失败时单独请求，这时活跃帖子要按论坛拉取
+                info, active = get_channel_info(channel_id), None
+            infos = [info] if info else []
+        for info in infos:
+            if info["id"] in seen:
+                continue
+            seen.add(info["id"])
+            threads = active.get(info["id"], []) if active is not None else None
+            resolved.append((guild_id, info, threads))
+    return resolved
+
+
+class RateLimiter:
+    """线程安全的 Discord 速率限制器
+
+    - 路由 → bucket 的映射来自 X-RateLimit-Bucket 响应头
+    - 每个 (bucket, major parameter) 独立记录 remaining / reset 时间
+    - 全局 429 会让所有请求一起等待
+    - 所有线程共用每秒 GLOBAL_RATE_PER_SEC 次的全局额度，并发抓取不会触发全局限流
+    """
+
+    def __init__(self, global_rate=None):
+        self._lock = threading.Lock()
+        self._route_buckets = {}
+        self._buckets = {}
+        self._global_reset = 0.0
+        self._global_rate = global_rate or GLOBAL_RATE_PER_SEC
+        self._recent = deque()
+
+    def _bucket_key(self, route, major):
+        return (self._route_buckets.get(route, route), major)
+
+    def wait(self, method, endpoint):
+        """请求前调用：必要时阻塞到 bucket 有额度，返回实际等待秒数"""
+        route, major = route_key(method, endpoint)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._recent and now - self._recent[0] >= 1.0:
+                    self._recent.popleft()
+                delay = self._global_reset - now
+                if delay <= 0 and len(self._recent) >= self._global_rate:
+                    delay = self._recent[0] + 1.0 - now
+                if delay <= 0:
+                    bucket = self._buckets.get(self._bucket_key(route, major))
+                    if bucket is not None and now < bucket["reset_at"]:
+                        if bucket["remaining"] <= 0:
+                            delay = bucket["reset_at"] - now
+                        else:
+                            bucket["remaining"] -= 1
+                    if delay <= 0:
+                        self._recent.append(now)
+                        return waited
+            time.sleep(delay)
+            waited += delay
+
+    def update(self, method, endpoint, response):
+        """请求后调用：用响应头刷新 bucket 状态，429 时返回需要等待的秒数"""
+        route, major = route_key(method, endpoint)
+        headers = response.headers
+        now = time.monotonic()
+        retry_after = None
+
+        if response.status_code == 429:
+            try:
+                body = response.json()
+            except ValueError:
+                body = {}
+            retry_after = float(body.get("retry_after") or headers.get("Retry-After") or 1)
+
+        with self._lock:
+            bucket_hash = headers.get("X-RateLimit-Bucket")
+            if bucket_hash:
+                self._route_buckets[route] = bucket_hash
+            key = self._bucket_key(route, major)
+
+            remaining = headers.get("X-RateLimit-Remaining")
+            reset_after = headers.get("X-RateLimit-Reset-After")
+            if remaining is not None and reset_after is not None:
+                reset_at = now + float(reset_after)
+                remaining = int(remaining)
+                old = self._buckets.get(key)
+                # 并发时旧响应可能晚到，同一窗口内只信更小的 remaining
+                if old and now < old["reset_at"]:
+                    remaining = min(remaining, old["remaining"])
+                self._buckets[key] = {"remaining": remaining, "reset_at": reset_at}
+
+            if retry_after is not None:
+                is_global = headers.get("X-RateLimit-Global") == "true" or body.get("global")
+                if is_global:
+                    self._global_reset = max(self._global_reset, now + retry_after)
+                else:
+                    self._buckets[key] = {"remaining": 0, "reset_at": now + retry_after}
+
+        return retry_after
+
+
+# 进程内共享，同时运行的多个导出共用同一份额度
+rate_limiter = RateLimiter()
+
+
+class DiscordClient:
+    """共享连接池的 Discord REST 客户端
+
+    get_headers 每次请求时调用，这样运行中修改 Token 也能立即生效
+    """
+
+    def __init__(self, get_headers, api_base=API_BASE, limiter=None,
+                 pool_size=None, timeout=None):
+        self.get_headers = get_headers
+        self.api_base = api_base
+        self.limiter = limiter or rate_limiter
+        self.timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+        self.session = requests.Session()
+        # urllib3 装了 brotli 时 ACCEPT_ENCODING 会自动带上 br
+        self.session.headers.update({
+            "Accept-Encoding": ACCEPT_ENCODING,
+            "Connection": "keep-alive",
+        })
+        adapter = HTTPAdapter(
+            pool_connections=pool_size or POOL_SIZE,
+            pool_maxsize=pool_size or POOL_SIZE,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self._count = 0
+        self._total_latency = 0.0
+
+    def get(self, endpoint, params=None, on_rate_limit=None):
+        """GET 请求，429 时自动等待重试；on_rate_limit(秒数) 用于打印提示"""
+        url = f"{self.api_base}{endpoint}"
+        route, _ = route_key("GET", endpoint)
+        reason = "quota"
+        while True:
+            waited = self.limiter.wait("GET", endpoint)
+            if waited:
+                # retry_after：上一次被 429 后的等待；quota：额度用完前的主动等待
+                metrics.inc("discord_rate_limit_wait_seconds_total", waited, reason=reason)
+            start = time.monotonic()
+            r = self.session.get(url, headers=self.get_headers(), params=params, timeout=self.timeout)
+            latency = time.monotonic() - start
+            self._record(latency)
+            metrics.inc("discord_requests_total", route=route, status=r.status_code)
+            metrics.inc("discord_response_bytes_total", len(r.content), route=route)
+            metrics.observe("discord_request_duration_seconds", latency, route=route)
+            retry = self.limiter.update("GET", endpoint, r)
+            if retry is not None:
+                metrics.inc("discord_rate_limited_total", route=route)
+                reason = "retry_after"
+                if on_rate_limit:
+                    on_rate_limit(retry)
+                continue
+            return r
+
+    def _record(self, latency):
+        with self._lock:
+            self._count += 1
+            self._total_latency += latency
+            self._latencies.append(latency)
+
+    def latency_stats(self):
+        """请求数与耗时统计（最近 1000 次请求的分位数，单位秒）"""
+        with self._lock:
+            recent = sorted(self._latencies)
+            count, total = self._count, self._total_latency
+        if not recent:
+            return {"requests": count, "avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        return {
+            "requests": count,
+            "avg": total / count,
+            "p50": recent[len(recent) // 2],
+            "p95": recent[min(len(recent) - 1, int(len(recent) * 0.95))],
+            "max": recent[-1],
+        }
+
+
+def fetch_ordered(items, fetch, max_workers=None, on_done=None):
+    """用线程池并发执行 fetch(item)，按 items 原顺序逐个产出 (item, 结果)
+
+    最多提前提交 2×线程数 个任务，下游消费多慢内存里就只压多少结果；
+    on_done(已产出数, 总数) 用于汇报进度
+    """
+    items = list(items)
+    if not items:
+        return
+    workers = max(1, min(max_workers or THREAD_WORKERS, len(items)))
+    window = workers * 2
+    pending = deque()
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for item in items:
+                pending.append((item, pool.submit(fetch, item)))
+                if len(pending) < window:
+                    continue
+                head, future = pending.popleft()
+                result = future.result()
+                done += 1
+                if on_done:
+                    on_done(done, len(items))
+                yield head, result
+            while pending:
+                head, future = pending.popleft()
+                result = future.result()
+                done += 1
+                if on_done:
+                    on_done(done, len(items))
+                yield head, result
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def fetch_all(items, fetch, max_workers=None, on_done=None):
+    """fetch_ordered 的列表版本，结果按 items 原顺序返回"""
+    return [result for _, result in fetch_ordered(items, fetch, max_workers, on_done)]
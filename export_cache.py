@@ -0,0 +1,179 @@
+"""
+导出结果缓存 + exports/ 目录磁盘配额
+相同的请求（频道ID、snowflake 区间、格式和选项）且时间范围已完全过去时直接复用上次的文件；
+缓存条目按 TTL 过期，exports/ 超出配额时按最近使用时间淘汰旧文件；
+索引在 SQLite 里，多个 worker 进程看到的是同一份缓存，淘汰时不会删掉别的进程还在引用的条目
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+EXPORT_DIR = "exports"
+# 缓存索引放在 SQLite 里，多个 worker 进程共享；旧版本的 JSON 索引启动时导入一次
+CACHE_DB_PATH = os.environ.get("EXPORT_CACHE_DB_PATH", os.path.join("data", "export_cache.db"))
+LEGACY_INDEX_NAME = ".export_cache.json"
+CACHE_TTL = float(os.environ.get("EXPORT_CACHE_TTL_HOURS", "168")) * 3600
+DISK_QUOTA = int(float(os.environ.get("EXPORT_DISK_QUOTA_MB", "2048")) * 1024 * 1024)
+# 只清理程序自己生成的文件，Prompt 等手工放入的文件不动
+MANAGED_PREFIXES = ("Discord导出_", "聊天记录可视化_")
+# 最近修改过的文件可能还在被任务写入，不参与淘汰
+MIN_IDLE_SECONDS = 600
+
+
+def make_key(channel_ids, after, before, export_format, options=None):
+    """请求归一化后的内容哈希：频道去重保序，区间用 snowflake 表示"""
+    normalized = {
+        "channels": list(dict.fromkeys(str(c) for c in channel_ids)),
+        "after": after,
+        "before": before,
+        "format": export_format,
+        "options": options or {},
+    }
+    raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    files TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+"""
+
+
+class ExportCache:
+    """索引存在 SQLite 里，多个 gunicorn worker 共用同一份条目；
+    修改都在 BEGIN IMMEDIATE 事务里进行，evict 的扫描和删除整体跨进程互斥"""
+
+    def __init__(self, directory=EXPORT_DIR, ttl=CACHE_TTL, quota=DISK_QUOTA, path=CACHE_DB_PATH):
+        self.directory = directory
+        self.ttl = ttl
+        self.quota = quota
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._import_legacy_index()
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _import_legacy_index(self):
+        """旧版本的索引是 exports/ 下的 JSON 文件，导入一次后删掉"""
+        legacy = os.path.join(self.directory, LEGACY_INDEX_NAME)
+        try:
+            with open(legacy, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._transaction(lambda conn: conn.executemany(
+            "INSERT OR IGNORE INTO entries (key, files, result, created, last_access) VALUES (?, ?, ?, ?, ?)",
+            [(key, json.dumps(e["files"], ensure_ascii=False), json.dumps(e["result"], ensure_ascii=False),
+              e["created"], e["last_access"]) for key, e in entries.items()],
+        ))
+        try:
+            os.remove(legacy)
+        except OSError:
+            pass
+
+    def get(self, key):
+        """命中且文件都还在时返回 {"files", "result", ...}，并刷新最近使用时间"""
+        def run(conn):
+            row = conn.execute(
+                "SELECT files, result, created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+            files, result, created = json.loads(row[0]), json.loads(row[1]), row[2]
+            now = time.time()
+            if now - created > self.ttl or not all(os.path.exists(p) for p in files):
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            return {"files": files, "result": result, "created": created, "last_access": now}
+        return self._transaction(run)
+
+    def put(self, key, files, result):
+        now = time.time()
+        self._transaction(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO entries (key, files, result, created, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, json.dumps(sorted(set(files)), ensure_ascii=False), json.dumps(result, ensure_ascii=False),
+             now, now),
+        ))
+
+    def evict(self):
+        """删除过期条目，再按最近使用时间淘汰文件直到 exports/ 不超过配额；返回删除的文件"""
+        def run(conn):
+            removed = []
+            now = time.time()
+            entries = [(key, json.loads(files), created, last_access) for key, files, created, last_access
+                       in conn.execute("SELECT key, files, created, last_access FROM entries").fetchall()]
+            live = []
+            for key, files, created, last_access in entries:
+                if now - created > self.ttl:
+                    removed.extend(self._remove_files(files))
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                else:
+                    live.append((key, files, last_access))
+
+            if not os.path.isdir(self.directory):
+                return removed
+
+            last_used = {}
+            for _, files, last_access in live:
+                for path in files:
+                    last_used[os.path.normpath(path)] = last_access
+
+            total = 0
+            candidates = []
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if not os.path.isfile(path):
+                    continue
+                st = os.stat(path)
+                total += st.st_size
+                if name.startswith(MANAGED_PREFIXES) and now - st.st_mtime > MIN_IDLE_SECONDS:
+                    used = last_used.get(os.path.normpath(path), st.st_mtime)
+                    candidates.append((used, path, st.st_size))
+
+            candidates.sort()
+            for _, path, size in candidates:
+                if total <= self.quota:
+                    break
+                removed.extend(self._remove_files([path]))
+                total -= size
+
+            gone = {os.path.normpath(p) for p in removed}
+            for key, files, _ in live:
+                if any(os.path.normpath(p) in gone for p in files):
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return removed
+        return self._transaction(run)
+
+    @staticmethod
+    def _remove_files(paths):
+        removed = []
+        for path in paths:
+            try:
+                os.remove(path)
+                removed.append(path)
+            except OSError:
+                pass
+        return removed
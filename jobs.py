@@ -0,0 +1,670 @@
+"""
+后台任务队列 - 多个导出任务并行执行，每个任务独立的状态、结果和取消
+任务状态、排队顺序和取消标记存在共享后端里（默认 SQLite）：多个 gunicorn worker
+或多台实例指向同一个库时，任意进程都能查询、取消任意任务，并发上限对所有进程整体生效
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", "2"))
+VISUALIZE_WORKERS = int(os.environ.get("VISUALIZE_WORKERS", "1"))
+# 最多保留多少个已结束的任务
+MAX_FINISHED_JOBS = 100
+# sqlite：多进程共享（默认）；memory：仅当前进程
+JOB_BACKEND = os.environ.get("JOB_BACKEND", "sqlite")
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", os.path.join("data", "jobs.db"))
+# 运行中的任务超过这么久没有心跳，视为所在进程已退出，重新排队
+LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "60"))
+# 空闲时多久去共享后端看一次有没有新任务 / 其他进程执行的任务有没有新状态
+POLL_INTERVAL = 1.0
+
+FINISHED_STATES = ("done", "error", "cancelled")
+
+
+def new_job_id():
+    return str(uuid.uuid4())[:8]
+
+
+def encode_args(value):
+    """任务参数要能交给其他进程执行，存成 JSON；datetime 单独标记"""
+    def default(o):
+        if isinstance(o, datetime):
+            return {"__datetime__": o.isoformat()}
+        raise TypeError(f"任务参数无法序列化: {type(o).__name__}")
+    return json.dumps(value, ensure_ascii=False, default=default)
+
+
+def decode_args(raw):
+    def hook(d):
+        if "__datetime__" in d:
+            return datetime.fromisoformat(d["__datetime__"])
+        return d
+    return json.loads(raw, object_hook=hook)
+
+
+def initial_status(job_id, kind, priority):
+    return {
+        "task_id": job_id,
+        "kind": kind,
+        "state": "queued",
+        "is_running": True,
+        "priority": priority,
+        "progress": "排队中...",
+        "result": None,
+        "error": None,
+        "filename": None,
+        "txt_filename": None,
+        "report_filename": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+    }
+
+
+def requeued_status(status):
+    return dict(status, state="queued", is_running=True, started_at=None, progress="任务中断，重新排队...")
+
+
+def claimed_status(status):
+    return dict(status, state="running", started_at=time.time(), progress="任务启动中...")
+
+
+def cancelled_status(status):
+    return dict(status, state="cancelled", is_running=False, finished_at=time.time(), progress="已取消")
+
+
+class JobCancelled(Exception):
+    """任务被取消，由 Job.set_progress / check_cancelled 抛出"""
+
+
+class JobBackend(ABC):
+    """共享任务状态的存储接口，换成 Redis 等实现以下方法即可，缺了哪个方法实例化时就会报错
+
+    任务记录是 dict：id, kind, priority, target, args, kwargs, status, version, cancel_requested；
+    args / kwargs 为 encode_args 后的 JSON 文本，status 与前端看到的任务状态一致
+    """
+
+    @abstractmethod
+    def insert(self, record):
+        """新增任务；同一ID已存在时不动原记录，返回 False"""
+
+    @abstractmethod
+    def load(self, job_id):
+        """任务记录，不存在时返回 None"""
+
+    @abstractmethod
+    def list(self, kind=None):
+        """按提交顺序倒序"""
+
+    @abstractmethod
+    def update_status(self, job_id, fields):
+        """合并状态字段并递增 version，返回 (status, version)"""
+
+    @abstractmethod
+    def claim(self, kind, limit, owner, lease):
+        """原子地领取优先级最高的排队任务，该类任务运行数已达 limit 时返回 None；
+        顺带把心跳超过 lease 秒的运行中任务放回队列"""
+
+    @abstractmethod
+    def heartbeat(self, job_ids, owner):
+        """刷新 owner 正在执行的这些任务的心跳"""
+
+    @abstractmethod
+    def request_cancel(self, job_id):
+        """排队中的任务直接标记为已取消，运行中的任务打上取消标记；已结束返回 False"""
+
+    @abstractmethod
+    def cancel_requested(self, job_id):
+        """任务是否被要求取消"""
+
+    @abstractmethod
+    def position(self, job_id):
+        """同类任务中排在它前面的排队任务数，不在排队时返回 None"""
+
+    @abstractmethod
+    def prune(self, keep):
+        """只保留最近结束的 keep 个已结束任务"""
+
+
+class MemoryJobBackend(JobBackend):
+    """进程内后端，只适合单进程运行"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}
+        self._seq = 0
+
+    @staticmethod
+    def _copy(record):
+        return dict(record, status=dict(record["status"]))
+
+    def insert(self, record):
+        with self._lock:
+            if record["id"] in self._records:
+                return False
+            self._seq += 1
+            self._records[record["id"]] = dict(self._copy(record), seq=self._seq, owner=None, heartbeat=0.0)
+            return True
+
+    def load(self, job_id):
+        with self._lock:
+            record = self._records.get(job_id)
+            return self._copy(record) if record else None
+
+    def list(self, kind=None):
+        with self._lock:
+            records = [self._copy(r) for r in self._records.values() if kind is None or r["kind"] == kind]
+        return sorted(records, key=lambda r: r["seq"], reverse=True)
+
+    def update_status(self, job_id, fields):
+        with self._lock:
+            record = self._records[job_id]
+            record["status"] = dict(record["status"], **fields)
+            record["version"] += 1
+            if record["status"]["state"] in FINISHED_STATES:
+                record["owner"] = None
+            return dict(record["status"]), record["version"]
+
+    def claim(self, kind, limit, owner, lease):
+        now = time.time()
+        with self._lock:
+            for record in self._records.values():
+                if record["status"]["state"] == "running" and record["heartbeat"] < now - lease:
+                    record.update(status=requeued_status(record["status"]), owner=None,
+                                  version=record["version"] + 1)
+            same_kind = [r for r in self._records.values() if r["kind"] == kind]
+            if sum(1 for r in same_kind if r["status"]["state"] == "running") >= limit:
+                return None
+            queued = [r for r in same_kind if r["status"]["state"] == "queued"]
+            if not queued:
+                return None
+            record = min(queued, key=lambda r: (-r["priority"], r["seq"]))
+            record.update(status=claimed_status(record["status"]), owner=owner, heartbeat=now,
+                          version=record["version"] + 1)
+            return self._copy(record)
+
+    def heartbeat(self, job_ids, owner):
+        now = time.time()
+        with self._lock:
+            for job_id in job_ids:
+                record = self._records.get(job_id)
+                if record and record["owner"] == owner:
+                    record["heartbeat"] = now
+
+    def request_cancel(self, job_id):
+        with self._lock:
+            record = self._records.get(job_id)
+            if not record or record["status"]["state"] in FINISHED_STATES:
+                return False
+            if record["status"]["state"] == "queued":
+                record["status"] = cancelled_status(record["status"])
+                record["version"] += 1
+            record["cancel_requested"] = True
+            return True
+
+    def cancel_requested(self, job_id):
+        with self._lock:
+            record = self._records.get(job_id)
+            return bool(record and record["cancel_requested"])
+
+    def position(self, job_id):
+        with self._lock:
+            job = self._records.get(job_id)
+            if not job or job["status"]["state"] != "queued":
+                return None
+            key = (-job["priority"], job["seq"])
+            return sum(
+                1 for r in self._records.values()
+                if r["kind"] == job["kind"] and r["status"]["state"] == "queued"
+                and (-r["priority"], r["seq"]) < key
+            )
+
+    def prune(self, keep):
+        with self._lock:
+            finished = [r for r in self._records.values() if r["status"]["state"] in FINISHED_STATES]
+            finished.sort(key=lambda r: r["status"]["finished_at"] or 0)
+            for record in finished[:max(0, len(finished) - keep)]:
+                del self._records[record["id"]]
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    state TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    finished_at REAL,
+    owner TEXT,
+    heartbeat REAL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    target TEXT,
+    args TEXT,
+    kwargs TEXT,
+    status TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (kind, state, priority, seq);
+"""
+
+RECORD_COLUMNS = "id, kind, priority, target, args, kwargs, status, version, cancel_requested"
+
+
+def row_to_record(row):
+    job_id, kind, priority, target, args, kwargs, status, version, cancel_requested = row
+    return {
+        "id": job_id, "kind": kind, "priority": priority, "target": target,
+        "args": args, "kwargs": kwargs, "status": json.loads(status),
+        "version": version, "cancel_requested": bool(cancel_requested),
+    }
+
+
+class SQLiteJobBackend(JobBackend):
+    """SQLite 后端：同一台机器上的多个进程共用一个库文件；
+    多台实例要把 JOB_DB_PATH 放在共享存储上，或换成其他 JobBackend 实现"""
+
+    def __init__(self, path=JOB_DB_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        # 事务由 _transaction 手动 BEGIN IMMEDIATE，跨进程互斥
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    @staticmethod
+    def _set_status(conn, job_id, status, **columns):
+        assignments = "".join(f", {name} = ?" for name in columns)
+        conn.execute(
+            f"UPDATE jobs SET status = ?, state = ?, finished_at = ?, version = version + 1{assignments} "
+            "WHERE id = ?",
+            (json.dumps(status, ensure_ascii=False), status["state"], status["finished_at"],
+             *columns.values(), job_id),
+        )
+
+    def insert(self, record):
+        status = record["status"]
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (id, kind, state, priority, finished_at, target, args, kwargs, status, "
+                "version, cancel_requested) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (record["id"], record["kind"], status["state"], record["priority"], status["finished_at"],
+                 record["target"], record["args"], record["kwargs"], json.dumps(status, ensure_ascii=False),
+                 record["version"], int(record["cancel_requested"])),
+            )
+            return cur.rowcount == 1
+
+    def load(self, job_id):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {RECORD_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row_to_record(row) if row else None
+
+    def list(self, kind=None):
+        with self._lock:
+            if kind is None:
+                rows = self._conn.execute(f"SELECT {RECORD_COLUMNS} FROM jobs ORDER BY seq DESC").fetchall()
+            else:
+                rows = self._conn.execute(
+                    f"SELECT {RECORD_COLUMNS} FROM jobs WHERE kind = ? ORDER BY seq DESC", (kind,)
+                ).fetchall()
+        return [row_to_record(row) for row in rows]
+
+    def update_status(self, job_id, fields):
+        def run(conn):
+            status, version = conn.execute("SELECT status, version FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            status = dict(json.loads(status), **fields)
+            columns = {"owner": None} if status["state"] in FINISHED_STATES else {}
+            self._set_status(conn, job_id, status, **columns)
+            return status, version + 1
+        return self._transaction(run)
+
+    def claim(self, kind, limit, owner, lease):
+        now = time.time()
+
+        def run(conn):
+            for job_id, status in conn.execute(
+                "SELECT id, status FROM jobs WHERE state = 'running' AND heartbeat < ?", (now - lease,)
+            ).fetchall():
+                self._set_status(conn, job_id, requeued_status(json.loads(status)), owner=None)
+            running, = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE kind = ? AND state = 'running'", (kind,)
+            ).fetchone()
+            if running >= limit:
+                return None
+            row = conn.execute(
+                f"SELECT {RECORD_COLUMNS} FROM jobs WHERE kind = ? AND state = 'queued' "
+                "ORDER BY priority DESC, seq LIMIT 1", (kind,)
+            ).fetchone()
+            if not row:
+                return None
+            record = row_to_record(row)
+            record["status"] = claimed_status(record["status"])
+            record["version"] += 1
+            self._set_status(conn, record["id"], record["status"], owner=owner, heartbeat=now)
+            return record
+        return self._transaction(run)
+
+    def heartbeat(self, job_ids, owner):
+        if not job_ids:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND owner = ?",
+                [(now, job_id, owner) for job_id in job_ids],
+            )
+
+    def request_cancel(self, job_id):
+        def run(conn):
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if not row:
+                return False
+            status = json.loads(row[0])
+            if status["state"] in FINISHED_STATES:
+                return False
+            if status["state"] == "queued":
+                self._set_status(conn, job_id, cancelled_status(status), cancel_requested=1)
+            else:
+                conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            return True
+        return self._transaction(run)
+
+    def cancel_requested(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def position(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT kind, state, priority, seq FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if not row or row[1] != "queued":
+                return None
+            kind, _, priority, seq = row
+            count, = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE kind = ? AND state = 'queued' "
+                "AND (priority > ? OR (priority = ? AND seq < ?))", (kind, priority, priority, seq)
+            ).fetchone()
+        return count
+
+    def prune(self, keep):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE state IN ('done', 'error', 'cancelled') AND id NOT IN ("
+                "SELECT id FROM jobs WHERE state IN ('done', 'error', 'cancelled') "
+                "ORDER BY finished_at DESC LIMIT ?)", (keep,)
+            )
+
+
+def make_backend(name=JOB_BACKEND):
+    if name == "memory":
+        return MemoryJobBackend()
+    if name == "sqlite":
+        return SQLiteJobBackend()
+    raise ValueError(f"未知的 JOB_BACKEND: {name}")
+
+
+class Job:
+    """一个后台任务；status 的字段与原来的全局 task_status 保持兼容
+
+    本进程执行的任务，状态一变化就通过 Condition 唤醒等待者；
+    其他进程执行的任务，wait_for_change 每 POLL_INTERVAL 秒从共享后端刷新一次
+    """
+
+    def __init__(self, manager, record):
+        self.manager = manager
+        self.id = record["id"]
+        self.kind = record["kind"]
+        self.priority = record["priority"]
+        self.target = record["target"]
+        self.args = decode_args(record["args"]) if record["args"] else []
+        self.kwargs = decode_args(record["kwargs"]) if record["kwargs"] else {}
+        self.status = record["status"]
+        self.version = record["version"]
+        self.cancel_event = threading.Event()
+        if record["cancel_requested"]:
+            self.cancel_event.set()
+        # 每次状态变化 version +1 并唤醒等待者（SSE 推送用）
+        self.changed = threading.Condition()
+        self._cancel_checked = time.monotonic()
+
+    def check_cancelled(self):
+        # 取消可能来自其他进程，最多每秒去共享后端查一次
+        now = time.monotonic()
+        if not self.cancel_event.is_set() and now - self._cancel_checked >= 1.0:
+            self._cancel_checked = now
+            if self.manager.backend.cancel_requested(self.id):
+                self.cancel_event.set()
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def update(self, **fields):
+        status, version = self.manager.backend.update_status(self.id, fields)
+        with self.changed:
+            self.status = status
+            self.version = version
+            self.changed.notify_all()
+
+    def set_progress(self, text, **fields):
+        self.check_cancelled()
+        self.update(progress=text, **fields)
+
+    def refresh(self):
+        record = self.manager.backend.load(self.id)
+        if not record:
+            return
+        with self.changed:
+            if record["version"] != self.version:
+                self.status = record["status"]
+                self.version = record["version"]
+                self.changed.notify_all()
+
+    def wait_for_change(self, version, timeout=None):
+        """阻塞到 version 之后又有新的状态变化（或超时），返回最新 version"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = POLL_INTERVAL if deadline is None else min(POLL_INTERVAL, deadline - time.monotonic())
+            with self.changed:
+                if self.version == version and wait > 0:
+                    self.changed.wait(wait)
+                if self.version != version:
+                    return self.version
+            self.refresh()
+            if self.version != version or (deadline is not None and time.monotonic() >= deadline):
+                return self.version
+
+    def to_dict(self):
+        with self.changed:
+            return dict(self.status)
+
+
+class JobManager:
+    """有界线程池 + 优先级队列（priority 越大越先执行，同优先级先到先得）
+
+    每种任务（kind）有独立的并发上限，耗时的可视化任务不会占满导出的名额；
+    上限对共用同一后端的所有进程整体生效。任务函数要先用 @jobs.task 注册，
+    领取到任务的进程按函数名找到它执行；全部注册完再调用 start() 开始领取，
+    否则先启动的工作线程可能领到还没注册的任务
+    """
+
+    def __init__(self, backend=None, workers=None):
+        self.backend = backend or make_backend()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{new_job_id()}"
+        self._lock = threading.Lock()
+        self._pool_sizes = workers or {"export": EXPORT_WORKERS, "visualize": VISUALIZE_WORKERS}
+        self._tasks = {}
+        self._local = {}
+        self._wake = {}
+        self._heartbeat_started = False
+
+    def task(self, fn):
+        """注册任务函数（装饰器）"""
+        self._tasks[fn.__name__] = fn
+        return fn
+
+    def start(self):
+        """本进程开始领取各类任务；重复调用无影响"""
+        for kind in self._pool_sizes:
+            self._ensure_workers(kind)
+
+    def _limit(self, kind):
+        return max(1, self._pool_sizes.get(kind, 1))
+
+    def _ensure_workers(self, kind):
+        with self._lock:
+            wake = self._wake.get(kind)
+            if wake is None:
+                wake = self._wake[kind] = threading.Event()
+                for _ in range(self._limit(kind)):
+                    threading.Thread(target=self._work, args=(kind, wake), daemon=True).start()
+            if not self._heartbeat_started:
+                self._heartbeat_started = True
+                threading.Thread(target=self._heartbeat, daemon=True).start()
+            return wake
+
+    def submit(self, target, *args, kind="export", priority=0, job_id=None, **kwargs):
+        """target(job, *args, **kwargs) 在工作线程里执行，返回值写入 status["result"]
+
+        参数要能 JSON 序列化（datetime 可以）；job_id 用于按断点恢复的任务沿用原来的任务ID，
+        该ID已经在任务库里时（如多个 worker 同时按断点恢复）不重复提交，返回已有的任务
+        """
+        self._tasks.setdefault(target.__name__, target)
+        job_id = job_id or new_job_id()
+        record = {
+            "id": job_id, "kind": kind, "priority": priority, "target": target.__name__,
+            "args": encode_args(list(args)), "kwargs": encode_args(kwargs),
+            "status": initial_status(job_id, kind, priority), "version": 0, "cancel_requested": False,
+        }
+        if not self.backend.insert(record):
+            return self.get(job_id)
+        # 还没 start() 时只入库，启动后照常领取
+        with self._lock:
+            wake = self._wake.get(kind)
+        if wake:
+            wake.set()
+        return Job(self, record)
+
+    def add_finished(self, result, kind="export", **fields):
+        """直接登记一个已完成的任务（如命中结果缓存），前端照常按任务ID查询"""
+        job_id = new_job_id()
+        now = time.time()
+        status = initial_status(job_id, kind, 0)
+        status.update(fields, result=result, progress="完成！", state="done", is_running=False,
+                      started_at=now, finished_at=now)
+        record = {
+            "id": job_id, "kind": kind, "priority": 0, "target": None, "args": None, "kwargs": None,
+            "status": status, "version": 0, "cancel_requested": False,
+        }
+        self.backend.insert(record)
+        self.backend.prune(MAX_FINISHED_JOBS)
+        return Job(self, record)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._local.get(job_id)
+        if job:
+            return job
+        record = self.backend.load(job_id)
+        return Job(self, record) if record else None
+
+    def list(self, kind=None):
+        with self._lock:
+            local = dict(self._local)
+        return [local.get(r["id"]) or Job(self, r) for r in self.backend.list(kind)]
+
+    def latest(self, kind=None):
+        jobs = self.list(kind)
+        return jobs[0] if jobs else None
+
+    def position(self, job):
+        """排队位置（前面还有几个排队中的任务），不在排队时返回 None"""
+        return self.backend.position(job.id)
+
+    def cancel(self, job_id):
+        """排队中的任务直接取消；运行中的任务在下一个检查点退出（在其他进程里的最多晚一秒）"""
+        if not self.backend.request_cancel(job_id):
+            return False
+        with self._lock:
+            job = self._local.get(job_id)
+        if job:
+            job.cancel_event.set()
+        return True
+
+    def _finish(self, job, state, progress=None, error=None):
+        fields = {"state": state, "is_running": False, "finished_at": time.time()}
+        if progress is not None:
+            fields["progress"] = progress
+        if error is not None:
+            fields["error"] = error
+        job.update(**fields)
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(LEASE_SECONDS / 4)
+            with self._lock:
+                job_ids = list(self._local)
+            try:
+                self.backend.heartbeat(job_ids, self.owner)
+            except sqlite3.Error:
+                pass
+
+    def _work(self, kind, wake):
+        while True:
+            try:
+                record = self.backend.claim(kind, self._limit(kind), self.owner, LEASE_SECONDS)
+            except sqlite3.Error:
+                record = None
+            if record is None:
+                wake.wait(POLL_INTERVAL)
+                wake.clear()
+                continue
+            job = Job(self, record)
+            target = self._tasks.get(job.target)
+            if job.cancel_event.is_set():
+                self._finish(job, "cancelled", progress="已取消")
+                continue
+            if target is None:
+                # 其他版本的进程提交的任务，本进程不认识
+                self._finish(job, "error", error=f"未知的任务函数: {job.target}")
+                continue
+            with self._lock:
+                self._local[job.id] = job
+            try:
+                result = target(job, *job.args, **job.kwargs)
+                if result is not None:
+                    job.update(result=result)
+                if job.cancel_event.is_set() or self.backend.cancel_requested(job.id):
+                    # 取消请求在最后一个检查点之后才到，结果照常保留，状态仍以用户的取消为准
+                    self._finish(job, "cancelled", progress="已取消")
+                elif job.status["error"]:
+                    self._finish(job, "error")
+                else:
+                    self._finish(job, "done")
+            except JobCancelled:
+                self._finish(job, "cancelled", progress="已取消")
+            except Exception as e:
+                self._finish(job, "error", error=str(e))
+            finally:
+                with self._lock:
+                    self._local.pop(job.id, None)
+                self.backend.prune(MAX_FINISHED_JOBS)
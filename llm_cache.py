@@ -0,0 +1,130 @@
+"""
+大模型响应缓存 - app.py 与 daily_report.py 共用
+按 (Prompt 模板, 输入文本, 模型名, 额外要求) 的哈希缓存模型输出，每条一个 JSON 文件；
+目录总大小超出上限时按最近使用时间淘汰。重跑周报、重复点"可视化"都不再调用模型
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from metrics import metrics
+
+CACHE_DIR = os.environ.get("LLM_CACHE_DIR", os.path.join("data", "llm_cache"))
+CACHE_MAX_BYTES = int(float(os.environ.get("LLM_CACHE_MAX_MB", "200")) * 1024 * 1024)
+
+
+def make_key(template, text, model, extra=""):
+    h = hashlib.sha256()
+    # 各字段带长度前缀，避免拼接后不同输入撞出同一个串
+    for part in (template, text, model, extra or ""):
+        data = part.encode("utf-8")
+        h.update(f"{len(data)}:".encode("ascii"))
+        h.update(data)
+    return h.hexdigest()
+
+
+class LLMCache:
+    """磁盘缓存 + 命中率统计；写入用临时文件替换，多线程/多进程读写都安全"""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read(self, template, text, model, extra):
+        """读出缓存的输出文本并刷新文件 mtime 作为最近使用时间；不计入命中统计"""
+        path = self._path(make_key(template, text, model, extra))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                output = json.load(f)["output"]
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return output
+
+    def _record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.inc("llm_cache_requests_total", result="hit" if hit else "miss")
+
+    def get(self, template, text, model, extra=""):
+        """命中返回缓存的输出文本，否则 None"""
+        output = self._read(template, text, model, extra)
+        self._record(output is not None)
+        return output
+
+    def get_any(self, template, text, models, extra=""):
+        """依次查几个候选模型的缓存，返回 (模型名, 输出)，都没有时返回 (None, None)；只算一次查询"""
+        for model in models:
+            output = self._read(template, text, model, extra)
+            if output is not None:
+                self._record(True)
+                return model, output
+        self._record(False)
+        return None, None
+
+    def put(self, template, text, model, output, extra=""):
+        if not output:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(make_key(template, text, model, extra))
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"model": model, "created": time.time(), "output": output}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        """总大小超过 max_bytes 时从最久未用的条目开始删除，返回删除的条目数"""
+        with self._lock:
+            try:
+                names = [n for n in os.listdir(self.directory) if n.endswith(".json")]
+            except OSError:
+                return 0
+            entries = []
+            total = 0
+            for name in names:
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                total += st.st_size
+                entries.append((st.st_mtime, path, st.st_size))
+
+            removed = 0
+            entries.sort()
+            for _, path, size in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+                total -= size
+            return removed
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# 进程内共享，统计的是整个进程的命中率
+llm_cache = LLMCache()
@@ -0,0 +1,305 @@
+"""
+本地 SQLite 消息库 - app.py 与 daily_report.py 共用
+每个频道/帖子记录已完整抓取的若干段 snowflake 区间 [low, high]（互不相接），
+再次导出时只向 Discord 请求这些区间之外、又在导出范围之内的消息，重叠的时间范围直接读库
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from discord_client import DiscordAPIError, datetime_to_snowflake, iter_message_batches
+from metrics import metrics
+
+STORE_PATH = os.environ.get("MESSAGE_STORE_PATH", os.path.join("data", "message_store.db"))
+# 本机时钟可能比 Discord 快：离现在这么近的区间不凭本机时间记为已覆盖，只记到实际拿到的最新消息
+CLOCK_SKEW_SECONDS = 300
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channels (
+    id INTEGER PRIMARY KEY,
+    parent_id INTEGER,
+    archive_timestamp TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_channels_parent ON channels (parent_id);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    author_id INTEGER,
+    author TEXT,
+    content TEXT,
+    attachments TEXT,
+    reference_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_messages_channel ON messages (channel_id, id);
+CREATE TABLE IF NOT EXISTS sync_ranges (
+    channel_id INTEGER NOT NULL,
+    low INTEGER NOT NULL,
+    high INTEGER NOT NULL,
+    PRIMARY KEY (channel_id, low)
+);
+"""
+
+
+def channel_row(info):
+    meta = info.get("thread_metadata") or {}
+    # 只记录已归档帖子的归档时间，供归档列表增量翻页判断
+    archive_timestamp = meta.get("archive_timestamp") if meta.get("archived") else None
+    return (int(info["id"]), int(info["parent_id"]) if info.get("parent_id") else None,
+            archive_timestamp, json.dumps(info, ensure_ascii=False))
+
+
+def message_row(channel_id, msg):
+    author = msg.get("author") or {}
+    ref = (msg.get("message_reference") or {}).get("message_id")
+    return (
+        int(msg["id"]),
+        int(channel_id),
+        int(author["id"]) if author.get("id") else None,
+        author.get("username", "未知"),
+        msg.get("content", ""),
+        json.dumps([a.get("url", "") for a in msg.get("attachments", [])]),
+        int(ref) if ref else None,
+    )
+
+
+def missing_ranges(ranges, lo, hi):
+    """[lo, hi] 里不在已覆盖区间 ranges（按 low 升序）内的各段，升序"""
+    gaps = []
+    cursor = lo
+    for low, high in ranges:
+        if high < cursor:
+            continue
+        if low > hi:
+            break
+        if low > cursor:
+            gaps.append((cursor, low - 1))
+        cursor = max(cursor, high + 1)
+    if cursor <= hi:
+        gaps.append((cursor, hi))
+    return gaps
+
+
+class MessageRecord:
+    """导出和统计只用到的几个字段；__slots__ 没有实例 dict，几十万条消息常驻内存也不大"""
+
+    __slots__ = ("id", "channel_id", "author_id", "author", "content", "attachments", "reference_id")
+
+    def __init__(self, id, channel_id, author_id, author, content, attachments, reference_id):
+        self.id = id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.author = author
+        self.content = content
+        self.attachments = attachments
+        self.reference_id = reference_id
+
+    def __repr__(self):
+        return f"MessageRecord(id={self.id}, author={self.author!r})"
+
+
+def row_to_message(row):
+    """数据库行 → MessageRecord；同一用户名只保留一份字符串，附件为 URL 元组"""
+    mid, channel_id, author_id, author, content, attachments, ref = row
+    return MessageRecord(
+        mid,
+        channel_id,
+        author_id,
+        sys.intern(author) if author else "未知",
+        content or "",
+        tuple(json.loads(attachments)) if attachments and attachments != "[]" else (),
+        ref,
+    )
+
+
+class MessageStore:
+    """线程安全的消息库，所有操作串行化在一个连接上"""
+
+    def __init__(self, path=STORE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        # 旧版每个频道只记一段区间
+        if self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sync_state'").fetchone():
+            with self._conn:
+                self._conn.execute("INSERT OR IGNORE INTO sync_ranges SELECT channel_id, low, high FROM sync_state")
+                self._conn.execute("DROP TABLE sync_state")
+
+    # ---------- 频道 / 帖子 ----------
+
+    def save_channel(self, info):
+        self.save_threads([info])
+
+    def save_threads(self, threads):
+        """频道/帖子信息批量入库，整服发现时几百条也只开一次事务"""
+        rows = [channel_row(info) for info in threads]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO channels (id, parent_id, archive_timestamp, data) VALUES (?, ?, ?, ?)", rows,
+            )
+
+    def get_channel(self, channel_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM channels WHERE id = ?", (int(channel_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_threads(self, forum_id):
+        """论坛下已知的全部帖子，新帖在前"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM channels WHERE parent_id = ? ORDER BY id DESC", (int(forum_id),)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def latest_archive_timestamp(self, forum_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(archive_timestamp) FROM channels WHERE parent_id = ?", (int(forum_id),)
+            ).fetchone()
+        return row[0] if row else None
+
+    # ---------- 消息 ----------
+
+    def save_messages(self, channel_id, messages):
+        if not messages:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [message_row(channel_id, msg) for msg in messages],
+            )
+
+    def iter_messages(self, channel_id, after=None, before=None, chunk_size=1000):
+        """逐条产出 (after, before) 开区间内的消息，按 id 升序
+
+        按 id 分块查询，每块查完即释放锁，遍历再大的频道也只占一块的内存
+        """
+        cursor = after if after is not None else -1
+        upper = before if before is not None else (1 << 63) - 1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, channel_id, author_id, author, content, attachments, reference_id "
+                    "FROM messages WHERE channel_id = ? AND id > ? AND id < ? ORDER BY id LIMIT ?",
+                    (int(channel_id), cursor, upper, chunk_size),
+                ).fetchall()
+            for row in rows:
+                yield row_to_message(row)
+            if len(rows) < chunk_size:
+                return
+            cursor = rows[-1][0]
+
+    def get_messages(self, channel_id, after=None, before=None):
+        """(after, before) 开区间内的消息列表，按 id 升序"""
+        return list(self.iter_messages(channel_id, after, before))
+
+    def coverage(self, channel_id):
+        """已覆盖区间 [(low, high), ...]，按 low 升序"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT low, high FROM sync_ranges WHERE channel_id = ? ORDER BY low", (int(channel_id),)
+            ).fetchall()
+
+    def add_coverage(self, channel_id, low, high):
+        """记一段已覆盖区间，与重叠或相接的区间合并成一段"""
+        cid = int(channel_id)
+        with self._lock, self._conn:
+            where = "channel_id = ? AND low <= ? AND high >= ?"
+            bounds = (cid, high + 1, low - 1)
+            for l, h in self._conn.execute(f"SELECT low, high FROM sync_ranges WHERE {where}", bounds).fetchall():
+                low, high = min(low, l), max(high, h)
+            self._conn.execute(f"DELETE FROM sync_ranges WHERE {where}", bounds)
+            self._conn.execute("INSERT INTO sync_ranges (channel_id, low, high) VALUES (?, ?, ?)", (cid, low, high))
+
+    def _fetch(self, api_get, channel_id, after, before, on_page=None, newest_first=False, check_cancelled=None):
+        """抓取并逐页入库，返回拿到的最新消息 id（没有消息时为 None）
+
+        on_page(本页最小 id, 本页最大 id) 用于逐页推进已覆盖区间；check_cancelled() 在每页入库后调用
+        """
+        newest = None
+        for batch in iter_message_batches(api_get, channel_id, after, before, newest_first):
+            self.save_messages(channel_id, batch)
+            metrics.inc("discord_pages_fetched_total")
+            metrics.inc("discord_messages_fetched_total", len(batch))
+            if batch:
+                ids = [int(msg["id"]) for msg in batch]
+                newest = max(newest or 0, max(ids))
+                if on_page:
+                    on_page(min(ids), max(ids))
+            if check_cancelled:
+                check_cancelled()
+        return newest
+
+    def sync(self, api_get, channel_id, after=None, before=None, last_message_id=None, check_cancelled=None):
+        """保证 (after, before) 开区间内的消息都已入库
+
+        只抓范围内还没覆盖的各段，不为了连成一段去补范围外的历史：
+        上面接着已覆盖区间的段从上往下翻页，每页都与上面的区间相接；一直到范围上界的最新一段从下往上翻页。
+        每抓完一页就记下已覆盖的部分，进程中途退出后从断开的那一页继续。
+        last_message_id（频道/帖子对象自带）早于最新一段时说明没有新消息，直接跳过请求；
+        这个 id 可能是早先列出时拿到的，跳过时不记为已覆盖，下次不带它时照常补抓。
+        抓取失败时抛 DiscordAPIError，已入库的页保留；check_cancelled() 每抓完一页调用一次，它抛的异常原样向上传。
+        最近 CLOCK_SKEW_SECONDS 内的区间照常抓取，但已覆盖区间只记到实际拿到的最新消息为止。
+        """
+        now = datetime.now()
+        lo = after + 1 if after is not None else 0
+        hi = datetime_to_snowflake(now)
+        if before is not None:
+            hi = min(before - 1, hi)
+        if lo > hi:
+            return
+        settled = datetime_to_snowflake(now - timedelta(seconds=CLOCK_SKEW_SECONDS))
+        last = int(last_message_id) if last_message_id else None
+
+        def covered_high(newest):
+            """最新一段同步之后可以记为已覆盖的上界"""
+            top = min(hi, settled)
+            return max(top, min(newest, hi)) if newest is not None else top
+
+        for a, b in missing_ranges(self.coverage(channel_id), lo, hi):
+            after_id = a - 1 if a > 0 else None
+            if b < hi:
+                # 上面是已覆盖区间：从 b 向前翻页，已覆盖 [本页最小 id, b]
+                self._fetch(api_get, channel_id, after_id, b + 1,
+                            lambda first, last_id, b=b: self.add_coverage(channel_id, first, b),
+                            newest_first=True, check_cancelled=check_cancelled)
+                self.add_coverage(channel_id, a, b)
+                continue
+            if last is not None and last < a:
+                continue
+            if a > 0:
+                # 从 a 向后翻页，已覆盖 [a, 本页最大 id]
+                on_page = lambda first, last_id: self.add_coverage(channel_id, a, last_id)
+            else:
+                # 从 hi 向前翻页，第一页就是最新的消息，已覆盖 [本页最小 id, 第一页最大 id]
+                top = []
+
+                def on_page(first, last_id):
+                    if not top:
+                        top.append(covered_high(last_id))
+                    self.add_coverage(channel_id, first, top[0])
+            newest = self._fetch(api_get, channel_id, after_id, hi + 1, on_page, check_cancelled=check_cancelled)
+            if covered_high(newest) >= a:
+                self.add_coverage(channel_id, a, covered_high(newest))
+
+    def try_sync(self, api_get, channel_id, after=None, before=None, last_message_id=None, check_cancelled=None):
+        """sync 的容错版本：Discord 拒绝访问时保留库里已有的数据，返回是否同步成功"""
+        try:
+            self.sync(api_get, channel_id, after, before, last_message_id, check_cancelled)
+            return True
+        except DiscordAPIError:
+            return False
+
+    def load_messages(self, api_get, channel_id, after=None, before=None, last_message_id=None):
+        """先增量同步再读库，返回 (消息列表, 是否同步成功)；同步失败时只有库里已有的消息"""
+        ok = self.try_sync(api_get, channel_id, after, before, last_message_id)
+        return self.get_messages(channel_id, after, before), ok
@@ -0,0 +1,143 @@
+"""
+运行指标 - app.py 与 daily_report.py 共用
+记录 Discord 请求数/字节数/耗时、速率限制等待、写文件和大模型调用耗时、各阶段耗时；
+Flask 端以 Prometheus 文本格式暴露（/api/metrics），daily_report 结束时打印 JSON 汇总
+指标只在本进程内累计，gunicorn 多 worker 时每个 worker 各自一份
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+# Discord / 大模型单次请求耗时的分桶上限（秒）
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 整个阶段（抓取、写文件、摘要）耗时的分桶上限（秒）
+STAGE_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800)
+
+# 名称 → (类型, 说明, 分桶)
+DEFINITIONS = {
+    "discord_requests_total": ("counter", "Discord API 请求数", None),
+    "discord_response_bytes_total": ("counter", "Discord API 响应体字节数（解压后）", None),
+    "discord_request_duration_seconds": ("histogram", "Discord API 单次请求耗时", LATENCY_BUCKETS),
+    "discord_rate_limited_total": ("counter", "Discord 返回 429 的次数", None),
+    "discord_rate_limit_wait_seconds_total": ("counter", "请求前为速率限制等待的总秒数", None),
+    "discord_pages_fetched_total": ("counter", "抓取的消息页数", None),
+    "discord_messages_fetched_total": ("counter", "抓取并入库的消息条数", None),
+    "export_messages_total": ("counter", "写入导出文件的消息条数", None),
+    "export_write_seconds_total": ("counter", "各 writer 写文件的总秒数", None),
+    "attachment_downloads_total": ("counter", "归档的附件数（downloaded / reused / failed）", None),
+    "attachment_bytes_downloaded_total": ("counter", "下载附件的字节数", None),
+    "llm_requests_total": ("counter", "大模型请求数（按结果）", None),
+    "llm_request_duration_seconds": ("histogram", "大模型单次请求耗时", LATENCY_BUCKETS),
+    "llm_retry_wait_seconds_total": ("counter", "大模型限流/不可用时退避等待的总秒数", None),
+    "llm_cache_requests_total": ("counter", "大模型缓存查询次数（hit / miss）", None),
+    "stage_duration_seconds": ("histogram", "各阶段耗时", STAGE_BUCKETS),
+}
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in pairs) + "}"
+
+
+def format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metrics:
+    """线程安全的计数器与直方图；标签组合很少，一把锁就够"""
+
+    def __init__(self, definitions=DEFINITIONS):
+        self.definitions = definitions
+        self._lock = threading.Lock()
+        self._values = {name: {} for name in definitions}
+
+    def inc(self, name, value=1, **labels):
+        key = label_key(labels)
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = self.definitions[name][2]
+        key = label_key(labels)
+        with self._lock:
+            h = self._values[name].get(key)
+            if h is None:
+                h = self._values[name][key] = {"buckets": [0] * len(buckets), "count": 0, "sum": 0.0, "max": 0.0}
+            for i, upper in enumerate(buckets):
+                if value <= upper:
+                    h["buckets"][i] += 1
+                    break
+            h["count"] += 1
+            h["sum"] += value
+            h["max"] = max(h["max"], value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """记录 with 块的耗时；块内抛异常也照样记录"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def stage(self, stage):
+        return self.timer("stage_duration_seconds", stage=stage)
+
+    def render_prometheus(self):
+        """Prometheus 文本格式（0.0.4）"""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets) in self.definitions.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(self._values[name].items()):
+                    if kind == "counter":
+                        lines.append(f"{name}{format_labels(key)} {format_value(value)}")
+                        continue
+                    cumulative = 0
+                    for upper, count in zip(buckets, value["buckets"]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(key, [('le', upper)])} {cumulative}")
+                    lines.append(f"{name}_bucket{format_labels(key, [('le', '+Inf')])} {value['count']}")
+                    lines.append(f"{name}_sum{format_labels(key)} {format_value(value['sum'])}")
+                    lines.append(f"{name}_count{format_labels(key)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """JSON 友好的汇总：{指标名: {"标签=值,...": 数值或 {count, sum, avg, max}}}，没有数据的指标不列出"""
+        out = {}
+        with self._lock:
+            for name, (kind, _, _) in self.definitions.items():
+                series = {}
+                for key, value in sorted(self._values[name].items()):
+                    label = ",".join(f"{k}={v}" for k, v in key) or "total"
+                    if kind == "counter":
+                        series[label] = round(value, 3)
+                    else:
+                        series[label] = {
+                            "count": value["count"],
+                            "sum": round(value["sum"], 3),
+                            "avg": round(value["sum"] / value["count"], 3),
+                            "max": round(value["max"], 3),
+                        }
+                if series:
+                    out[name] = series
+        return out
+
+
+# 进程内共享
+metrics = Metrics()
@@ -0,0 +1,138 @@
+"""
+周报的按天分区 - daily_report.py 用
+每个自然日一个 JSON 文件：当天的消息数、发言人计数、涉及的频道/帖子，以及按频道/帖子切好的消息片段。
+过去的日子数据不再变化，分区生成一次即可；日报/周报/月报都只需合并最近 N 天的分区，不必重新抓取和统计
+"""
+
+import json
+import os
+import sys
+from collections import Counter
+from datetime import datetime, timedelta
+
+from discord_client import DISCORD_EPOCH
+from message_store import MessageRecord
+
+PARTITION_DIR = os.environ.get("REPORT_PARTITION_DIR", os.path.join("data", "daily"))
+# 分区里保留创建时间在这么多天以内的帖子，合并时再按报告起始日期筛掉更早的帖子，因此报告最长 31 天
+THREAD_LOOKBACK_DAYS = 31
+# 分区格式变了就加一，旧分区会被当作缺失重新生成
+VERSION = 1
+
+
+def day_bounds(day):
+    """自然日 → (00:00:00, 23:59:59.999)，与 export 的闭区间 date_to 一致"""
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1) - timedelta(milliseconds=1)
+
+
+def snowflake_datetime(sid):
+    return datetime.fromtimestamp(((int(sid) >> 22) + DISCORD_EPOCH) / 1000)
+
+
+def key_id(key):
+    """片段键 thread:ID / channel:ID → ID"""
+    return int(key.split(":", 1)[1])
+
+
+def split_by_day(sections, days):
+    """把一段多天的 [(键, 频道ID, 标题, 消息)] 按消息日期拆成 {日期: sections}，只保留 days 里的日期"""
+    wanted = set(days)
+    by_day = {}
+    for key, parent, header, msgs in sections:
+        buckets = {}
+        for m in msgs:
+            day = snowflake_datetime(m.id).date()
+            if day in wanted:
+                buckets.setdefault(day, []).append(m)
+        for day, day_msgs in buckets.items():
+            by_day.setdefault(day, []).append((key, parent, header, day_msgs))
+    return by_day
+
+
+def build_partition(day, urls, sections):
+    """一天的 sections → 分区 dict；每个片段带自己的发言人计数，合并时筛掉片段后计数仍然准确"""
+    out = []
+    author_counts = Counter()
+    for key, parent, header, msgs in sections:
+        counts = Counter(m.author for m in msgs)
+        author_counts.update(counts)
+        out.append({
+            "key": key,
+            "parent": parent,
+            "header": header,
+            "author_counts": dict(counts),
+            "messages": [[m.id, m.author, m.content, m.reference_id] for m in msgs],
+        })
+    return {
+        "version": VERSION,
+        "date": day.isoformat(),
+        "urls": sorted(urls),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "total_messages": sum(author_counts.values()),
+        "author_counts": dict(author_counts),
+        "covered_items": [s["key"] for s in out],
+        "sections": out,
+    }
+
+
+def merge_partitions(partitions, window_start):
+    """合并若干天的分区 → (sections, 发言人计数, 消息总数)
+
+    论坛帖子只保留创建时间不早于 window_start 的，与直接导出整段时间的结果一致；
+    同一频道/帖子跨天的片段首尾相接（消息仍按 id 升序），频道按最近一天的顺序，论坛内新帖在前
+    """
+    merged = {}
+    author_counts = Counter()
+    rank = {}
+    for p in reversed(partitions):
+        for s in p["sections"]:
+            rank.setdefault(s["parent"], len(rank))
+    for p in partitions:
+        for s in p["sections"]:
+            key = s["key"]
+            if key.startswith("thread:") and snowflake_datetime(key_id(key)) < window_start:
+                continue
+            author_counts.update(s["author_counts"])
+            msgs = [MessageRecord(mid, key_id(key), None, sys.intern(author), content, (), ref)
+                    for mid, author, content, ref in s["messages"]]
+            if key in merged:
+                merged[key][3].extend(msgs)
+            else:
+                merged[key] = (key, s["parent"], s["header"], msgs)
+
+    def order(section):
+        key, parent = section[0], section[1]
+        return rank.get(parent, len(rank)), -key_id(key) if key.startswith("thread:") else 0
+
+    sections = sorted(merged.values(), key=order)
+    return sections, author_counts, sum(author_counts.values())
+
+
+class PartitionStore:
+    """每天一个 JSON 文件，写入用临时文件替换"""
+
+    def __init__(self, directory=PARTITION_DIR):
+        self.directory = directory
+
+    def _path(self, day):
+        return os.path.join(self.directory, f"{day.isoformat()}.json")
+
+    def get(self, day, urls):
+        """读出某天的分区；不存在、格式过旧或频道列表不同时返回 None"""
+        try:
+            with open(self._path(day), "r", encoding="utf-8") as f:
+                partition = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if partition.get("version") != VERSION or partition.get("urls") != sorted(urls):
+            return None
+        return partition
+
+    def put(self, partition):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{partition['date']}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(partition, f, ensure_ascii=False)
+        os.replace(tmp, path)
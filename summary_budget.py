@@ -0,0 +1,148 @@
+"""
+摘要输入的 token 预算 - 按重要度挑选消息装进模型上下文
+中日韩文字大约一字一个 token，英文大约四个字符一个 token，按字符数估算会严重偏差；
+超出预算时给每条消息打分（回复深度、被回复数、长度、链接、发言人多样性、帖子热度），
+从高分开始装，保留的消息仍按原顺序输出，省略处留标记
+"""
+
+import math
+import re
+from collections import Counter
+
+# 中日韩表意文字、假名、谚文及全角标点
+CJK_RE = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+LINK_RE = re.compile(r"https?://")
+
+# 各信号的权重
+W_LENGTH = 1.0
+W_REPLIES = 1.5
+W_DEPTH = 0.5
+W_LINK = 1.5
+W_RARE_AUTHOR = 1.0
+W_THREAD_ACTIVITY = 1.0
+W_THREAD_DIVERSITY = 1.0
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    cjk = len(CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def message_line(msg):
+    return f"{msg.author}: {msg.content}"
+
+
+def render_sections(sections):
+    """[(标题, [MessageRecord...])] → 送给模型的纯文本，格式与导出 TXT 的 AI 版一致"""
+    return "\n\n".join(
+        "\n".join([header] + [message_line(m) for m in msgs]) for header, msgs in sections
+    )
+
+
+def score_messages(sections):
+    """一次遍历收集各列特征，再逐列算分；返回与消息一一对应的 (分数, token 数) 列表"""
+    authors, tokens, replies_to, has_link, empty, section_of = [], [], [], [], [], []
+    section_sizes, section_authors = [], []
+    depth = {}
+    for s, (_, msgs) in enumerate(sections):
+        section_sizes.append(len(msgs))
+        section_authors.append(len({m.author for m in msgs}))
+        for m in msgs:
+            ref = m.reference_id
+            # 消息按 id 升序，被回复的消息一定先出现
+            depth[m.id] = depth.get(ref, 0) + 1 if ref else 0
+            authors.append(m.author)
+            tokens.append(estimate_tokens(message_line(m)) + 1)
+            replies_to.append(ref)
+            has_link.append(bool(LINK_RE.search(m.content)))
+            empty.append(not m.content.strip())
+            section_of.append(s)
+
+    reply_counts = Counter(r for r in replies_to if r)
+    author_counts = Counter(authors)
+    ids = [m.id for _, msgs in sections for m in msgs]
+    max_size = max(section_sizes, default=1) or 1
+
+    scores = []
+    for i, mid in enumerate(ids):
+        s = section_of[i]
+        score = (
+            W_LENGTH * math.log1p(tokens[i])
+            + W_REPLIES * math.log1p(reply_counts[mid])
+            + W_DEPTH * min(depth[mid], 5)
+            + W_LINK * has_link[i]
+            + W_RARE_AUTHOR / math.sqrt(author_counts[authors[i]])
+            + W_THREAD_ACTIVITY * math.log1p(section_sizes[s]) / math.log1p(max_size)
+            + W_THREAD_DIVERSITY * section_authors[s] / section_sizes[s]
+        )
+        # 只有附件没有文字的消息对摘要没有信息量
+        if empty[i]:
+            score = 0.0
+        scores.append((score, tokens[i]))
+    return scores
+
+
+def pack(sections, scores, limit):
+    """按分数从高到低装入，直到 token 数达到 limit；返回保留的消息下标集合"""
+    header_tokens = [estimate_tokens(header) + 2 for header, _ in sections]
+    section_of = [s for s, (_, msgs) in enumerate(sections) for _ in msgs]
+    keep = set()
+    opened = set()
+    used = 0
+    for i in sorted(range(len(scores)), key=lambda i: -scores[i][0]):
+        cost = scores[i][1]
+        s = section_of[i]
+        if s not in opened:
+            # 第一条入选的消息要连同帖子标题一起算
+            cost += header_tokens[s]
+        if used + cost > limit:
+            continue
+        used += cost
+        keep.add(i)
+        opened.add(s)
+    return keep
+
+
+def render_selected(sections, keep):
+    blocks = []
+    i = 0
+    for header, msgs in sections:
+        lines = [header]
+        skipped = 0
+        for m in msgs:
+            if i in keep:
+                if skipped:
+                    lines.append(f"[...省略 {skipped} 条...]")
+                    skipped = 0
+                lines.append(message_line(m))
+            else:
+                skipped += 1
+            i += 1
+        if len(lines) == 1:
+            continue
+        if skipped:
+            lines.append(f"[...省略 {skipped} 条...]")
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+def select_messages(sections, token_budget):
+    """按重要度把消息装进 token_budget，返回 (文本, 保留条数, 总条数)"""
+    total = sum(len(msgs) for _, msgs in sections)
+    full_text = render_sections(sections)
+    if estimate_tokens(full_text) <= token_budget:
+        return full_text, total, total
+
+    scores = score_messages(sections)
+    limit = token_budget
+    # 省略标记也占 token，超出时按超出量收紧再装一次
+    for _ in range(5):
+        keep = pack(sections, scores, limit)
+        text = render_selected(sections, keep)
+        over = estimate_tokens(text) - token_budget
+        if over <= 0:
+            break
+        limit -= over
+    return text, len(keep), total